@@ -228,6 +228,18 @@ final class HomeViewModel: ObservableObject {
                 currentNote.hasBeenScanned = true
                 isLoading = true
 
+                // cache hits are answered right away, with the result inline
+                if res.status == "completed", let result = res.result {
+                    if let task_id = res.task_id {
+                        currentNote.mostRecentOCRTaskId = task_id
+                    }
+                    self.selectedNote.scannedCode = result
+                    self.editorIsPresented = true
+                    self.isLoading = false
+                    self.saveNotes()
+                    return
+                }
+
                 if res.status != "processing" {
                     print("error with server since status is not processing")
                     throw URLError(.badServerResponse)
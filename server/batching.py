@@ -0,0 +1,107 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BatchResult:
+    output: Any
+    batch_size: int
+    batch_latency: float
+
+
+class MicroBatcher:
+    """
+    Collects requests submitted from concurrent Celery task threads and runs
+    them through `run_batch` together. A batch is closed when it reaches
+    `max_batch_size` or when `max_wait_ms` has passed since its first request.
+    A batch that raises is rerun one request at a time, so only the requests
+    that fail on their own get the exception.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[list], list],
+        max_batch_size: int = 4,
+        max_wait_ms: int = 50,
+        on_batch: Optional[Callable[[int, float], None]] = None,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0, max_wait_ms) / 1000
+        self.on_batch = on_batch
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, item) -> Future:
+        future: Future = Future()
+        self._ensure_started()
+        self._queue.put((item, future))
+        return future
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._loop, name="ocr-batcher", daemon=True
+                )
+                self._thread.start()
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._run(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    logger.error(f"Batch of 1 failed: {e}")
+                    batch[0][1].set_exception(e)
+                    continue
+                # one bad request should not fail the others it was batched with
+                logger.warning(
+                    f"Batch of {len(batch)} failed, retrying one at a time: {e}"
+                )
+                for request in batch:
+                    try:
+                        self._run([request])
+                    except Exception as request_error:
+                        logger.error(f"Batch of 1 failed: {request_error}")
+                        request[1].set_exception(request_error)
+
+    def _run(self, batch: list):
+        items = [item for item, _ in batch]
+        futures = [future for _, future in batch]
+
+        start_time = time.time()
+        outputs = self.run_batch(items)
+        latency = time.time() - start_time
+
+        logger.info(f"Ran batch of {len(batch)} in {latency:.2f}s")
+        if self.on_batch:
+            try:
+                self.on_batch(len(batch), latency)
+            except Exception as e:
+                logger.warning(f"Could not record batch stats: {e}")
+
+        for future, output in zip(futures, outputs):
+            future.set_result(BatchResult(output, len(batch), latency))
@@ -0,0 +1,58 @@
+"""
+Import time and peak RSS of the API module against the worker module, each
+measured in a fresh interpreter. Before the split the API imported what
+`tasks` imports now, so the `tasks` row is the old API footprint.
+
+    python benchmarks/bench_api_import.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": elapsed,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "torch": "torch" in sys.modules,
+    "transformers": "transformers" in sys.modules,
+}}))
+"""
+
+
+def measure(module: str, runs: int = 3) -> dict:
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module)],
+            cwd=SERVER_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        samples.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    return min(samples, key=lambda sample: sample["seconds"])
+
+
+def main():
+    print(
+        f"{'module':<8} {'import s':>9} {'max RSS MB':>11} {'torch':>6}"
+        f" {'transformers':>13}"
+    )
+    for module in ("main", "tasks"):
+        stats = measure(module)
+        print(
+            f"{module:<8} {stats['seconds']:>9.2f} {stats['max_rss_mb']:>11.1f}"
+            f" {str(stats['torch']):>6} {str(stats['transformers']):>13}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Decoding throughput of each OCR_ASSISTED mode against plain greedy decoding
+on the same images, and whether every assisted transcription is identical to
+the greedy one. Uses the images in --data, or a rendered sample without it.
+
+    python benchmarks/bench_assisted.py --modes off,prompt_lookup,draft
+    python benchmarks/bench_assisted.py --data eval/handwriting --max-tokens 512
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import imaging  # noqa: E402
+import tasks  # noqa: E402
+from bench_prefix_cache import sample_image  # noqa: E402
+from eval_precision import IMAGE_EXTENSIONS  # noqa: E402
+
+
+def load_images(data_dir) -> list[Image.Image]:
+    if not data_dir:
+        return [sample_image()]
+    return [
+        Image.open(os.path.join(data_dir, name))
+        for name in sorted(os.listdir(data_dir))
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+    ]
+
+
+def run_mode(mode: str, images: list[Image.Image], max_tokens: int):
+    tasks.ocrAssisted = mode
+    if mode == "draft" and tasks.draft_model is None:
+        tasks.load_draft_model(next(tasks.model.parameters()).dtype)
+
+    # warm-up, so the first mode does not pay for lazy initialisation
+    tasks.run_ocr_batch([tasks.OCRJob(images[0], max_tokens)])
+
+    outputs = []
+    tokens = 0
+    start = time.perf_counter()
+    for image in images:
+        output = tasks.run_ocr_batch([tasks.OCRJob(image, max_tokens)])[0].text
+        tokens += len(tasks.tokenizer.encode(output, add_special_tokens=False))
+        outputs.append(output)
+    return outputs, tokens / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", default="off,prompt_lookup")
+    parser.add_argument("--data", help="directory of drawings to transcribe")
+    parser.add_argument("--max-tokens", type=int, default=256)
+    args = parser.parse_args()
+
+    tasks.load_model()
+    images = [
+        imaging.preprocess_for_ocr(
+            image.convert("RGB"),
+            factor=tasks.patch_factor(),
+            min_tokens=tasks.ocrMinVisualTokens,
+            max_tokens=tasks.max_visual_tokens(),
+        )[0]
+        for image in load_images(args.data)
+    ]
+
+    # greedy decoding runs first, it is what the others are compared to
+    modes = ["off"] + [mode for mode in args.modes.split(",") if mode != "off"]
+
+    greedy = None
+    print(f"{'mode':<14} {'tok/s':>8} {'speedup':>8} {'identical':>10}")
+    for mode in modes:
+        outputs, tokens_per_second = run_mode(mode, images, args.max_tokens)
+        if greedy is None:
+            greedy = (outputs, tokens_per_second)
+        identical = sum(a == b for a, b in zip(outputs, greedy[0]))
+        print(
+            f"{mode:<14} {tokens_per_second:>8.2f}"
+            f" {tokens_per_second / greedy[1]:>7.2f}x"
+            f" {identical:>5}/{len(images)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Compares enqueueing OCR images base64-encoded inside the Celery message with
+enqueueing a blob-store reference. Messages go to a throwaway queue that no
+worker consumes, so broker memory can be read while they sit there. Memory
+covers both Redis instances; with OCR_BLOB_BACKEND=shm the blobs live in
+OCR_BLOB_DIR instead and only the message overhead shows up.
+
+    python benchmarks/bench_blob_transport.py --count 50
+"""
+
+import argparse
+import base64
+import os
+import statistics
+import sys
+import time
+from os import getenv
+
+import redis
+from celery import Celery
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import blob_store  # noqa: E402
+
+BENCH_QUEUE = "bench_blob_transport"
+SIZES = [100 * 1024, 500 * 1024, 1024 * 1024, 2 * 1024 * 1024, 5 * 1024 * 1024]
+
+
+def used_memory(client) -> int:
+    return int(client.info("memory")["used_memory"])
+
+
+def redis_memory(broker, store) -> int:
+    # used_memory is per server, so two databases on one server count once
+    server = lambda c: (  # noqa: E731
+        c.connection_pool.connection_kwargs.get("host"),
+        c.connection_pool.connection_kwargs.get("port"),
+    )
+    if server(broker) == server(store):
+        return used_memory(broker)
+    return used_memory(broker) + used_memory(store)
+
+
+def run(celeryApp, broker, store, size: int, count: int, transport: str):
+    payload = os.urandom(size)
+    broker.delete(BENCH_QUEUE)
+    before = redis_memory(broker, store)
+
+    latencies = []
+    refs = []
+    for _ in range(count):
+        start = time.perf_counter()
+        if transport == "base64":
+            arg = base64.b64encode(payload).decode("utf-8")
+        else:
+            arg = blob_store.put(store, payload)
+            refs.append(arg)
+        celeryApp.send_task(
+            "ocr_service.process_ocr", args=(arg, 256), queue=BENCH_QUEUE
+        )
+        latencies.append(time.perf_counter() - start)
+
+    after = redis_memory(broker, store)
+    broker.delete(BENCH_QUEUE)
+    for ref in refs:
+        blob_store.delete(store, ref)
+
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "memory_mb": (after - before) / (1024 * 1024),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=50)
+    args = parser.parse_args()
+
+    load_dotenv()
+    redisCeleryURL = getenv("REDIS_URL_CELERY")
+    celeryApp = Celery("bench", broker=redisCeleryURL)
+    celeryApp.conf.update(task_serializer="json")
+    broker = redis.from_url(redisCeleryURL)
+    store = redis.from_url(getenv("REDIS_URL_OCR"))
+
+    print(
+        f"{'size':>8} {'transport':>10} {'p50 ms':>8} {'p95 ms':>8}"
+        f" {'memory MB':>10}"
+    )
+    for size in SIZES:
+        for transport in ("base64", "blob"):
+            stats = run(celeryApp, broker, store, size, args.count, transport)
+            print(
+                f"{size // 1024:>6}KB {transport:>10} {stats['p50_ms']:>8.2f}"
+                f" {stats['p95_ms']:>8.2f} {stats['memory_mb']:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
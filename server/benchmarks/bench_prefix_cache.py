@@ -0,0 +1,91 @@
+"""
+Time to first token of one OCR request with and without reusing the cached
+KV of the text prompt prefix. Each request asks for a single new token, so
+its latency is the prefill plus one decoding step. Meant to be run on a CPU
+host with the worker's dependencies installed.
+
+    python benchmarks/bench_prefix_cache.py --runs 10
+    python benchmarks/bench_prefix_cache.py --image drawing.png
+    OCR_PROMPT_TEXT_FIRST=1 python benchmarks/bench_prefix_cache.py
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import imaging  # noqa: E402
+import tasks  # noqa: E402
+
+SAMPLE_CODE = """public class Main {
+    public static void main(String[] args) {
+        for (int i = 0; i < 10; i++) {
+            System.out.println(i * i);
+        }
+    }
+}"""
+
+
+def sample_image() -> Image.Image:
+    image = Image.new("RGB", (1200, 700), "white")
+    draw = ImageDraw.Draw(image)
+    for row, line in enumerate(SAMPLE_CODE.splitlines()):
+        draw.text((40, 40 + row * 80), line, fill="black", font_size=48)
+    return image
+
+
+def time_to_first_token(
+    image: Image.Image, use_prefix: bool, runs: int
+) -> list[float]:
+    tasks.ocrPrefixCache = use_prefix
+    job = tasks.OCRJob(image, maxNewTokens=1)
+    # the first call builds the prefix cache and warms the kernels
+    tasks.run_ocr_batch([job])
+
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        tasks.run_ocr_batch([job])
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--image", help="drawing to use instead of a rendered one")
+    args = parser.parse_args()
+
+    tasks.load_model()
+    image = Image.open(args.image) if args.image else sample_image()
+    image, stats = imaging.preprocess_for_ocr(
+        image,
+        tasks.patch_factor(),
+        tasks.ocrMinVisualTokens,
+        tasks.max_visual_tokens(),
+        tasks.ocrBinarize,
+        tasks.ocrDenoise,
+    )
+    prefix_cache = tasks.get_prefix_cache()
+    prefix_cache.build()
+    print(
+        f"device={tasks.device} visual_tokens={stats['visual_tokens']}"
+        f" prefix_tokens={prefix_cache.prefix_ids.shape[1]}"
+    )
+
+    print(f"{'prefix cache':<14} {'p50 ms':>9} {'min ms':>9}")
+    for use_prefix in (False, True):
+        samples = time_to_first_token(image, use_prefix, args.runs)
+        print(
+            f"{'on' if use_prefix else 'off':<14}"
+            f" {statistics.median(samples) * 1000:>9.1f}"
+            f" {min(samples) * 1000:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
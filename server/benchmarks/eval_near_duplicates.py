@@ -0,0 +1,119 @@
+"""
+Checks whether an OCR_HASH_MAX_DISTANCE is safe for a grid size. Each program
+is rendered, then rendered again with one-glyph edits (which must never match,
+they would be answered with the old code) and passed through harmless changes
+(JPEG re-encode, a small shift, a rescale, which near-duplicate matching is
+meant to catch). A threshold is only safe below the smallest edit distance;
+it is only useful if it also covers the harmless changes.
+
+    python benchmarks/eval_near_duplicates.py --grids 32,64,128
+    python benchmarks/eval_near_duplicates.py --source Main.java --font-size 40
+"""
+
+import argparse
+import importlib
+import io
+import os
+import sys
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ocr_cache  # noqa: E402
+
+SAMPLE_CODE = """public class Main {
+    public static void main(String[] args) {
+        int x = 10;
+        for (int i = 0; i < x; i++) {
+            System.out.println(i * 2);
+        }
+    }
+}"""
+
+# (old, new) one-glyph edits, each applied where it first occurs
+EDITS = [
+    ("10", "19"),
+    ("* 2", "* 3"),
+    ("int x", "int y"),
+    ("< x", "<= x"),
+    ("i++", "i--"),
+    ("(i", "(j"),
+]
+
+
+def render(code: str, font_size: int, shift: int = 0) -> Image.Image:
+    lines = code.splitlines()
+    line_height = int(font_size * 1.5)
+    width = max(len(line) for line in lines) * font_size + 80
+    image = Image.new("L", (width, len(lines) * line_height + 80), "white")
+    draw = ImageDraw.Draw(image)
+    for row, line in enumerate(lines):
+        draw.text(
+            (40 + shift, 40 + shift + row * line_height),
+            line,
+            fill="black",
+            font_size=font_size,
+        )
+    return image
+
+
+def reencode(image: Image.Image) -> Image.Image:
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=70)
+    return Image.open(io.BytesIO(buffer.getvalue()))
+
+
+def distances(code: str, font_size: int) -> tuple[list[int], list[int]]:
+    original = render(code, font_size)
+    phash = ocr_cache.ink_hash(original.copy())
+
+    edited = [
+        ocr_cache.ink_hash(render(code.replace(old, new, 1), font_size))
+        for old, new in EDITS
+        if old in code
+    ]
+    harmless = [
+        ocr_cache.ink_hash(reencode(original)),
+        ocr_cache.ink_hash(render(code, font_size, shift=3)),
+        ocr_cache.ink_hash(
+            original.resize((original.width * 9 // 10, original.height * 9 // 10))
+        ),
+    ]
+    return (
+        [(phash ^ other).bit_count() for other in edited],
+        [(phash ^ other).bit_count() for other in harmless],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--grids", default="32,64,128,256")
+    parser.add_argument("--font-size", type=int, default=40)
+    parser.add_argument(
+        "--source", action="append", help="program to use instead of the sample"
+    )
+    args = parser.parse_args()
+
+    programs = [SAMPLE_CODE]
+    if args.source:
+        programs = []
+        for path in args.source:
+            with open(path) as f:
+                programs.append(f.read())
+
+    print(f"{'grid':>5} {'min edit':>9} {'max harmless':>13} {'safe below':>11}")
+    for grid in args.grids.split(","):
+        os.environ["OCR_HASH_GRID"] = grid
+        importlib.reload(ocr_cache)
+        edits, harmless = [], []
+        for code in programs:
+            program_edits, program_harmless = distances(code, args.font_size)
+            edits += program_edits
+            harmless += program_harmless
+        safe = min(edits) if edits else 0
+        verdict = "" if max(harmless) < safe else "  (no threshold separates them)"
+        print(f"{grid:>5} {min(edits):>9} {max(harmless):>13} {safe:>11}{verdict}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Runs a fixed set of handwritten-code images through the OCR model in each
+OCR_PRECISION mode and reports character error rate, decoding throughput and
+peak RSS, then names the fastest mode whose CER stays within --budget of fp32.
+Every mode runs in its own interpreter so RSS and load state do not leak
+between them. --prompt-orders also runs each mode with the instruction before
+the image (OCR_PROMPT_TEXT_FIRST=1), against the same fp32 baseline.
+
+The data directory holds images (png/jpg) next to a .txt file of the same
+name with the expected source code:
+
+    python benchmarks/eval_precision.py --data eval/handwriting --budget 0.02
+    python benchmarks/eval_precision.py --data eval/handwriting --modes fp32 --prompt-orders
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def levenshtein(a: str, b: str) -> int:
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (char_a != char_b),
+                )
+            )
+        previous = current
+    return previous[-1]
+
+
+def normalize(text: str) -> str:
+    # trailing whitespace is invisible in a drawing, so it is not an error
+    return "\n".join(line.rstrip() for line in text.strip().splitlines())
+
+
+def load_samples(data_dir: str) -> list[tuple[str, str]]:
+    samples = []
+    for name in sorted(os.listdir(data_dir)):
+        stem, extension = os.path.splitext(name)
+        truth_path = os.path.join(data_dir, f"{stem}.txt")
+        if extension.lower() in IMAGE_EXTENSIONS and os.path.exists(truth_path):
+            with open(truth_path) as f:
+                samples.append((os.path.join(data_dir, name), f.read()))
+    return samples
+
+
+def evaluate(data_dir: str, max_tokens: int) -> dict:
+    """
+    Runs in the child interpreter, with OCR_PRECISION already set
+    """
+    sys.path.insert(0, SERVER_DIR)
+    from PIL import Image
+
+    import imaging
+    import tasks
+
+    tasks.load_model()
+    samples = load_samples(data_dir)
+
+    def transcribe(path: str) -> str:
+        image, _ = imaging.preprocess_for_ocr(
+            Image.open(path),
+            factor=tasks.patch_factor(),
+            min_tokens=tasks.ocrMinVisualTokens,
+            max_tokens=tasks.max_visual_tokens(),
+            binarize=tasks.ocrBinarize,
+            denoise=tasks.ocrDenoise,
+        )
+        return tasks.run_ocr_batch([tasks.OCRJob(image, max_tokens)])[0].text
+
+    # kernels and the prefix cache warm up on the first image
+    transcribe(samples[0][0])
+
+    errors = characters = tokens = 0
+    seconds = 0.0
+    for path, truth in samples:
+        start = time.perf_counter()
+        output = transcribe(path)
+        seconds += time.perf_counter() - start
+        tokens += len(tasks.tokenizer.encode(output, add_special_tokens=False))
+        errors += levenshtein(normalize(output), normalize(truth))
+        characters += len(normalize(truth))
+
+    return {
+        "samples": len(samples),
+        "cer": errors / max(characters, 1),
+        "tokens_per_second": tokens / seconds if seconds else 0.0,
+        "seconds_per_image": seconds / len(samples),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_mode(mode: str, data_dir: str, max_tokens: int, text_first: bool) -> dict:
+    output = subprocess.run(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--child",
+            "--data",
+            data_dir,
+            "--max-tokens",
+            str(max_tokens),
+        ],
+        cwd=SERVER_DIR,
+        env={
+            **os.environ,
+            "OCR_PRECISION": mode,
+            "OCR_PROMPT_TEXT_FIRST": "1" if text_first else "0",
+        },
+        capture_output=True,
+        text=True,
+    )
+    if output.returncode != 0:
+        return {"error": output.stderr.strip().splitlines()[-1:]}
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", required=True, help="images with .txt truths")
+    parser.add_argument("--modes", default="fp32,bf16,int8")
+    parser.add_argument("--max-tokens", type=int, default=512)
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=0.02,
+        help="largest CER increase over fp32 a mode may have",
+    )
+    parser.add_argument(
+        "--prompt-orders",
+        action="store_true",
+        help="also run every mode with the instruction before the image",
+    )
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(evaluate(args.data, args.max_tokens)))
+        return
+
+    if not load_samples(args.data):
+        sys.exit(f"No images with matching .txt files in {args.data}")
+
+    modes = args.modes.split(",")
+    if "fp32" not in modes:
+        modes.insert(0, "fp32")
+
+    runs = [(mode, False) for mode in modes]
+    if args.prompt_orders:
+        runs += [(mode, True) for mode in modes]
+
+    results = {}
+    print(f"{'mode':<16} {'CER':>7} {'tok/s':>8} {'s/image':>8} {'peak RSS MB':>12}")
+    for mode, text_first in runs:
+        name = f"{mode}/text-first" if text_first else mode
+        result = results[name] = run_mode(mode, args.data, args.max_tokens, text_first)
+        if "error" in result:
+            print(f"{name:<16} failed: {result['error']}")
+            continue
+        print(
+            f"{name:<16} {result['cer']:>7.3f} {result['tokens_per_second']:>8.2f}"
+            f" {result['seconds_per_image']:>8.2f} {result['peak_rss_mb']:>12.0f}"
+        )
+
+    baseline = results["fp32"].get("cer")
+    if baseline is None:
+        sys.exit("fp32 failed, there is no baseline to compare against")
+    within_budget = [
+        mode
+        for mode, result in results.items()
+        if "error" not in result and result["cer"] - baseline <= args.budget
+    ]
+    fastest = max(within_budget, key=lambda m: results[m]["tokens_per_second"])
+    print(f"\nFastest mode within {args.budget:.3f} CER of fp32: {fastest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Holds many idle SSE streams open against a running API and samples /health
+latency while they are open, to check one process keeps serving requests
+while it carries hundreds of streams.
+
+    python benchmarks/load_test_sse.py --url http://localhost:8000 --streams 500
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from uuid import uuid4
+
+import httpx
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * pct), len(samples) - 1)]
+
+
+async def hold_stream(client: httpx.AsyncClient, path: str, events: list[float]):
+    """
+    Streams a task id that never completes, recording time to first event
+    """
+    start = time.perf_counter()
+    try:
+        async with client.stream("GET", path) as response:
+            async for line in response.aiter_lines():
+                if line.startswith("data:"):
+                    events.append(time.perf_counter() - start)
+                    start = time.perf_counter()
+    except (httpx.HTTPError, asyncio.CancelledError):
+        pass
+
+
+async def sample_health(client: httpx.AsyncClient, duration: float) -> list[float]:
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.get("/health")
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.1)
+    return latencies
+
+
+def report(label: str, latencies: list[float]):
+    print(
+        f"{label:<28} n={len(latencies):<5}"
+        f" p50={statistics.median(latencies) * 1000:8.1f}ms"
+        f" p99={percentile(latencies, 0.99) * 1000:8.1f}ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--streams", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=30)
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=args.streams + 10)
+    timeout = httpx.Timeout(args.duration + 60)
+    async with httpx.AsyncClient(
+        base_url=args.url, limits=limits, timeout=timeout
+    ) as client:
+        report("/health idle", await sample_health(client, 10))
+
+        events: dict[str, list[float]] = {"ocr": [], "execute": []}
+        wait = int(args.duration) + 10
+        streams = []
+        for i in range(args.streams):
+            kind = "ocr" if i % 2 else "execute"
+            path = f"/{kind}/stream/{uuid4()}?wait={wait}"
+            streams.append(
+                asyncio.create_task(hold_stream(client, path, events[kind]))
+            )
+
+        report(
+            f"/health with {args.streams} streams",
+            await sample_health(client, args.duration),
+        )
+        for kind, latencies in events.items():
+            if latencies:
+                report(f"/{kind}/stream event gap", latencies)
+
+        for stream in streams:
+            stream.cancel()
+        await asyncio.gather(*streams, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
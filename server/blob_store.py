@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import mmap
+import os
+import time
+from io import BytesIO
+from os import getenv
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+# "redis" works across hosts, "shm" needs the API and worker to share blobDir
+blobBackend = getenv("OCR_BLOB_BACKEND", "redis")
+blobDir = getenv("OCR_BLOB_DIR", "/dev/shm/rightcode")
+
+BLOB_TTL = 600  # seconds
+SWEEP_INTERVAL = 60  # seconds
+
+_last_sweep = 0.0
+
+
+def put(redis_client, data: bytes) -> str:
+    """
+    Stores `data` once outside the task message and returns a reference
+    """
+    blob_id = uuid4().hex
+    if blobBackend == "shm":
+        os.makedirs(blobDir, exist_ok=True)
+        _sweep_expired()
+        path = os.path.join(blobDir, blob_id)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+        return f"shm:{blob_id}"
+
+    redis_client.setex(f"blob:{blob_id}", BLOB_TTL, data)
+    return f"redis:{blob_id}"
+
+
+async def put_async(redis_client, data: bytes) -> str:
+    """
+    put() for the API's redis.asyncio client
+    """
+    if blobBackend == "shm":
+        return await asyncio.to_thread(put, redis_client, data)
+
+    blob_id = uuid4().hex
+    await redis_client.setex(f"blob:{blob_id}", BLOB_TTL, data)
+    return f"redis:{blob_id}"
+
+
+def open_blob(redis_client, ref: str):
+    """
+    Returns a readable, seekable view of the blob without copying it: an mmap
+    of the shared-memory file, or a BytesIO sharing the buffer Redis returned.
+    """
+    scheme, blob_id = ref.split(":", 1)
+    if scheme == "shm":
+        with open(os.path.join(blobDir, blob_id), "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    data = redis_client.get(f"blob:{blob_id}")
+    if data is None:
+        raise KeyError(f"Blob {ref} expired or does not exist")
+    return BytesIO(data)
+
+
+def delete(redis_client, ref: str):
+    scheme, blob_id = ref.split(":", 1)
+    try:
+        if scheme == "shm":
+            os.unlink(os.path.join(blobDir, blob_id))
+        else:
+            redis_client.delete(f"blob:{blob_id}")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Could not delete blob {ref}: {e}")
+
+
+def _sweep_expired():
+    """
+    Shared-memory files have no TTL of their own, so orphans left by failed
+    tasks are removed here at most once per SWEEP_INTERVAL.
+    """
+    global _last_sweep
+
+    now = time.time()
+    if now - _last_sweep < SWEEP_INTERVAL:
+        return
+    _last_sweep = now
+
+    for entry in os.scandir(blobDir):
+        try:
+            if now - entry.stat().st_mtime > BLOB_TTL:
+                os.unlink(entry.path)
+        except FileNotFoundError:
+            pass
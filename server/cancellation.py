@@ -0,0 +1,35 @@
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# the executors read the same key, keep the format in step with them
+CANCEL_TTL = 600  # seconds
+
+
+def cancel_key(task_id: str) -> str:
+    return f"cancel:{task_id}"
+
+
+async def request_cancel_async(redis_client, task_id: str):
+    await redis_client.setex(cancel_key(task_id), CANCEL_TTL, 1)
+
+
+def cancelled(redis_client, task_ids: list[Optional[str]]) -> list[bool]:
+    """
+    Which of `task_ids` have been cancelled, in one round trip. Ids that are
+    None are never cancelled, and a Redis error cancels nothing.
+    """
+    keys = [cancel_key(task_id) for task_id in task_ids if task_id]
+    if not keys:
+        return [False] * len(task_ids)
+    try:
+        flags = iter(redis_client.mget(keys))
+    except Exception as e:
+        logger.warning(f"Could not check cancel flags: {e}")
+        return [False] * len(task_ids)
+    return [bool(task_id) and next(flags) is not None for task_id in task_ids]
+
+
+def is_cancelled(redis_client, task_id: Optional[str]) -> bool:
+    return cancelled(redis_client, [task_id])[0]
@@ -0,0 +1,34 @@
+import logging
+from dotenv import load_dotenv
+from os import getenv
+from celery import Celery
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Env Variables
+load_dotenv()
+redisOcrURL = getenv("REDIS_URL_OCR")
+redisCeleryURL = getenv("REDIS_URL_CELERY")
+
+# Task names, so the API can enqueue without importing the worker code
+PROCESS_OCR_TASK = "ocr_service.process_ocr"
+EXECUTE_CODE_TASK = "ocr_service.execute_code"
+
+celeryApp = Celery(
+    "ocr_service", broker=redisCeleryURL, backend=redisCeleryURL, include=["tasks"]
+)
+celeryApp.conf.update(
+    task_serializer="json",
+    accept_content=["json"],
+    result_serializer="json",
+    timezone="UTC",
+    enable_utc=True,
+    result_expires=3600,
+    task_track_started=True,
+    task_time_limit=300,  # 5 minutes
+    task_soft_time_limit=240,  # 4 minutes
+    worker_prefetch_multiplier=1,
+    worker_max_tasks_per_child=1000,
+)
@@ -1 +1 @@
-from main import celeryApp
\ No newline at end of file
+from tasks import celeryApp
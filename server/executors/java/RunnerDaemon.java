@@ -0,0 +1,450 @@
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.ByteArrayInputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.EOFException;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.lang.management.ManagementFactory;
+import java.lang.management.MemoryPoolMXBean;
+import java.lang.management.MemoryType;
+import java.lang.management.MemoryUsage;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.URI;
+import java.nio.charset.StandardCharsets;
+import java.security.CodeSource;
+import java.security.Permission;
+import java.security.Permissions;
+import java.security.Policy;
+import java.security.ProtectionDomain;
+import java.util.Arrays;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.PropertyPermission;
+import javax.tools.Diagnostic;
+import javax.tools.DiagnosticCollector;
+import javax.tools.FileObject;
+import javax.tools.ForwardingJavaFileManager;
+import javax.tools.JavaCompiler;
+import javax.tools.JavaFileObject;
+import javax.tools.SimpleJavaFileObject;
+import javax.tools.StandardJavaFileManager;
+import javax.tools.ToolProvider;
+
+/**
+ * Warm compile-and-run service for the Java executor, so a submission does not
+ * pay for two cold JVMs. Requests arrive on stdin and are answered on stdout,
+ * one at a time:
+ *
+ *   COMPILE className source
+ *     -> status (OK | ERROR), diagnostics, class count, (name, bytes)...
+ *   RUN mainClass timeoutMillis memoryBytes class count, (name, bytes)...
+ *     -> status (OK | TIMEOUT | MEMORY), reusable, exit code, stdout, stderr
+ *
+ * Strings are an int byte count and UTF-8, byte arrays an int count and the
+ * bytes, numbers big endian. Sources are compiled in memory, and each run gets
+ * a fresh class loader whose classes hold no permissions. A run that cannot be
+ * stopped cleanly is answered with reusable = false, after which this JVM halts
+ * and the executor starts a new one.
+ *
+ * Needs -Djava.security.manager=allow on JDK 18 and later.
+ */
+public class RunnerDaemon {
+    // per stream, the rest of the output is dropped
+    static final int MAX_OUTPUT = 1024 * 1024;
+    static final long POLL_MILLIS = 10;
+
+    static final JavaCompiler compiler = ToolProvider.getSystemJavaCompiler();
+    // kept across compilations, it caches the platform classes javac reads
+    static final StandardJavaFileManager platformFiles =
+        compiler.getStandardFileManager(null, null, StandardCharsets.UTF_8);
+
+    // submitted classes get exactly these permissions, the policy is never asked
+    static final ProtectionDomain SANDBOX = new ProtectionDomain(
+        new CodeSource(null, (java.security.cert.Certificate[]) null), sandboxPermissions());
+
+    static volatile Run current;
+
+    public static void main(String[] args) throws IOException {
+        DataInputStream in = new DataInputStream(new BufferedInputStream(System.in));
+        DataOutputStream out = new DataOutputStream(
+            new BufferedOutputStream(new FileOutputStream(FileDescriptor.out)));
+        // stdout carries the protocol, nothing else may write to it
+        System.setOut(System.err);
+
+        Policy.setPolicy(new Policy() {
+            @Override
+            public boolean implies(ProtectionDomain domain, Permission permission) {
+                return true;
+            }
+        });
+        System.setSecurityManager(new SandboxSecurityManager());
+
+        while (true) {
+            String op;
+            try {
+                op = readString(in);
+            } catch (EOFException e) {
+                return;
+            }
+            switch (op) {
+                case "COMPILE":
+                    compile(in, out);
+                    break;
+                case "RUN":
+                    if (!run(in, out)) {
+                        out.flush();
+                        // threads of the run may still be going, only a new JVM is clean
+                        Runtime.getRuntime().halt(0);
+                    }
+                    break;
+                default:
+                    throw new IOException("Unknown op " + op);
+            }
+            out.flush();
+        }
+    }
+
+    static Permissions sandboxPermissions() {
+        Permissions permissions = new Permissions();
+        permissions.add(new PropertyPermission("*", "read"));
+        return permissions;
+    }
+
+    // COMPILE
+
+    static void compile(DataInputStream in, DataOutputStream out) throws IOException {
+        String className = readString(in);
+        String source = readString(in);
+
+        DiagnosticCollector<JavaFileObject> diagnostics = new DiagnosticCollector<>();
+        MemoryFileManager files = new MemoryFileManager(platformFiles);
+        boolean ok = compiler.getTask(
+            null, files, diagnostics, List.of("-proc:none"), null,
+            List.of(new SourceFile(className, source))).call();
+
+        writeString(out, ok ? "OK" : "ERROR");
+        writeString(out, formatDiagnostics(diagnostics.getDiagnostics(), className, source));
+        out.writeInt(files.classes.size());
+        for (Map.Entry<String, ByteArrayOutputStream> entry : files.classes.entrySet()) {
+            writeString(out, entry.getKey());
+            writeBytes(out, entry.getValue().toByteArray());
+        }
+    }
+
+    /** The same text javac prints, with the file named after the class */
+    static String formatDiagnostics(
+            List<Diagnostic<? extends JavaFileObject>> diagnostics, String className, String source) {
+        String[] lines = source.split("\n", -1);
+        StringBuilder text = new StringBuilder();
+        int errors = 0;
+        int warnings = 0;
+        for (Diagnostic<? extends JavaFileObject> diagnostic : diagnostics) {
+            String message = diagnostic.getMessage(null);
+            switch (diagnostic.getKind()) {
+                case ERROR:
+                    errors++;
+                    break;
+                case WARNING:
+                case MANDATORY_WARNING:
+                    warnings++;
+                    break;
+                default:
+                    text.append("Note: ").append(message).append('\n');
+                    continue;
+            }
+            String kind = diagnostic.getKind() == Diagnostic.Kind.ERROR ? "error" : "warning";
+            long line = diagnostic.getLineNumber();
+            if (line < 1 || line > lines.length) {
+                text.append(kind).append(": ").append(message).append('\n');
+                continue;
+            }
+            text.append(className).append(".java:").append(line).append(": ")
+                .append(kind).append(": ").append(message).append('\n')
+                .append(lines[(int) line - 1].replace("\r", "")).append('\n');
+            long column = diagnostic.getColumnNumber();
+            if (column > 0) {
+                text.append(" ".repeat((int) column - 1)).append("^\n");
+            }
+        }
+        if (errors > 0) {
+            text.append(errors).append(errors == 1 ? " error\n" : " errors\n");
+        }
+        if (warnings > 0) {
+            text.append(warnings).append(warnings == 1 ? " warning\n" : " warnings\n");
+        }
+        return text.toString();
+    }
+
+    static class SourceFile extends SimpleJavaFileObject {
+        final String source;
+
+        SourceFile(String className, String source) {
+            super(URI.create("string:///" + className + ".java"), Kind.SOURCE);
+            this.source = source;
+        }
+
+        @Override
+        public CharSequence getCharContent(boolean ignoreEncodingErrors) {
+            return source;
+        }
+    }
+
+    static class MemoryFileManager extends ForwardingJavaFileManager<StandardJavaFileManager> {
+        final Map<String, ByteArrayOutputStream> classes = new LinkedHashMap<>();
+
+        MemoryFileManager(StandardJavaFileManager files) {
+            super(files);
+        }
+
+        @Override
+        public JavaFileObject getJavaFileForOutput(
+                Location location, String className, JavaFileObject.Kind kind, FileObject sibling) {
+            URI uri = URI.create("mem:///" + className.replace('.', '/') + kind.extension);
+            return new SimpleJavaFileObject(uri, kind) {
+                @Override
+                public OutputStream openOutputStream() {
+                    ByteArrayOutputStream bytes = new ByteArrayOutputStream();
+                    classes.put(className, bytes);
+                    return bytes;
+                }
+            };
+        }
+    }
+
+    // RUN
+
+    static class Run {
+        final ThreadGroup group = new ThreadGroup("submission");
+        final Map<String, byte[]> classes;
+        volatile boolean exited;
+        volatile int exitStatus;
+        volatile boolean uncaught;
+        volatile boolean outOfMemory;
+
+        Run(Map<String, byte[]> classes) {
+            this.classes = classes;
+        }
+
+        boolean owns(Thread thread) {
+            ThreadGroup threadGroup = thread.getThreadGroup();
+            return threadGroup != null && group.parentOf(threadGroup);
+        }
+
+        boolean hasLiveThreads(boolean includeDaemons) {
+            Thread[] threads = new Thread[group.activeCount() + 8];
+            int count = group.enumerate(threads, true);
+            for (int i = 0; i < count; i++) {
+                if (threads[i].isAlive() && (includeDaemons || !threads[i].isDaemon())) {
+                    return true;
+                }
+            }
+            return false;
+        }
+    }
+
+    static class SandboxLoader extends ClassLoader {
+        final Map<String, byte[]> classes;
+
+        SandboxLoader(Map<String, byte[]> classes) {
+            // only the platform is visible, not this daemon
+            super(ClassLoader.getPlatformClassLoader());
+            this.classes = classes;
+        }
+
+        @Override
+        protected Class<?> findClass(String name) throws ClassNotFoundException {
+            byte[] bytes = classes.get(name);
+            if (bytes == null) {
+                throw new ClassNotFoundException(name);
+            }
+            return defineClass(name, bytes, 0, bytes.length, SANDBOX);
+        }
+    }
+
+    static class ExitTrapped extends SecurityException {
+        ExitTrapped(int status) {
+            super("System.exit(" + status + ")");
+        }
+    }
+
+    static class SandboxSecurityManager extends SecurityManager {
+        @Override
+        public void checkExit(int status) {
+            Run run = current;
+            if (run != null && run.owns(Thread.currentThread())) {
+                run.exitStatus = status;
+                run.exited = true;
+                throw new ExitTrapped(status);
+            }
+            super.checkExit(status);
+        }
+    }
+
+    /** Returns whether this JVM can take another run */
+    static boolean run(DataInputStream in, DataOutputStream out) throws IOException {
+        String mainClass = readString(in);
+        long timeoutMillis = in.readLong();
+        long memoryBytes = in.readLong();
+        Map<String, byte[]> classes = readClasses(in);
+
+        BoundedOutput stdout = new BoundedOutput();
+        BoundedOutput stderr = new BoundedOutput();
+        PrintStream daemonErr = System.err;
+        InputStream daemonIn = System.in;
+
+        Run run = new Run(classes);
+        long baseline = liveHeap();
+        long deadline = System.nanoTime() + timeoutMillis * 1_000_000;
+        String status = "OK";
+
+        System.setOut(new PrintStream(stdout, true, StandardCharsets.UTF_8));
+        System.setErr(new PrintStream(stderr, true, StandardCharsets.UTF_8));
+        System.setIn(new ByteArrayInputStream(new byte[0]));
+        current = run;
+        Thread main = new Thread(run.group, () -> invokeMain(run, mainClass), "main");
+        try {
+            main.start();
+            while (true) {
+                // like the java launcher, wait for every non-daemon thread
+                if (run.exited || (!main.isAlive() && !run.hasLiveThreads(false))) {
+                    break;
+                }
+                if (run.outOfMemory || liveHeap() - baseline > memoryBytes) {
+                    status = "MEMORY";
+                    break;
+                }
+                if (System.nanoTime() >= deadline) {
+                    status = "TIMEOUT";
+                    break;
+                }
+                main.join(POLL_MILLIS);
+            }
+            if (run.exited) {
+                main.join(POLL_MILLIS);
+            }
+        } catch (InterruptedException e) {
+            status = "TIMEOUT";
+        } finally {
+            current = null;
+            System.out.flush();
+            System.err.flush();
+            System.setOut(daemonErr);
+            System.setErr(daemonErr);
+            System.setIn(daemonIn);
+        }
+
+        int exitCode = run.exited ? run.exitStatus : run.uncaught ? 1 : 0;
+        boolean reusable = status.equals("OK") && !run.outOfMemory && !run.hasLiveThreads(true);
+
+        writeString(out, status);
+        out.writeBoolean(reusable);
+        out.writeInt(exitCode);
+        writeString(out, stdout.toString(StandardCharsets.UTF_8));
+        writeString(out, stderr.toString(StandardCharsets.UTF_8));
+        return reusable;
+    }
+
+    static void invokeMain(Run run, String mainClass) {
+        try {
+            Class<?> cls = Class.forName(mainClass, true, new SandboxLoader(run.classes));
+            Method main = cls.getMethod("main", String[].class);
+            // the launcher also runs main of a class that is not public
+            main.setAccessible(true);
+            main.invoke(null, (Object) new String[0]);
+        } catch (InvocationTargetException e) {
+            uncaught(run, e.getCause());
+        } catch (NoSuchMethodException e) {
+            System.err.println("Error: Main method not found in class " + mainClass
+                + ", please define the main method as:\n   public static void main(String[] args)");
+            run.uncaught = true;
+        } catch (Throwable e) {
+            uncaught(run, e);
+        }
+    }
+
+    static void uncaught(Run run, Throwable error) {
+        if (error instanceof ExitTrapped || run.exited) {
+            return;
+        }
+        if (error instanceof OutOfMemoryError) {
+            run.outOfMemory = true;
+        }
+        run.uncaught = true;
+        // drop the reflection and daemon frames below the submission's own
+        StackTraceElement[] frames = error.getStackTrace();
+        int last = frames.length - 1;
+        while (last >= 0 && !run.classes.containsKey(frames[last].getClassName())) {
+            last--;
+        }
+        if (last >= 0) {
+            error.setStackTrace(Arrays.copyOf(frames, last + 1));
+        }
+        System.err.print("Exception in thread \"main\" ");
+        error.printStackTrace(System.err);
+    }
+
+    /** Heap still in use after the latest collections, checked against a run's limit */
+    static long liveHeap() {
+        long used = 0;
+        for (MemoryPoolMXBean pool : ManagementFactory.getMemoryPoolMXBeans()) {
+            MemoryUsage usage = pool.getCollectionUsage();
+            if (pool.getType() == MemoryType.HEAP && usage != null) {
+                used += usage.getUsed();
+            }
+        }
+        return used;
+    }
+
+    static class BoundedOutput extends ByteArrayOutputStream {
+        @Override
+        public synchronized void write(int b) {
+            if (count < MAX_OUTPUT) {
+                super.write(b);
+            }
+        }
+
+        @Override
+        public synchronized void write(byte[] b, int off, int len) {
+            super.write(b, off, Math.min(len, MAX_OUTPUT - count));
+        }
+    }
+
+    // framing
+
+    static Map<String, byte[]> readClasses(DataInputStream in) throws IOException {
+        int count = in.readInt();
+        Map<String, byte[]> classes = new LinkedHashMap<>();
+        for (int i = 0; i < count; i++) {
+            classes.put(readString(in), readBytes(in));
+        }
+        return classes;
+    }
+
+    static byte[] readBytes(DataInputStream in) throws IOException {
+        byte[] bytes = new byte[in.readInt()];
+        in.readFully(bytes);
+        return bytes;
+    }
+
+    static String readString(DataInputStream in) throws IOException {
+        return new String(readBytes(in), StandardCharsets.UTF_8);
+    }
+
+    static void writeBytes(DataOutputStream out, byte[] bytes) throws IOException {
+        out.writeInt(bytes.length);
+        out.write(bytes);
+    }
+
+    static void writeString(DataOutputStream out, String value) throws IOException {
+        writeBytes(out, value.getBytes(StandardCharsets.UTF_8));
+    }
+}
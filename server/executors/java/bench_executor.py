@@ -0,0 +1,103 @@
+"""
+End-to-end time of execute_java on the warm daemon against the javac + java
+subprocess path, p50/p99 over the same submissions. Each path is measured
+with the compile cache off, then (unless JAVA_COMPILE_CACHE_MB=0) with it on
+and already holding the programs. Run inside the executor image, where
+RunnerDaemon is compiled:
+
+    python3 bench_executor.py --runs 50
+"""
+import argparse
+import os
+import sys
+import time
+
+# the executor connects lazily, nothing here talks to Redis or SQS
+os.environ.setdefault("REDIS_URL_OCR", "redis://localhost:6379")
+os.environ.setdefault("AWS_REGION", "us-east-1")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import executor  # noqa: E402
+
+PROGRAMS = [
+    """
+public class Hello {
+    public static void main(String[] args) {
+        System.out.println("Hello, world");
+    }
+}
+""",
+    """
+import java.util.*;
+
+public class Sort {
+    public static void main(String[] args) {
+        List<Integer> values = new ArrayList<>();
+        Random random = new Random(42);
+        for (int i = 0; i < 10000; i++) {
+            values.add(random.nextInt(1000));
+        }
+        Collections.sort(values);
+        System.out.println(values.get(0) + " " + values.get(values.size() - 1));
+    }
+}
+""",
+    """
+public class Fib {
+    static int fib(int n) {
+        return n < 2 ? n : fib(n - 1) + fib(n - 2);
+    }
+
+    public static void main(String[] args) {
+        System.out.println(fib(25));
+    }
+}
+""",
+]
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+def measure(run, runs):
+    times = []
+    for i in range(runs):
+        code = PROGRAMS[i % len(PROGRAMS)]
+        start = time.perf_counter()
+        result = run(code)
+        times.append(time.perf_counter() - start)
+        if not result["success"]:
+            sys.exit(f"Run failed: {result}")
+    return times
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=30)
+    args = parser.parse_args()
+
+    code_executor = executor.CodeExecutor()
+    if code_executor.daemons is None:
+        sys.exit(f"RunnerDaemon.class not found in {executor.javaDaemonClasspath}")
+    # wait until the pool has started and warmed its daemon
+    daemon = code_executor.daemons.acquire(120)
+    if daemon is None:
+        sys.exit("The Java daemon did not start, see the log above")
+    code_executor.daemons.release(daemon, True)
+
+    compile_cache = code_executor.compile_cache
+    print(f"{'path':<12} {'cache':<6} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, run in (
+        ("subprocess", code_executor.execute_java_subprocess),
+        ("daemon", code_executor.execute_java),
+    ):
+        for cached in (False, True) if compile_cache else (False,):
+            code_executor.compile_cache = compile_cache if cached else None
+            if cached:
+                measure(run, len(PROGRAMS))
+            times = measure(run, args.runs)
+            print(
+                f"{name:<12} {'on' if cached else 'off':<6} "
+                f"{percentile(times, 0.5) * 1000:>8.0f} {percentile(times, 0.99) * 1000:>8.0f}"
+            )
+
+if __name__ == "__main__":
+    main()
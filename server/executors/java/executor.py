@@ -1,9 +1,16 @@
 import os
 import json
+import hashlib
+import queue
+import select
+import signal
+import struct
 import subprocess
 import tempfile
+import threading
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 import redis
 
@@ -15,44 +22,542 @@ logger = logging.getLogger(__name__)
 redisURL = os.getenv("REDIS_URL_OCR")
 executionQueueURL = os.getenv("EXECUTION_QUEUE_JAVA_URL")
 awsRegion = os.getenv("AWS_REGION")
+# submissions run at the same time, one per CPU unless set
+executorConcurrency = int(os.getenv("EXECUTOR_CONCURRENCY", str(os.cpu_count() or 1)))
+# warm JVMs running RunnerDaemon, 0 runs every submission with javac and java
+javaDaemons = int(os.getenv("JAVA_DAEMON_POOL_SIZE", str(executorConcurrency)))
+javaDaemonClasspath = os.getenv(
+    "JAVA_DAEMON_CLASSPATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "daemon")
+)
+# on top of the per-run memory limit, for javac and the daemon itself
+javaDaemonHeadroomMB = int(os.getenv("JAVA_DAEMON_HEADROOM_MB", "256"))
+# compiler output of earlier submissions, 0 MB disables the cache
+compileCacheDir = os.getenv(
+    "JAVA_COMPILE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "rightcode-javac")
+)
+compileCacheMB = int(os.getenv("JAVA_COMPILE_CACHE_MB", "256"))
+compileCacheRedis = os.getenv("JAVA_COMPILE_CACHE_REDIS", "0") == "1"
+compileCacheTTL = int(os.getenv("JAVA_COMPILE_CACHE_TTL", "86400")) # seconds
 
 # Initialize services
 redis_client = redis.from_url(redisURL)
 sqs = boto3.client('sqs', region_name=awsRegion)
 
+# the API sets cancel:<task_id> when a task is cancelled
+CANCEL_POLL_INTERVAL = 0.25 # seconds
+
+class ExecutionCancelled(Exception):
+    pass
+
+def is_cancelled(task_id) -> bool:
+    if not task_id:
+        return False
+    try:
+        return redis_client.exists(f"cancel:{task_id}") == 1
+    except Exception as e:
+        logger.warning(f"Could not check cancel flag for {task_id}: {e}")
+        return False
+
+def cancelled_result() -> dict:
+    return {
+        "success": False,
+        "output": None,
+        "errors": "Execution was cancelled",
+        "stage": "cancelled",
+        "cancelled": True
+    }
+
+# how long past its own time limit a daemon may take to answer
+DAEMON_GRACE = 2 # seconds
+WARM_UP_SOURCE = """
+public class WarmUp {
+    public static void main(String[] args) {
+        System.out.println("ready");
+    }
+}
+"""
+
+class DaemonError(Exception):
+    """The daemon died or broke protocol, the submission itself is not at fault"""
+
+class DaemonUnavailable(DaemonError):
+    """The daemon did not take the request, so the submission has not run"""
+
+class JavaDaemon:
+    """
+    One JVM running RunnerDaemon, see RunnerDaemon.java for the protocol.
+    Requests are answered one at a time.
+    """
+    def __init__(self, heap_mb: int):
+        self.process = subprocess.Popen(
+            [
+                'java',
+                '-Djava.security.manager=allow',
+                f'-Xmx{heap_mb}m',
+                '-XX:+UseSerialGC',
+                '-cp', javaDaemonClasspath,
+                'RunnerDaemon'
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            bufsize=0,
+            start_new_session=True
+        )
+        self.buffer = b""
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.process.wait()
+
+    def send(self, *fields):
+        payload = b"".join(
+            field if isinstance(field, bytes) else pack_field(field) for field in fields
+        )
+        view = memoryview(payload)
+        try:
+            while view:
+                view = view[os.write(self.process.stdin.fileno(), view):]
+        except (BrokenPipeError, OSError) as e:
+            raise DaemonUnavailable(f"daemon is not accepting requests: {e}")
+
+    def read(self, size: int, deadline: float, task_id=None) -> bytes:
+        fd = self.process.stdout.fileno()
+        while len(self.buffer) < size:
+            ready, _, _ = select.select([fd], [], [], CANCEL_POLL_INTERVAL)
+            if ready:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    raise DaemonError(f"daemon exited with {self.process.wait()}")
+                self.buffer += chunk
+                continue
+            if time.time() >= deadline:
+                raise subprocess.TimeoutExpired(self.process.args, DAEMON_GRACE)
+            if is_cancelled(task_id):
+                raise ExecutionCancelled()
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def read_int(self, deadline: float, task_id=None) -> int:
+        return struct.unpack(">i", self.read(4, deadline, task_id))[0]
+
+    def read_bytes(self, deadline: float, task_id=None) -> bytes:
+        return self.read(self.read_int(deadline, task_id), deadline, task_id)
+
+    def read_string(self, deadline: float, task_id=None) -> str:
+        return self.read_bytes(deadline, task_id).decode("utf-8", errors="replace")
+
+    def compile(self, class_name: str, source: str, deadline: float, task_id=None):
+        """
+        (compiled, diagnostics, {class name: class file bytes})
+        """
+        self.send("COMPILE", class_name, source)
+        compiled = self.read_string(deadline, task_id) == "OK"
+        diagnostics = self.read_string(deadline, task_id)
+        classes = {}
+        for _ in range(self.read_int(deadline, task_id)):
+            name = self.read_string(deadline, task_id)
+            classes[name] = self.read_bytes(deadline, task_id)
+        return compiled, diagnostics, classes
+
+    def run(self, main_class: str, classes: dict, timeout: float, memory_limit: int, deadline: float, task_id=None) -> dict:
+        self.send(
+            "RUN",
+            main_class,
+            struct.pack(">qq", int(timeout * 1000), memory_limit),
+            struct.pack(">i", len(classes)),
+            *[pack_field(item) for name, data in classes.items() for item in (name, data)]
+        )
+        status = self.read_string(deadline, task_id)
+        reusable = self.read(1, deadline, task_id) != b"\x00"
+        return {
+            "status": status,
+            "reusable": reusable,
+            "exit_code": self.read_int(deadline, task_id),
+            "stdout": self.read_string(deadline, task_id),
+            "stderr": self.read_string(deadline, task_id),
+        }
+
+def pack_field(value) -> bytes:
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return struct.pack(">i", len(value)) + value
+
+def jdk_version() -> str:
+    try:
+        result = subprocess.run(["javac", "-version"], capture_output=True, text=True, timeout=30)
+        return (result.stdout or result.stderr).strip()
+    except Exception as e:
+        logger.warning(f"Could not read the JDK version: {e}")
+        return "unknown"
+
+class CompileCache:
+    """
+    Compiler output keyed by the source, its class name and the JDK version:
+    the class files of a successful compile or the diagnostics of a failed
+    one. Entries are files in `directory`, trimmed to `max_bytes` by least
+    recent use, and optionally copied to Redis for the other executors.
+    """
+    def __init__(self, directory: str, max_bytes: int, use_redis: bool, ttl: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.use_redis = use_redis
+        self.ttl = ttl
+        self.jdk = jdk_version()
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(size for _, _, size in self.entries())
+
+    def key(self, source: str, class_name: str) -> str:
+        digest = hashlib.sha256(f"{self.jdk}\0{class_name}\0{source}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, source: str, class_name: str):
+        """
+        (compiled, diagnostics, classes) as JavaDaemon.compile returns them,
+        or None on a miss
+        """
+        key = self.key(source, class_name)
+        path = os.path.join(self.directory, key)
+        data = None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # the modification time orders eviction
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+        if data is None and self.use_redis:
+            try:
+                data = redis_client.get(f"javac:{key}")
+            except Exception as e:
+                logger.warning(f"Could not read the compile cache from Redis: {e}")
+            if data is not None:
+                self.write(key, data)
+
+        if data is None:
+            return None
+        try:
+            return decode_compile(data)
+        except (struct.error, UnicodeDecodeError) as e:
+            logger.warning(f"Dropping corrupt compile cache entry {key}: {e}")
+            return None
+
+    def put(self, source: str, class_name: str, compiled: bool, diagnostics: str, classes: dict):
+        key = self.key(source, class_name)
+        data = encode_compile(compiled, diagnostics, classes)
+        self.write(key, data)
+        if self.use_redis:
+            try:
+                redis_client.setex(f"javac:{key}", self.ttl, data)
+            except Exception as e:
+                logger.warning(f"Could not write the compile cache to Redis: {e}")
+
+    def write(self, key: str, data: bytes):
+        path = os.path.join(self.directory, key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write compile cache entry {key}: {e}")
+            return
+        with self.lock:
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def entries(self):
+        for name in os.listdir(self.directory):
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            yield name, stat.st_mtime, stat.st_size
+
+    def evict(self):
+        # recount, overwritten entries were added twice
+        entries = sorted(self.entries(), key=lambda entry: entry[1])
+        self.size = sum(size for _, _, size in entries)
+        for name, _, size in entries:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+def encode_compile(compiled: bool, diagnostics: str, classes: dict) -> bytes:
+    parts = [b"\x01" if compiled else b"\x00", pack_field(diagnostics), struct.pack(">i", len(classes))]
+    for name, data in classes.items():
+        parts += [pack_field(name), pack_field(data)]
+    return b"".join(parts)
+
+def decode_compile(data: bytes):
+    offset = 1
+
+    def field() -> bytes:
+        nonlocal offset
+        (size,) = struct.unpack_from(">i", data, offset)
+        offset += 4 + size
+        if offset > len(data):
+            raise struct.error("truncated entry")
+        return data[offset - size:offset]
+
+    compiled = data[:1] == b"\x01"
+    diagnostics = field().decode("utf-8")
+    (count,) = struct.unpack_from(">i", data, offset)
+    offset += 4
+    classes = {}
+    for _ in range(count):
+        name = field().decode("utf-8")
+        classes[name] = field()
+    return compiled, diagnostics, classes
+
+class JavaDaemonPool:
+    """
+    Warm daemons shared by the executor. A daemon that timed out, ran out of
+    memory or died is killed and a new one is started in the background.
+    """
+    def __init__(self, size: int, heap_mb: int):
+        self.heap_mb = heap_mb
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        # idle plus starting, 0 means nothing will become available
+        self.available = 0
+        for _ in range(size):
+            self.replace()
+
+    def replace(self):
+        with self.lock:
+            self.available += 1
+        threading.Thread(target=self.start, daemon=True).start()
+
+    def start(self):
+        try:
+            daemon = JavaDaemon(self.heap_mb)
+            # the first compile loads and JITs javac, keep that off the first submission
+            deadline = time.time() + 60
+            compiled, diagnostics, classes = daemon.compile("WarmUp", WARM_UP_SOURCE, deadline)
+            if not compiled:
+                raise DaemonError(diagnostics)
+            daemon.run("WarmUp", classes, 10, 64 * 1024 * 1024, deadline)
+        except Exception as e:
+            logger.error(f"Could not start a Java daemon: {e}")
+            with self.lock:
+                self.available -= 1
+            return
+        self.idle.put(daemon)
+
+    def acquire(self, timeout: float):
+        """
+        An idle daemon, or None when none is ready within `timeout`
+        """
+        with self.lock:
+            if self.available == 0:
+                return None
+        try:
+            daemon = self.idle.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self.lock:
+            self.available -= 1
+        return daemon
+
+    def release(self, daemon, reusable: bool):
+        if reusable and daemon.alive():
+            with self.lock:
+                self.available += 1
+            self.idle.put(daemon)
+            return
+        daemon.kill()
+        self.replace()
+
 class CodeExecutor:
     def __init__(self):
         self.timeout = 10 # seconds
         self.memory_limit = 128 * 1024 * 1024 #128MB
+        self.daemons = None
+        if javaDaemons > 0 and os.path.exists(os.path.join(javaDaemonClasspath, "RunnerDaemon.class")):
+            heap_mb = self.memory_limit // (1024*1024) + javaDaemonHeadroomMB
+            self.daemons = JavaDaemonPool(javaDaemons, heap_mb)
+        self.compile_cache = None
+        if compileCacheMB > 0:
+            self.compile_cache = CompileCache(
+                compileCacheDir, compileCacheMB * 1024 * 1024, compileCacheRedis, compileCacheTTL
+            )
+
+    def run_process(self, cmd, task_id=None, **kwargs):
+        """
+        subprocess.run with capture_output and self.timeout that also stops
+        when the task is cancelled. The child runs in its own process group
+        so anything it spawned is killed with it.
+        """
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            start_new_session=True,
+            **kwargs
+        )
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                stdout, stderr = process.communicate(timeout=CANCEL_POLL_INTERVAL)
+                return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+            except subprocess.TimeoutExpired:
+                pass
+
+            if time.time() >= deadline:
+                self.kill_process_group(process)
+                raise subprocess.TimeoutExpired(cmd, self.timeout)
+            if is_cancelled(task_id):
+                self.kill_process_group(process)
+                raise ExecutionCancelled()
+
+    def kill_process_group(self, process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.communicate()
         
-    def execute_java(self, code: str): 
+    def execute_java(self, code: str, task_id=None):
+        daemon = self.daemons.acquire(self.timeout) if self.daemons else None
+        if daemon is None:
+            return self.execute_java_subprocess(code, task_id)
+
+        reusable = False
+        try:
+            result, reusable = self.execute_java_daemon(daemon, code, task_id)
+            return result
+        except DaemonUnavailable as e:
+            logger.warning(f"Java daemon failed, running with javac and java instead: {e}")
+            return self.execute_java_subprocess(code, task_id)
+        except DaemonError as e:
+            # the submission may have run already, running it again could
+            # repeat its side effects
+            logger.warning(f"Java daemon failed during a run: {e}")
+            return {
+                "success": False,
+                "output": None,
+                "errors": "Code execution failed",
+                "stage": "execution"
+            }
+        except ExecutionCancelled:
+            return cancelled_result()
+        except subprocess.TimeoutExpired:
+            return {
+                "success": False,
+                "output": None,
+                "errors": "Code execution timed out",
+                "stage": "execution"
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "output": None,
+                "errors": str(e),
+                "stage": "setup"
+            }
+        finally:
+            self.daemons.release(daemon, reusable)
+
+    def execute_java_daemon(self, daemon, code: str, task_id=None):
+        """
+        The result and whether the daemon can take another submission
+        """
+        class_name = self.extract_java_classname(code)
+        cached = self.compile_cache.get(code, class_name) if self.compile_cache else None
+        if cached is not None:
+            logger.info(f"Compile cache hit for {class_name}")
+            compiled, diagnostics, classes = cached
+        else:
+            compiled, diagnostics, classes = daemon.compile(
+                class_name, code, time.time() + self.timeout, task_id
+            )
+            if self.compile_cache:
+                self.compile_cache.put(code, class_name, compiled, diagnostics, classes)
+        if not compiled:
+            return {
+                "success": False,
+                "output": None,
+                "errors": diagnostics,
+                "stage": "compilation"
+            }, True
+
+        run = daemon.run(
+            class_name,
+            classes,
+            self.timeout,
+            self.memory_limit,
+            time.time() + self.timeout + DAEMON_GRACE,
+            task_id
+        )
+        if run["status"] == "TIMEOUT":
+            raise subprocess.TimeoutExpired(class_name, self.timeout)
+        if run["status"] == "MEMORY":
+            return {
+                "success": False,
+                "output": run["stdout"],
+                "errors": run["stderr"] + "Memory limit exceeded",
+                "stage": "execution"
+            }, False
+        return {
+            "success": run["exit_code"] == 0,
+            "output": run["stdout"],
+            "errors": run["stderr"] if run["exit_code"] != 0 else None,
+            "stage": "execution",
+            "exit_code": run["exit_code"]
+        }, run["reusable"]
+
+    def execute_java_subprocess(self, code: str, task_id=None):
         try: 
             with tempfile.TemporaryDirectory() as temp_dir:
                 class_name = self.extract_java_classname(code)
-                java_file = os.path.join(temp_dir, f"{class_name}.java")
-                
-                with open(java_file, "w") as f:
-                    f.write(code)
-                    
-                compile_result = subprocess.run(
-                    ["javac", java_file],
-                    capture_output=True,
-                    text=True,
-                    timeout=self.timeout,
-                    cwd=temp_dir
-                )
-                
-                if compile_result.returncode != 0:
+                cached = self.compile_cache.get(code, class_name) if self.compile_cache else None
+                if cached is not None:
+                    logger.info(f"Compile cache hit for {class_name}")
+                    compiled, diagnostics, classes = cached
+                    self.write_class_files(temp_dir, classes)
+                else:
+                    java_file = os.path.join(temp_dir, f"{class_name}.java")
+
+                    with open(java_file, "w") as f:
+                        f.write(code)
+
+                    # relative, so the diagnostics do not name the temp dir
+                    compile_result = self.run_process(
+                        ["javac", f"{class_name}.java"],
+                        task_id=task_id,
+                        cwd=temp_dir
+                    )
+                    compiled = compile_result.returncode == 0
+                    diagnostics = compile_result.stderr
+                    if self.compile_cache:
+                        classes = self.read_class_files(temp_dir) if compiled else {}
+                        self.compile_cache.put(code, class_name, compiled, diagnostics, classes)
+
+                if not compiled:
                     return {
                         "success": False,
                         "output": None,
-                        "errors": compile_result.stderr,
+                        "errors": diagnostics,
                         "stage": "compilation"
                     }
                     
                 security_policy = self.create_security_fallback(temp_dir)
                 
-                execute_result = subprocess.run(
+                execute_result = self.run_process(
                     [
                         'java',
                         f'-Djava.security.manager',
@@ -61,9 +566,7 @@ class CodeExecutor:
                         '-cp', temp_dir,
                         class_name
                     ],
-                    capture_output=True,
-                    text=True, 
-                    timeout=self.timeout,
+                    task_id=task_id,
                     cwd=temp_dir
                 )
                 
@@ -76,6 +579,8 @@ class CodeExecutor:
                 }
 
                 
+        except ExecutionCancelled:
+            return cancelled_result()
         except subprocess.TimeoutExpired:
             return {
                 "success": False,
@@ -92,6 +597,21 @@ class CodeExecutor:
             }
 
     
+    def read_class_files(self, directory: str) -> dict:
+        classes = {}
+        for name in os.listdir(directory):
+            if name.endswith(".class"):
+                with open(os.path.join(directory, name), "rb") as f:
+                    classes[name[:-len(".class")]] = f.read()
+        return classes
+
+    def write_class_files(self, directory: str, classes: dict):
+        for name, data in classes.items():
+            path = os.path.join(directory, name.replace(".", os.sep) + ".class")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+
     def extract_java_classname(self, code: str) -> str:
         import re
         match = re.search(r'public\s+class\s+(\w+)', code)
@@ -118,77 +638,174 @@ class CodeExecutor:
             f.write(policy_content)
         return policy_file
 
+# how long a received message stays hidden, extended while it runs
+VISIBILITY_TIMEOUT = 60 # seconds
+HEARTBEAT_INTERVAL = 20 # seconds
+# SQS takes at most 10 entries per batch call
+SQS_BATCH_SIZE = 10
+DELETE_FLUSH_INTERVAL = 1 # seconds
+
+class MessageTracker:
+    """
+    Keeps the messages being executed invisible with a heartbeat and deletes
+    finished ones in batches.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # message id -> receipt handle
+        self.in_flight = {}
+        self.finished = queue.Queue()
+        threading.Thread(target=self.heartbeat, daemon=True).start()
+        threading.Thread(target=self.delete_finished, daemon=True).start()
+
+    def start(self, message):
+        with self.lock:
+            self.in_flight[message['MessageId']] = message['ReceiptHandle']
+
+    def finish(self, message, delete: bool):
+        with self.lock:
+            self.in_flight.pop(message['MessageId'], None)
+        if delete:
+            self.finished.put(message['ReceiptHandle'])
+
+    def heartbeat(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self.lock:
+                handles = list(self.in_flight.values())
+            for i in range(0, len(handles), SQS_BATCH_SIZE):
+                entries = [
+                    {"Id": str(n), "ReceiptHandle": handle, "VisibilityTimeout": VISIBILITY_TIMEOUT}
+                    for n, handle in enumerate(handles[i:i + SQS_BATCH_SIZE])
+                ]
+                try:
+                    res = sqs.change_message_visibility_batch(QueueUrl=executionQueueURL, Entries=entries)
+                    for failure in res.get("Failed", []):
+                        # a message that finished meanwhile can no longer be changed
+                        logger.debug(f"Could not extend visibility: {failure.get('Message')}")
+                except Exception as e:
+                    logger.warning(f"Could not extend message visibility: {e}")
+
+    def delete_finished(self):
+        while True:
+            handles = [self.finished.get()]
+            deadline = time.time() + DELETE_FLUSH_INTERVAL
+            while len(handles) < SQS_BATCH_SIZE:
+                try:
+                    handles.append(self.finished.get(timeout=max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+            entries = [{"Id": str(n), "ReceiptHandle": handle} for n, handle in enumerate(handles)]
+            try:
+                res = sqs.delete_message_batch(QueueUrl=executionQueueURL, Entries=entries)
+                for failure in res.get("Failed", []):
+                    logger.error(f"Failed to delete message: {failure.get('Message')}")
+            except Exception as e:
+                logger.error(f"Failed to delete {len(entries)} messages: {e}")
+
+def execute_message(executor, message) -> bool:
+    """
+    Runs one message and stores its result, returns whether to delete it
+    """
+    body = {}
+    try:
+        body = json.loads(message["Body"])
+        code = body["code"]
+        language: str = body["language"]
+
+        if language.lower() != "java":
+            return False
+
+        if is_cancelled(body['task_id']):
+            logger.info(f"Dropping cancelled task {body['task_id']}")
+            result = cancelled_result()
+            result["language"] = language
+            result['worker'] = "java-executor"
+            redis_client.setex(f"execution:{body['task_id']}", 600, json.dumps(result))
+            return True
+
+        logger.info(f"Executing Java Code")
+
+        start_time = time.time()
+        result = executor.execute_java(code, body['task_id'])
+        execution_time = time.time() - start_time
+
+        result["execution_time"] = execution_time
+        result["language"] = language
+        result['worker'] = "java-executor"
+
+        result_key = f"execution:{body['task_id']}"
+        redis_client.setex(result_key, 600, json.dumps(result))
+
+        logger.info(f"Execution completed in {execution_time:.2f}s")
+        return True
+
+    except Exception as e:
+        logger.error(f"Failed to process message: {e}")
+        if 'task_id' not in body:
+            return True
+        result = {
+            "success": False,
+            "output": "There was a problem with our servers or formatting of the code, please try again later",
+            "errors": str(e),
+            "stage": "execution",
+            "exit_code": 500
+        }
+        result_key = f"execution:{body['task_id']}"
+        redis_client.setex(result_key, 600, json.dumps(result))
+        return True
+
+def run_message(executor, tracker, slots, message):
+    delete = False
+    try:
+        delete = execute_message(executor, message)
+    finally:
+        tracker.finish(message, delete)
+        slots.release()
+
 def process_execution_messages(): 
     logger.info("initializing the executor class")
     executor = CodeExecutor()
+    tracker = MessageTracker()
+    workers = ThreadPoolExecutor(max_workers=executorConcurrency)
+    # one per run that may start, receiving waits while all are taken
+    slots = threading.Semaphore(executorConcurrency)
 
     while True:
+        free = 0
         try: 
             if not executionQueueURL:
                 logger.error("Execution URL cannot be None")
                 break
-            logger.info("about to receive sqs messages")
+            slots.acquire()
+            free = 1
+            while free < min(executorConcurrency, SQS_BATCH_SIZE) and slots.acquire(blocking=False):
+                free += 1
+
+            logger.info(f"about to receive up to {free} sqs messages")
             res = sqs.receive_message(
                 QueueUrl=executionQueueURL,
-                MaxNumberOfMessages=5,
+                MaxNumberOfMessages=free,
                 WaitTimeSeconds=5,
-                VisibilityTimeout=60,
+                VisibilityTimeout=VISIBILITY_TIMEOUT,
             )
             logger.info("received these as messages: \n" + json.dumps(res, indent=2))
 
-            messages = res.get("Messages", [])
-
-            for message in messages:
-                try:
-                    body = json.loads(message["Body"])
-                    code = body["code"]
-                    language: str = body["language"]
-
-                    if language.lower() != "java":
-                        continue
-
-                    logger.info(f"Executing Java Code")
-
-                    start_time = time.time()
-                    result = executor.execute_java(code)
-                    execution_time = time.time() - start_time
-
-                    result["execution_time"] = execution_time
-                    result["language"] = language
-                    result['worker'] = "java-executor"
-
-                    result_key = f"execution:{body['task_id']}"
-                    redis_client.setex(result_key, 600, json.dumps(result))
-
-                    logger.info(f"Execution completed in {execution_time:.2f}s")
-
-                    sqs.delete_message(
-                        QueueUrl=executionQueueURL,
-                        ReceiptHandle=message['ReceiptHandle']
-                    )
-
-                except Exception as e:
-                    logger.error(f"Failed to process message: {e}")
-                    result = {
-                        "success": False,
-                        "output": "There was a problem with our servers or formatting of the code, please try again later",
-                        "errors": str(e),
-                        "stage": "execution",
-                        "exit_code": 500
-                    }
-                    result_key = f"execution:{body['task_id']}"
-                    redis_client.setex(result_key, 600, json.dumps(result))
-                    sqs.delete_message(
-                        QueueUrl=executionQueueURL,
-                        ReceiptHandle=message['ReceiptHandle']
-                    )
-
-                except KeyboardInterrupt:
-                    logger.info("Shutting down executor")
-                    break
+            for message in res.get("Messages", []):
+                tracker.start(message)
+                workers.submit(run_message, executor, tracker, slots, message)
+                free -= 1
+        except KeyboardInterrupt:
+            logger.info("Shutting down executor")
+            break
         except Exception as e:
             logger.error(f"Error in main loop: {e}")
             time.sleep(5)  # Wait before retrying
+        finally:
+            for _ in range(free):
+                slots.release()
+
+    workers.shutdown(wait=True)
 
 if __name__ == "__main__":
     logger.info(f"Starting java code executor")
@@ -1,9 +1,16 @@
 import os
 import json
+import uuid
+import base64
+import queue
+import select
+import signal
 import subprocess
 import tempfile
+import threading
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 import redis
 
@@ -15,28 +22,334 @@ logger = logging.getLogger(__name__)
 redisURL = os.getenv("REDIS_URL_OCR")
 executionQueueURL = os.getenv("EXECUTION_QUEUE_JAVASCRIPT_URL")
 awsRegion = os.getenv("AWS_REGION")
+# submissions run at the same time, one per CPU unless set
+executorConcurrency = int(os.getenv("EXECUTOR_CONCURRENCY", str(os.cpu_count() or 1)))
+# warm node processes running runner.js, 0 starts node for every submission
+nodePoolSize = int(os.getenv("NODE_POOL_SIZE", str(executorConcurrency)))
+# submissions a runner takes before it is replaced
+nodeRunnerMaxRuns = int(os.getenv("NODE_RUNNER_MAX_RUNS", "100"))
 
 # Initialize services
 redis_client = redis.from_url(redisURL)
 sqs = boto3.client('sqs', region_name=awsRegion)
 
+# the API sets cancel:<task_id> when a task is cancelled
+CANCEL_POLL_INTERVAL = 0.25 # seconds
+
+class ExecutionCancelled(Exception):
+    pass
+
+def is_cancelled(task_id) -> bool:
+    if not task_id:
+        return False
+    try:
+        return redis_client.exists(f"cancel:{task_id}") == 1
+    except Exception as e:
+        logger.warning(f"Could not check cancel flag for {task_id}: {e}")
+        return False
+
+def cancelled_result() -> dict:
+    return {
+        "success": False,
+        "output": None,
+        "errors": "Execution was cancelled",
+        "stage": "cancelled",
+        "cancelled": True
+    }
+
+RUNNER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "runner.js")
+# how long past its own time limit a runner may take to answer
+RUNNER_GRACE = 2 # seconds
+
+class RunnerError(Exception):
+    """The runner died or broke protocol, the submission itself is not at fault"""
+
+class RunnerUnavailable(RunnerError):
+    """The runner did not take the request, so the submission has not run"""
+
+class RunnerDied(RunnerError):
+    """
+    The runner exited during a run, usually killed by the submission itself,
+    with the output that reached the executor before it did
+    """
+    def __init__(self, exit_code: int, stdout: str, stderr: str):
+        super().__init__(f"runner exited with {exit_code}")
+        self.exit_code = exit_code
+        self.stdout = stdout
+        self.stderr = stderr
+
+class NodeRunner:
+    """
+    One node process running runner.js, which runs each submission in a new
+    worker thread. See runner.js for the protocol, the answers come back on
+    their own pipe rather than stdout.
+    """
+    def __init__(self):
+        self.results, result_write = os.pipe()
+        try:
+            self.process = subprocess.Popen(
+                ["node", RUNNER, str(nodeRunnerMaxRuns), str(result_write)],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                bufsize=0,
+                cwd=tempfile.gettempdir(),
+                start_new_session=True,
+                pass_fds=(result_write,)
+            )
+        except Exception:
+            os.close(self.results)
+            raise
+        finally:
+            os.close(result_write)
+        self.buffer = b""
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.process.wait()
+        os.close(self.results)
+
+    def run(self, code: str, timeout: float, memory_limit: int, deadline: float, task_id=None) -> dict:
+        request_id = uuid.uuid4().hex
+        request = json.dumps({
+            "id": request_id,
+            "code": code,
+            "timeout_ms": int(timeout * 1000),
+            "memory_mb": memory_limit // (1024*1024)
+        }) + "\n"
+        view = memoryview(request.encode("utf-8"))
+        try:
+            while view:
+                view = view[os.write(self.process.stdin.fileno(), view):]
+        except OSError as e:
+            raise RunnerUnavailable(f"runner is not accepting requests: {e}")
+
+        output = {"stdout": b"", "stderr": b""}
+        while True:
+            message = self.read_message(deadline, task_id, output)
+            if message.get("id") != request_id:
+                raise RunnerError("runner answered a different request")
+            if "stream" not in message:
+                break
+            try:
+                output[message["stream"]] += base64.b64decode(message["data"])
+            except (KeyError, ValueError) as e:
+                raise RunnerError(f"runner answered out of protocol: {e}")
+        message["stdout"] = output["stdout"].decode("utf-8", errors="replace")
+        message["stderr"] = output["stderr"].decode("utf-8", errors="replace")
+        return message
+
+    def read_message(self, deadline: float, task_id, output: dict) -> dict:
+        fd = self.results
+        while b"\n" not in self.buffer:
+            ready, _, _ = select.select([fd], [], [], CANCEL_POLL_INTERVAL)
+            if ready:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    raise RunnerDied(
+                        self.process.wait(),
+                        output["stdout"].decode("utf-8", errors="replace"),
+                        output["stderr"].decode("utf-8", errors="replace")
+                    )
+                self.buffer += chunk
+                continue
+            if time.time() >= deadline:
+                raise subprocess.TimeoutExpired(self.process.args, RUNNER_GRACE)
+            if is_cancelled(task_id):
+                raise ExecutionCancelled()
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        try:
+            return json.loads(line)
+        except ValueError as e:
+            raise RunnerError(f"runner answered out of protocol: {e}")
+
+class NodeRunnerPool:
+    """
+    Warm runners shared by the executor. A runner that has to be recycled,
+    timed out or died is killed and a new one is started in the background.
+    """
+    def __init__(self, size: int, memory_limit: int):
+        self.memory_limit = memory_limit
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        # idle plus starting, 0 means nothing will become available
+        self.available = 0
+        for _ in range(size):
+            self.replace()
+
+    def replace(self):
+        with self.lock:
+            self.available += 1
+        threading.Thread(target=self.start, daemon=True).start()
+
+    def start(self):
+        try:
+            runner = NodeRunner()
+            # the first worker thread of a process is the slowest to start
+            runner.run("", 10, self.memory_limit, time.time() + 30)
+        except Exception as e:
+            logger.error(f"Could not start a node runner: {e}")
+            with self.lock:
+                self.available -= 1
+            return
+        self.idle.put(runner)
+
+    def acquire(self, timeout: float):
+        """
+        An idle runner, or None when none is ready within `timeout`
+        """
+        with self.lock:
+            if self.available == 0:
+                return None
+        try:
+            runner = self.idle.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self.lock:
+            self.available -= 1
+        return runner
+
+    def release(self, runner, reusable: bool):
+        if reusable and runner.alive():
+            with self.lock:
+                self.available += 1
+            self.idle.put(runner)
+            return
+        runner.kill()
+        self.replace()
+
 class CodeExecutor:
     def __init__(self):
         self.timeout = 10 # seconds
         self.memory_limit = 128 * 1024 * 1024 #128MB
+        self.runners = None
+        if nodePoolSize > 0 and os.path.exists(RUNNER):
+            self.runners = NodeRunnerPool(nodePoolSize, self.memory_limit)
+
+    def run_process(self, cmd, task_id=None, **kwargs):
+        """
+        subprocess.run with capture_output and self.timeout that also stops
+        when the task is cancelled. The child runs in its own process group
+        so anything it spawned is killed with it.
+        """
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            start_new_session=True,
+            **kwargs
+        )
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                stdout, stderr = process.communicate(timeout=CANCEL_POLL_INTERVAL)
+                return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+            except subprocess.TimeoutExpired:
+                pass
+
+            if time.time() >= deadline:
+                self.kill_process_group(process)
+                raise subprocess.TimeoutExpired(cmd, self.timeout)
+            if is_cancelled(task_id):
+                self.kill_process_group(process)
+                raise ExecutionCancelled()
+
+    def kill_process_group(self, process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.communicate()
         
-    def execute_javascript(self, code: str):
+    def execute_javascript(self, code: str, task_id=None):
+        runner = self.runners.acquire(self.timeout) if self.runners else None
+        if runner is None:
+            return self.execute_javascript_subprocess(code, task_id)
+
+        reusable = False
+        try:
+            run = runner.run(
+                code,
+                self.timeout,
+                self.memory_limit,
+                time.time() + self.timeout + RUNNER_GRACE,
+                task_id
+            )
+            reusable = not run["recycle"]
+            if run["status"] == "timeout":
+                raise subprocess.TimeoutExpired("node", self.timeout)
+            if run["status"] == "memory":
+                return {
+                    "success": False,
+                    "output": run["stdout"],
+                    "errors": run["stderr"] + "Memory limit exceeded",
+                    "stage": "execution"
+                }
+            return {
+                "success": run["exit_code"] == 0,
+                "output": run["stdout"],
+                "errors": run["stderr"] if run["exit_code"] != 0 else None,
+                "stage": "execution",
+                "exit_code": run["exit_code"]
+            }
+        except RunnerUnavailable as e:
+            logger.warning(f"Node runner failed, starting node instead: {e}")
+            return self.execute_javascript_subprocess(code, task_id)
+        except RunnerDied as e:
+            # what node main.js reports when the submission kills itself
+            logger.warning(f"Node runner died during a run: {e}")
+            return {
+                "success": False,
+                "output": e.stdout,
+                "errors": e.stderr,
+                "stage": "execution",
+                "exit_code": e.exit_code
+            }
+        except RunnerError as e:
+            # the submission may have run already, running it again could
+            # repeat its side effects
+            logger.warning(f"Node runner failed during a run: {e}")
+            return {
+                "success": False,
+                "output": None,
+                "errors": "Code execution failed",
+                "stage": "execution"
+            }
+        except ExecutionCancelled:
+            return cancelled_result()
+        except subprocess.TimeoutExpired:
+            return {
+                "success": False,
+                "output": None,
+                "errors": "Code execution timed out",
+                "stage": "execution"
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "output": None,
+                "errors": str(e),
+                "stage": "setup"
+            }
+        finally:
+            self.runners.release(runner, reusable)
+
+    def execute_javascript_subprocess(self, code: str, task_id=None):
         try:
             with tempfile.NamedTemporaryFile(mode="w", suffix=".js", delete=False) as tf:
                 tf.write(code)
                 js_file = tf.name
             
             try:
-                result = subprocess.run(
+                result = self.run_process(
                     ["node", f"{js_file}"],
-                    capture_output=True,
-                    text=True,
-                    timeout=self.timeout
+                    task_id=task_id
                 )
                 
                 return {
@@ -50,6 +363,8 @@ class CodeExecutor:
             finally:
                 os.unlink(js_file)
                 
+        except ExecutionCancelled:
+            return cancelled_result()
         except subprocess.TimeoutExpired:
             return {
                 "success": False,
@@ -66,77 +381,174 @@ class CodeExecutor:
             }
 
 
+# how long a received message stays hidden, extended while it runs
+VISIBILITY_TIMEOUT = 60 # seconds
+HEARTBEAT_INTERVAL = 20 # seconds
+# SQS takes at most 10 entries per batch call
+SQS_BATCH_SIZE = 10
+DELETE_FLUSH_INTERVAL = 1 # seconds
+
+class MessageTracker:
+    """
+    Keeps the messages being executed invisible with a heartbeat and deletes
+    finished ones in batches.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # message id -> receipt handle
+        self.in_flight = {}
+        self.finished = queue.Queue()
+        threading.Thread(target=self.heartbeat, daemon=True).start()
+        threading.Thread(target=self.delete_finished, daemon=True).start()
+
+    def start(self, message):
+        with self.lock:
+            self.in_flight[message['MessageId']] = message['ReceiptHandle']
+
+    def finish(self, message, delete: bool):
+        with self.lock:
+            self.in_flight.pop(message['MessageId'], None)
+        if delete:
+            self.finished.put(message['ReceiptHandle'])
+
+    def heartbeat(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self.lock:
+                handles = list(self.in_flight.values())
+            for i in range(0, len(handles), SQS_BATCH_SIZE):
+                entries = [
+                    {"Id": str(n), "ReceiptHandle": handle, "VisibilityTimeout": VISIBILITY_TIMEOUT}
+                    for n, handle in enumerate(handles[i:i + SQS_BATCH_SIZE])
+                ]
+                try:
+                    res = sqs.change_message_visibility_batch(QueueUrl=executionQueueURL, Entries=entries)
+                    for failure in res.get("Failed", []):
+                        # a message that finished meanwhile can no longer be changed
+                        logger.debug(f"Could not extend visibility: {failure.get('Message')}")
+                except Exception as e:
+                    logger.warning(f"Could not extend message visibility: {e}")
+
+    def delete_finished(self):
+        while True:
+            handles = [self.finished.get()]
+            deadline = time.time() + DELETE_FLUSH_INTERVAL
+            while len(handles) < SQS_BATCH_SIZE:
+                try:
+                    handles.append(self.finished.get(timeout=max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+            entries = [{"Id": str(n), "ReceiptHandle": handle} for n, handle in enumerate(handles)]
+            try:
+                res = sqs.delete_message_batch(QueueUrl=executionQueueURL, Entries=entries)
+                for failure in res.get("Failed", []):
+                    logger.error(f"Failed to delete message: {failure.get('Message')}")
+            except Exception as e:
+                logger.error(f"Failed to delete {len(entries)} messages: {e}")
+
+def execute_message(executor, message) -> bool:
+    """
+    Runs one message and stores its result, returns whether to delete it
+    """
+    body = {}
+    try:
+        body = json.loads(message["Body"])
+        code = body["code"]
+        language: str = body["language"]
+
+        if language.lower() != "javascript":
+            return False
+
+        if is_cancelled(body['task_id']):
+            logger.info(f"Dropping cancelled task {body['task_id']}")
+            result = cancelled_result()
+            result["language"] = language
+            result['worker'] = "javascript-executor"
+            redis_client.setex(f"execution:{body['task_id']}", 600, json.dumps(result))
+            return True
+
+        logger.info(f"Executing JavaScript Code")
+
+        start_time = time.time()
+        result = executor.execute_javascript(code, body['task_id'])
+        execution_time = time.time() - start_time
+
+        result["execution_time"] = execution_time
+        result["language"] = language
+        result['worker'] = "javascript-executor"
+
+        result_key = f"execution:{body['task_id']}"
+        redis_client.setex(result_key, 600, json.dumps(result))
+
+        logger.info(f"Execution completed in {execution_time:.2f}s")
+        return True
+
+    except Exception as e:
+        logger.error(f"Failed to process message: {e}")
+        if 'task_id' not in body:
+            return True
+        result = {
+            "success": False,
+            "output": "There was a problem with our servers or formatting of the code, please try again later",
+            "errors": str(e),
+            "stage": "execution",
+            "exit_code": 500
+        }
+        result_key = f"execution:{body['task_id']}"
+        redis_client.setex(result_key, 600, json.dumps(result))
+        return True
+
+def run_message(executor, tracker, slots, message):
+    delete = False
+    try:
+        delete = execute_message(executor, message)
+    finally:
+        tracker.finish(message, delete)
+        slots.release()
+
 def process_execution_messages(): 
     logger.info("initializing the executor class")
     executor = CodeExecutor()
+    tracker = MessageTracker()
+    workers = ThreadPoolExecutor(max_workers=executorConcurrency)
+    # one per run that may start, receiving waits while all are taken
+    slots = threading.Semaphore(executorConcurrency)
 
     while True:
+        free = 0
         try: 
             if not executionQueueURL:
                 logger.error("Execution URL cannot be None")
                 break
-            logger.info("about to receive sqs messages")
+            slots.acquire()
+            free = 1
+            while free < min(executorConcurrency, SQS_BATCH_SIZE) and slots.acquire(blocking=False):
+                free += 1
+
+            logger.info(f"about to receive up to {free} sqs messages")
             res = sqs.receive_message(
                 QueueUrl=executionQueueURL,
-                MaxNumberOfMessages=5,
+                MaxNumberOfMessages=free,
                 WaitTimeSeconds=5,
-                VisibilityTimeout=60
+                VisibilityTimeout=VISIBILITY_TIMEOUT,
             )
             logger.info("received these as messages: \n" + json.dumps(res, indent=2))
 
-            messages = res.get("Messages", [])
-
-            for message in messages:
-                try:
-                    body = json.loads(message["Body"])
-                    code = body["code"]
-                    language: str = body["language"]
-
-                    if language.lower() != "javascript":
-                        continue
-
-                    logger.info(f"Executing JavaScript Code")
-
-                    start_time = time.time()
-                    result = executor.execute_javascript(code)
-                    execution_time = time.time() - start_time
-
-                    result["execution_time"] = execution_time
-                    result["language"] = language
-                    result['worker'] = "javascript-executor"
-
-                    result_key = f"execution:{body['task_id']}"
-                    redis_client.setex(result_key, 600, json.dumps(result))
-
-                    logger.info(f"Execution completed in {execution_time:.2f}s")
-
-                    sqs.delete_message(
-                        QueueUrl=executionQueueURL,
-                        ReceiptHandle=message['ReceiptHandle']
-                    )
-
-                except Exception as e:
-                    logger.error(f"Failed to process message: {e}")
-                    result = {
-                        "success": False,
-                        "output": "There was a problem with our servers or formatting of the code, please try again later",
-                        "errors": str(e),
-                        "stage": "execution",
-                        "exit_code": 500
-                    }
-                    result_key = f"execution:{body['task_id']}"
-                    redis_client.setex(result_key, 600, json.dumps(result))
-                    sqs.delete_message(
-                        QueueUrl=executionQueueURL,
-                        ReceiptHandle=message['ReceiptHandle']
-                    )
-
-                except KeyboardInterrupt:
-                    logger.info("Shutting down executor")
-                    break
+            for message in res.get("Messages", []):
+                tracker.start(message)
+                workers.submit(run_message, executor, tracker, slots, message)
+                free -= 1
+        except KeyboardInterrupt:
+            logger.info("Shutting down executor")
+            break
         except Exception as e:
             logger.error(f"Error in main loop: {e}")
             time.sleep(5)  # Wait before retrying
+        finally:
+            for _ in range(free):
+                slots.release()
+
+    workers.shutdown(wait=True)
 
 if __name__ == "__main__":
     logger.info(f"Starting java code executor")
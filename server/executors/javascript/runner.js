@@ -0,0 +1,151 @@
+'use strict';
+// Warm runner for the JavaScript executor, so a submission does not pay for
+// starting node. Reads one JSON request per line on stdin,
+//   {"id": "...", "code": "...", "timeout_ms": 10000, "memory_mb": 128}
+// runs the code as a CommonJS module in a new worker thread, with its own heap
+// capped at memory_mb, and answers on the result fd with JSON lines: the
+// output as it arrives, base64 encoded,
+//   {"id": "...", "stream": "stdout" | "stderr", "data": "..."}
+// then the outcome,
+//   {"id": "...", "status": "ok" | "timeout" | "memory", "exit_code": 0,
+//    "recycle": false}
+// The output comes first so a submission that kills the whole runner still
+// leaves what it printed behind, as it would have running under plain node.
+// After maxRuns runs, or any run that hit a limit, the answer has recycle set
+// and this process exits so the executor can start a fresh one.
+//
+// The answers do not go to stdout, which a submission can write to with fs,
+// and carry the request's id, which the submission never sees, so it cannot
+// pass off output of its own as an answer.
+//
+// usage: node runner.js <maxRuns> <resultFd>
+
+const fs = require('fs');
+const { Worker } = require('worker_threads');
+const readline = require('readline');
+const util = require('util');
+
+const maxRuns = Number(process.argv[2] || 100);
+const resultFd = Number(process.argv[3]);
+// per stream, the rest of the output is dropped
+const MAX_OUTPUT = 1024 * 1024;
+// how long to wait for the output streams once the worker has exited
+const DRAIN_MS = 100;
+
+// runs inside the worker, like `node main.js` with the submission in main.js
+const WORKER_SOURCE = `
+const { workerData } = require('worker_threads');
+const { createRequire } = require('module');
+const path = require('path');
+const vm = require('vm');
+
+const filename = path.join(workerData.cwd, 'main.js');
+const main = vm.compileFunction(
+  workerData.code,
+  ['exports', 'require', 'module', '__filename', '__dirname'],
+  { filename }
+);
+const module_ = { exports: {}, filename, id: '.', loaded: false };
+const require_ = createRequire(filename);
+// so that require.main === module holds, as it does under node main.js
+require_.main = module_;
+main.call(module_.exports, module_.exports, require_, module_, filename, workerData.cwd);
+module_.loaded = true;
+`;
+
+function send(message) {
+  const data = Buffer.from(`${JSON.stringify(message)}\n`, 'utf8');
+  let written = 0;
+  while (written < data.length) {
+    written += fs.writeSync(resultFd, data, written);
+  }
+}
+
+function capture(id, name, stream) {
+  let size = 0;
+  stream.on('data', (chunk) => {
+    if (size < MAX_OUTPUT) {
+      send({ id, stream: name, data: chunk.subarray(0, MAX_OUTPUT - size).toString('base64') });
+      size += chunk.length;
+    }
+  });
+  return new Promise((resolve) => {
+    stream.on('end', resolve);
+    stream.on('close', resolve);
+  });
+}
+
+function formatUncaught(error) {
+  if (error instanceof Error && error.stack) {
+    // the frames from the first one of WORKER_SOURCE on are the runner's own
+    const lines = error.stack.split('\n');
+    const runnerFrame = lines.findIndex((line) => line.includes('[worker eval]'));
+    return `${(runnerFrame < 0 ? lines : lines.slice(0, runnerFrame)).join('\n')}\n`;
+  }
+  return `Uncaught ${util.inspect(error)}\n`;
+}
+
+function run({ id, code, timeout_ms: timeoutMs, memory_mb: memoryMb }) {
+  return new Promise((resolve) => {
+    const worker = new Worker(WORKER_SOURCE, {
+      eval: true,
+      workerData: { code, cwd: process.cwd() },
+      stdout: true,
+      stderr: true,
+      resourceLimits: {
+        maxOldGenerationSizeMb: memoryMb,
+        maxYoungGenerationSizeMb: Math.max(Math.floor(memoryMb / 8), 4),
+      },
+    });
+    const stdout = capture(id, 'stdout', worker.stdout);
+    const stderr = capture(id, 'stderr', worker.stderr);
+    let status = 'ok';
+    let uncaught = null;
+
+    const timer = setTimeout(() => {
+      status = 'timeout';
+      worker.terminate();
+    }, timeoutMs);
+
+    worker.on('error', (error) => {
+      if (error && error.code === 'ERR_WORKER_OUT_OF_MEMORY') {
+        status = 'memory';
+      } else {
+        uncaught = formatUncaught(error);
+      }
+    });
+
+    worker.on('exit', async (exitCode) => {
+      clearTimeout(timer);
+      const drained = new Promise((done) => setTimeout(done, DRAIN_MS));
+      await Promise.race([Promise.all([stdout, stderr]), drained]);
+      if (uncaught) {
+        // after the output, the same order node prints them in
+        send({ id, stream: 'stderr', data: Buffer.from(uncaught).toString('base64') });
+      }
+      resolve({ id, status, exit_code: exitCode });
+    });
+  });
+}
+
+async function main() {
+  const lines = readline.createInterface({ input: process.stdin, crlfDelay: Infinity });
+  let runs = 0;
+  for await (const line of lines) {
+    if (!line.trim()) {
+      continue;
+    }
+    const result = await run(JSON.parse(line));
+    runs += 1;
+    result.recycle = result.status !== 'ok' || runs >= maxRuns;
+    send(result);
+    if (result.recycle) {
+      process.exit(0);
+    }
+  }
+}
+
+main().catch((error) => {
+  process.stderr.write(formatUncaught(error));
+  process.exit(1);
+});
@@ -1,9 +1,13 @@
 import os
+import sys
 import json
+import queue
+import signal
 import subprocess
-import tempfile
+import threading
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 import redis
 
@@ -15,17 +19,164 @@ logger = logging.getLogger(__name__)
 redisURL = os.getenv("REDIS_URL_OCR")
 executionQueueURL = os.getenv("EXECUTION_QUEUE_PYTHON_URL")
 awsRegion = os.getenv("AWS_REGION")
+# submissions run at the same time, one per CPU unless set
+executorConcurrency = int(os.getenv("EXECUTOR_CONCURRENCY", str(os.cpu_count() or 1)))
+# idle interpreters kept ready, and how many may be started per second
+poolSize = int(os.getenv("PYTHON_POOL_SIZE", str(max(executorConcurrency, 4))))
+poolRefillRate = float(os.getenv("PYTHON_POOL_REFILL_RATE", "20"))
 
 # Initialize services
 redis_client = redis.from_url(redisURL)
 sqs = boto3.client('sqs', region_name=awsRegion)
 
+# the API sets cancel:<task_id> when a task is cancelled
+CANCEL_POLL_INTERVAL = 0.25 # seconds
+
+class ExecutionCancelled(Exception):
+    pass
+
+def is_cancelled(task_id) -> bool:
+    if not task_id:
+        return False
+    try:
+        return redis_client.exists(f"cancel:{task_id}") == 1
+    except Exception as e:
+        logger.warning(f"Could not check cancel flag for {task_id}: {e}")
+        return False
+
+def cancelled_result() -> dict:
+    return {
+        "success": False,
+        "output": None,
+        "errors": "Execution was cancelled",
+        "stage": "cancelled",
+        "cancelled": True
+    }
+
+BOOTSTRAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bootstrap.py")
+
+class WarmPool:
+    """
+    Interpreters started ahead of time with bootstrap.py, idle until they
+    are handed one submission on stdin. Every process runs exactly one
+    submission and a background thread starts its replacement, no faster
+    than refill_rate processes per second.
+    """
+    def __init__(self, size: int, refill_rate: float, memory_limit: int, cpu_seconds: int):
+        self.size = size
+        self.refill_interval = 1 / refill_rate if refill_rate > 0 else 0
+        self.cmd = [sys.executable, BOOTSTRAP, str(memory_limit), str(cpu_seconds)]
+        self.env = os.environ.copy()
+        self.env['PYTHONDONTWRITEBYTECODE'] = '1'
+        self.idle = queue.Queue()
+        self.wanted = threading.Event()
+        self.closed = False
+        if size > 0:
+            threading.Thread(target=self.refill, daemon=True).start()
+
+    def spawn(self):
+        return subprocess.Popen(
+            self.cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            start_new_session=True,
+            env=self.env
+        )
+
+    def refill(self):
+        while not self.closed:
+            if self.idle.qsize() >= self.size:
+                self.wanted.wait()
+                self.wanted.clear()
+                continue
+            try:
+                self.idle.put(self.spawn())
+            except Exception as e:
+                logger.error(f"Could not start a pool interpreter: {e}")
+            time.sleep(self.refill_interval)
+
+    def acquire(self, timeout: float):
+        """
+        An idle process and the seconds spent waiting for it. Falls back to
+        starting one directly when none becomes ready within `timeout`.
+        """
+        start = time.time()
+        while self.size > 0:
+            remaining = timeout - (time.time() - start)
+            try:
+                process = self.idle.get(timeout=max(remaining, 0))
+            except queue.Empty:
+                logger.warning(f"No warm interpreter after {timeout}s, starting one")
+                break
+            finally:
+                self.wanted.set()
+            # idle processes can still die, e.g. killed for memory
+            if process.poll() is None:
+                return process, time.time() - start
+        return self.spawn(), time.time() - start
+
+    def close(self):
+        self.closed = True
+        self.wanted.set()
+        while True:
+            try:
+                process = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            process.kill()
+            process.wait()
+
 class CodeExecutor:
     def __init__(self):
         self.timeout = 10 # seconds
         self.memory_limit = 128 * 1024 * 1024 #128MB
+        self.pool = WarmPool(poolSize, poolRefillRate, self.memory_limit, self.timeout)
+
+    def run_process(self, cmd, task_id=None, **kwargs):
+        """
+        subprocess.run with capture_output and self.timeout that also stops
+        when the task is cancelled. The child runs in its own process group
+        so anything it spawned is killed with it.
+        """
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            start_new_session=True,
+            **kwargs
+        )
+        return self.wait_process(process, task_id)
+
+    def wait_process(self, process, task_id=None, input=None):
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                stdout, stderr = process.communicate(input, timeout=CANCEL_POLL_INTERVAL)
+                return subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr)
+            except subprocess.TimeoutExpired:
+                # a retried communicate() keeps writing the input it was given first
+                input = None
+
+            if time.time() >= deadline:
+                self.kill_process_group(process)
+                raise subprocess.TimeoutExpired(process.args, self.timeout)
+            if is_cancelled(task_id):
+                self.kill_process_group(process)
+                raise ExecutionCancelled()
+
+    def kill_process_group(self, process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.communicate()
         
-    def execute_python(self, code: str):
+    def execute_python(self, code: str, task_id=None):
+        # reported next to the total so slow runs can be told from a starved pool
+        timings = {"queue_wait": None, "run_time": None}
         try:
             dangerous_imports = ['os', 'subprocess', 'sys', 'importlib', '__builtin__']
             
@@ -38,38 +189,31 @@ class CodeExecutor:
                         "stage": "security_check"
                     }
             
-            with tempfile.NamedTemporaryFile(mode="w", suffix=".py", delete=False) as tf:
-                tf.write(code)
-                python_file = tf.name
-                
+            process, timings["queue_wait"] = self.pool.acquire(self.timeout)
+            run_start = time.time()
             try:
-                env = os.environ.copy()
-                env['PYTHONDONTWRITEBYTECODE'] = '1'
-                result = subprocess.run(
-                    ["python3", f"{python_file}"],
-                    capture_output=True,
-                    text=True,
-                    timeout=self.timeout,
-                    env=env
-                )
-                
-                return {
-                    "success": result.returncode == 0,
-                    "output": result.stdout,
-                    "errors": result.stderr if result.returncode != 0 else None,
-                    "stage": "execution",
-                    "exit_code": result.returncode
-                }
-            
+                result = self.wait_process(process, task_id, input=code)
             finally:
-                os.unlink(python_file)
-            
+                timings["run_time"] = time.time() - run_start
+
+            return {
+                "success": result.returncode == 0,
+                "output": result.stdout,
+                "errors": result.stderr if result.returncode != 0 else None,
+                "stage": "execution",
+                "exit_code": result.returncode,
+                **timings
+            }
+
+        except ExecutionCancelled:
+            return {**cancelled_result(), **timings}
         except subprocess.TimeoutExpired:
             return {
                 "success": False,
                 "output": None,
                 "errors": "Code execution timed out",
-                "stage": "execution"
+                "stage": "execution",
+                **timings
             }
         except Exception as e:
             return {
@@ -79,77 +223,180 @@ class CodeExecutor:
                 "stage": "setup"
             }
 
+# how long a received message stays hidden, extended while it runs
+VISIBILITY_TIMEOUT = 60 # seconds
+HEARTBEAT_INTERVAL = 20 # seconds
+# SQS takes at most 10 entries per batch call
+SQS_BATCH_SIZE = 10
+DELETE_FLUSH_INTERVAL = 1 # seconds
+
+class MessageTracker:
+    """
+    Keeps the messages being executed invisible with a heartbeat and deletes
+    finished ones in batches.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # message id -> receipt handle
+        self.in_flight = {}
+        self.finished = queue.Queue()
+        threading.Thread(target=self.heartbeat, daemon=True).start()
+        threading.Thread(target=self.delete_finished, daemon=True).start()
+
+    def start(self, message):
+        with self.lock:
+            self.in_flight[message['MessageId']] = message['ReceiptHandle']
+
+    def finish(self, message, delete: bool):
+        with self.lock:
+            self.in_flight.pop(message['MessageId'], None)
+        if delete:
+            self.finished.put(message['ReceiptHandle'])
+
+    def heartbeat(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self.lock:
+                handles = list(self.in_flight.values())
+            for i in range(0, len(handles), SQS_BATCH_SIZE):
+                entries = [
+                    {"Id": str(n), "ReceiptHandle": handle, "VisibilityTimeout": VISIBILITY_TIMEOUT}
+                    for n, handle in enumerate(handles[i:i + SQS_BATCH_SIZE])
+                ]
+                try:
+                    res = sqs.change_message_visibility_batch(QueueUrl=executionQueueURL, Entries=entries)
+                    for failure in res.get("Failed", []):
+                        # a message that finished meanwhile can no longer be changed
+                        logger.debug(f"Could not extend visibility: {failure.get('Message')}")
+                except Exception as e:
+                    logger.warning(f"Could not extend message visibility: {e}")
+
+    def delete_finished(self):
+        while True:
+            handles = [self.finished.get()]
+            deadline = time.time() + DELETE_FLUSH_INTERVAL
+            while len(handles) < SQS_BATCH_SIZE:
+                try:
+                    handles.append(self.finished.get(timeout=max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+            entries = [{"Id": str(n), "ReceiptHandle": handle} for n, handle in enumerate(handles)]
+            try:
+                res = sqs.delete_message_batch(QueueUrl=executionQueueURL, Entries=entries)
+                for failure in res.get("Failed", []):
+                    logger.error(f"Failed to delete message: {failure.get('Message')}")
+            except Exception as e:
+                logger.error(f"Failed to delete {len(entries)} messages: {e}")
+
+def execute_message(executor, message) -> bool:
+    """
+    Runs one message and stores its result, returns whether to delete it
+    """
+    body = {}
+    try:
+        body = json.loads(message["Body"])
+        code = body["code"]
+        language: str = body["language"]
+
+        if language.lower() != "python":
+            return False
+
+        if is_cancelled(body['task_id']):
+            logger.info(f"Dropping cancelled task {body['task_id']}")
+            result = cancelled_result()
+            result["language"] = language
+            result['worker'] = "python-executor"
+            redis_client.setex(f"execution:{body['task_id']}", 600, json.dumps(result))
+            return True
+
+        logger.info(f"Executing Python Code")
+
+        start_time = time.time()
+        result = executor.execute_python(code, body['task_id'])
+        execution_time = time.time() - start_time
+
+        result["execution_time"] = execution_time
+        result["language"] = language
+        result['worker'] = "python-executor"
+
+        result_key = f"execution:{body['task_id']}"
+        redis_client.setex(result_key, 600, json.dumps(result))
+
+        if result.get("run_time") is not None:
+            logger.info(
+                f"Execution completed in {execution_time:.2f}s "
+                f"(queue wait {result['queue_wait']:.3f}s, run {result['run_time']:.3f}s)"
+            )
+        else:
+            logger.info(f"Execution completed in {execution_time:.2f}s")
+        return True
+
+    except Exception as e:
+        logger.error(f"Failed to process message: {e}")
+        if 'task_id' not in body:
+            return True
+        result = {
+            "success": False,
+            "output": "There was a problem with our servers or formatting of the code, please try again later",
+            "errors": str(e),
+            "stage": "execution",
+            "exit_code": 500
+        }
+        result_key = f"execution:{body['task_id']}"
+        redis_client.setex(result_key, 600, json.dumps(result))
+        return True
+
+def run_message(executor, tracker, slots, message):
+    delete = False
+    try:
+        delete = execute_message(executor, message)
+    finally:
+        tracker.finish(message, delete)
+        slots.release()
+
 def process_execution_messages(): 
     logger.info("initializing the executor class")
     executor = CodeExecutor()
+    tracker = MessageTracker()
+    workers = ThreadPoolExecutor(max_workers=executorConcurrency)
+    # one per run that may start, receiving waits while all are taken
+    slots = threading.Semaphore(executorConcurrency)
 
     while True:
+        free = 0
         try: 
             if not executionQueueURL:
                 logger.error("Execution URL cannot be None")
                 break
-            logger.info("about to receive sqs messages")
+            slots.acquire()
+            free = 1
+            while free < min(executorConcurrency, SQS_BATCH_SIZE) and slots.acquire(blocking=False):
+                free += 1
+
+            logger.info(f"about to receive up to {free} sqs messages")
             res = sqs.receive_message(
                 QueueUrl=executionQueueURL,
-                MaxNumberOfMessages=5,
+                MaxNumberOfMessages=free,
                 WaitTimeSeconds=5,
-                VisibilityTimeout=60,
+                VisibilityTimeout=VISIBILITY_TIMEOUT,
             )
             logger.info("received these as messages: \n" + json.dumps(res, indent=2))
 
-            messages = res.get("Messages", [])
-
-            for message in messages:
-                try:
-                    body = json.loads(message["Body"])
-                    code = body["code"]
-                    language: str = body["language"]
-
-                    if language.lower() != "python":
-                        continue
-
-                    logger.info(f"Executing Python Code")
-
-                    start_time = time.time()
-                    result = executor.execute_python(code)
-                    execution_time = time.time() - start_time
-
-                    result["execution_time"] = execution_time
-                    result["language"] = language
-                    result['worker'] = "python-executor"
-
-                    result_key = f"execution:{body['task_id']}"
-                    redis_client.setex(result_key, 600, json.dumps(result))
-
-                    logger.info(f"Execution completed in {execution_time:.2f}s")
-
-                    sqs.delete_message(
-                        QueueUrl=executionQueueURL,
-                        ReceiptHandle=message['ReceiptHandle']
-                    )
-
-                except Exception as e:
-                    logger.error(f"Failed to process message: {e}")
-                    result = {
-                        "success": False,
-                        "output": "There was a problem with our servers or formatting of the code, please try again later",
-                        "errors": str(e),
-                        "stage": "execution",
-                        "exit_code": 500
-                    }
-                    result_key = f"execution:{body['task_id']}"
-                    redis_client.setex(result_key, 600, json.dumps(result))
-                    sqs.delete_message(
-                        QueueUrl=executionQueueURL,
-                        ReceiptHandle=message['ReceiptHandle']
-                    )
-
-                except KeyboardInterrupt:
-                    logger.info("Shutting down executor")
-                    break
+            for message in res.get("Messages", []):
+                tracker.start(message)
+                workers.submit(run_message, executor, tracker, slots, message)
+                free -= 1
+        except KeyboardInterrupt:
+            logger.info("Shutting down executor")
+            break
         except Exception as e:
             logger.error(f"Error in main loop: {e}")
             time.sleep(5)  # Wait before retrying
+        finally:
+            for _ in range(free):
+                slots.release()
+
+    workers.shutdown(wait=True)
 
 if __name__ == "__main__":
     logger.info(f"Starting python code executor")
@@ -0,0 +1,235 @@
+import math
+from typing import Optional
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+# a pixel counts as ink when it differs this much from the page background
+INK_CONTRAST = 64
+# Qwen2.5-VL merges 2x2 patches of 14px into one visual token
+DEFAULT_PATCH_FACTOR = 28
+# ink fractions of the cropped page mapped onto the min/max token budget
+SPARSE_DENSITY = 0.01
+DENSE_DENSITY = 0.12
+# handwritten characters are roughly this wide relative to the line height
+CHAR_ASPECT = 0.5
+
+
+def load_grayscale(image: Image.Image) -> Image.Image:
+    """
+    Flattens PencilKit's transparent background onto white and converts to L
+    """
+    if image.mode in ("RGBA", "LA") or (
+        image.mode == "P" and "transparency" in image.info
+    ):
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image)
+    return image.convert("L")
+
+
+def ink_mask(gray: Image.Image) -> np.ndarray:
+    """
+    Boolean mask of ink pixels. The background is taken to be the median
+    tone, so light-on-dark exports work the same as dark-on-light ones.
+    """
+    pixels = np.asarray(gray, dtype=np.int16)
+    background = int(np.median(pixels))
+    return np.abs(pixels - background) > INK_CONTRAST
+
+
+def ink_bbox(
+    mask: np.ndarray, margin: int = 0
+) -> Optional[tuple[int, int, int, int]]:
+    """
+    (left, top, right, bottom) of the ink in `mask`, or None for a blank page
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if rows.size == 0:
+        return None
+
+    height, width = mask.shape
+    return (
+        max(int(cols[0]) - margin, 0),
+        max(int(rows[0]) - margin, 0),
+        min(int(cols[-1]) + 1 + margin, width),
+        min(int(rows[-1]) + 1 + margin, height),
+    )
+
+
+def visual_tokens(width: int, height: int, factor: int = DEFAULT_PATCH_FACTOR) -> int:
+    """
+    Visual tokens the vision encoder produces for an image of this size
+    """
+    return max(round(width / factor), 1) * max(round(height / factor), 1)
+
+
+def text_line_runs(mask: np.ndarray) -> tuple[list[tuple[int, int]], float]:
+    """
+    (top, bottom) row ranges of the text lines in `mask` and the median line
+    height. Lines are runs of rows containing ink; runs much shorter than the
+    median are dots, commas and stray marks, folded into the nearest line.
+    """
+    rows = mask.any(axis=1).astype(np.int8)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], rows, [0]))))
+    runs = [(int(top), int(bottom)) for top, bottom in zip(edges[::2], edges[1::2])]
+    if not runs:
+        return [], 0.0
+
+    line_height = float(np.median([bottom - top for top, bottom in runs]))
+    lines = [run for run in runs if run[1] - run[0] >= 0.35 * line_height]
+    if not lines:
+        return runs, line_height
+
+    for top, bottom in runs:
+        if bottom - top >= 0.35 * line_height:
+            continue
+        nearest = min(
+            range(len(lines)),
+            key=lambda i: max(lines[i][0] - bottom, top - lines[i][1], 0),
+        )
+        line_top, line_bottom = lines[nearest]
+        lines[nearest] = (min(line_top, top), max(line_bottom, bottom))
+    return lines, line_height
+
+
+def estimate_text_layout(mask: np.ndarray) -> dict:
+    """
+    Estimates how many text lines and characters a page of code holds from the
+    ink-row projection. A line's extent from the page's leftmost ink,
+    indentation included, divided by a character width derived from the line
+    height gives its characters.
+    """
+    lines, line_height = text_line_runs(mask)
+    if not lines:
+        return {"lines": 0, "characters": 0}
+
+    char_width = max(CHAR_ASPECT * line_height, 1.0)
+    page_left = int(np.flatnonzero(mask.any(axis=0))[0])
+
+    characters = 0
+    for top, bottom in lines:
+        cols = np.flatnonzero(mask[top:bottom].any(axis=0))
+        characters += math.ceil((int(cols[-1]) + 1 - page_left) / char_width)
+    return {"lines": len(lines), "characters": characters}
+
+
+def segment_lines(image: Image.Image) -> list[dict]:
+    """
+    Splits a drawing into one strip per text line, top to bottom. Each strip
+    has its grayscale crop ("image", padded by a quarter line), the ink mask
+    tight around the line ("mask") and its indentation in pixels from the
+    page's leftmost ink ("indent"), along with the page's median
+    "line_height".
+    """
+    gray = load_grayscale(image)
+    mask = ink_mask(gray)
+    lines, line_height = text_line_runs(mask)
+    if not lines:
+        return []
+
+    height, width = mask.shape
+    page_left = int(np.flatnonzero(mask.any(axis=0))[0])
+    pad = max(int(0.25 * line_height), 2)
+
+    strips = []
+    for top, bottom in lines:
+        cols = np.flatnonzero(mask[top:bottom].any(axis=0))
+        left, right = int(cols[0]), int(cols[-1]) + 1
+        strips.append(
+            {
+                "image": gray.crop(
+                    (
+                        max(left - pad, 0),
+                        max(top - pad, 0),
+                        min(right + pad, width),
+                        min(bottom + pad, height),
+                    )
+                ),
+                "mask": mask[top:bottom, left:right],
+                "indent": left - page_left,
+                "line_height": line_height,
+            }
+        )
+    return strips
+
+
+def target_size(
+    width: float,
+    height: float,
+    density: float,
+    factor: int = DEFAULT_PATCH_FACTOR,
+    min_tokens: int = 64,
+    max_tokens: int = 1024,
+) -> tuple[int, int]:
+    """
+    Size to scale a crop of `width` x `height` with this ink density to: its
+    share of [min_tokens, max_tokens], never larger than the crop, both
+    sides snapped to multiples of `factor`
+    """
+    weight = (density - SPARSE_DENSITY) / (DENSE_DENSITY - SPARSE_DENSITY)
+    target_tokens = min_tokens + (max_tokens - min_tokens) * min(max(weight, 0), 1)
+
+    scale = min(math.sqrt(target_tokens * factor * factor / (width * height)), 1.0)
+    columns = max(round(width * scale / factor), 1)
+    rows = max(round(height * scale / factor), 1)
+    # rounding both sides up can overshoot max_tokens, take it back
+    while columns * rows > max_tokens and max(columns, rows) > 1:
+        if columns >= rows:
+            columns -= 1
+        else:
+            rows -= 1
+    return columns * factor, rows * factor
+
+
+def preprocess_for_ocr(
+    image: Image.Image,
+    factor: int = DEFAULT_PATCH_FACTOR,
+    min_tokens: int = 64,
+    max_tokens: int = 1024,
+    binarize: bool = False,
+    denoise: bool = False,
+) -> tuple[Image.Image, dict]:
+    """
+    Crops to the ink with a margin and scales without distorting the aspect
+    ratio. Denser handwriting gets a bigger share of [min_tokens, max_tokens],
+    the result is never upscaled and both sides are multiples of `factor` so
+    the processor does not resize it again. The stats include the estimated
+    text layout of the full-resolution crop.
+    """
+    gray = load_grayscale(image)
+    if denoise:
+        gray = gray.filter(ImageFilter.MedianFilter(3))
+
+    mask = ink_mask(gray)
+    bbox = ink_bbox(mask)
+    if bbox is not None:
+        left, top, right, bottom = bbox
+        margin = factor // 2 + int(0.03 * max(right - left, bottom - top))
+        bbox = ink_bbox(mask, margin=margin)
+        gray = gray.crop(bbox)
+        left, top, right, bottom = bbox
+        density = float(mask[top:bottom, left:right].mean())
+        layout = estimate_text_layout(mask[top:bottom, left:right])
+    else:
+        density = 0.0
+        layout = estimate_text_layout(mask)
+
+    new_width, new_height = target_size(
+        *gray.size, density, factor, min_tokens, max_tokens
+    )
+    gray = gray.resize((new_width, new_height), Image.LANCZOS)
+
+    if binarize:
+        gray = Image.fromarray(np.where(ink_mask(gray), 0, 255).astype(np.uint8))
+
+    stats = {
+        "ink_density": density,
+        "width": new_width,
+        "height": new_height,
+        "visual_tokens": visual_tokens(new_width, new_height, factor),
+        "text_lines": layout["lines"],
+        "text_characters": layout["characters"],
+    }
+    return gray.convert("RGB"), stats
@@ -2,322 +2,113 @@ from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 import asyncio
-from pydantic import BaseModel
-from PIL import Image
-from io import BytesIO
-from transformers import AutoProcessor, AutoModelForImageTextToText, AutoTokenizer
-import torch
-from io import BytesIO
-from typing import Annotated, Optional
+from typing import Annotated, Any, Optional
 import logging
-from dotenv import load_dotenv
 from os import getenv
-import redis
-from celery import Celery
-from celery.signals import worker_process_init
+import redis.asyncio as aioredis
 import json
-import boto3
-from botocore.exceptions import ClientError
 import time
 from contextlib import asynccontextmanager
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-# Env Variables
-load_dotenv()
-redisOcrURL = getenv("REDIS_URL_OCR")
-redisCeleryURL = getenv("REDIS_URL_CELERY")
-executionQueuePythonURL = getenv("EXECUTION_QUEUE_PYTHON_URL")
-executionQueueJavaScriptURL = getenv("EXECUTION_QUEUE_JAVASCRIPT_URL")
-executionQueueJavaURL = getenv("EXECUTION_QUEUE_JAVA_URL")
-awsRegion = getenv("AWS_REGION")
-
-# initializing services
-redis_client = redis.from_url(redisOcrURL)
-celeryApp = Celery(
-    "ocr_service", broker=redisCeleryURL, backend=redisCeleryURL, include=["main"]
-)
-celeryApp.conf.update(
-    task_serializer="json",
-    accept_content=["json"],
-    result_serializer="json",
-    timezone="UTC",
-    enable_utc=True,
-    result_expires=3600,
-    task_track_started=True,
-    task_time_limit=300,  # 5 minutes
-    task_soft_time_limit=240,  # 4 minutes
-    worker_prefetch_multiplier=1,
-    worker_max_tasks_per_child=1000,
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from uuid import uuid4
+import blob_store
+import cancellation
+from celery_app import (
+    EXECUTE_CODE_TASK,
+    PROCESS_OCR_TASK,
+    celeryApp,
+    redisCeleryURL,
+    redisOcrURL,
 )
-sqs = boto3.client("sqs", region_name=awsRegion)
-
-
-# Model Setup
-model_path = "nanonets/Nanonets-OCR-s"
-
-
-# pydantic models
-class OCRRequest(BaseModel):
-    title: str
-    language: str
-    max_tokens: int = 256
-
-
-class OCRResponse(BaseModel):
-    task_id: str
-    status: str
-    result: Optional[str] = None
-    error: Optional[str] = None
-    cached: Optional[bool] = None
-    execution_time: Optional[float] = None
+import metrics
+from notifications import EventHub, keyspace_pattern
+import ocr_cache
+from schemas import ExecutionRequest, OCRBatchResponse, OCRResponse
+import singleflight
+import strokes as stroke_format
+from streaming import stream_key
 
+# The API only enqueues work by task name; torch, transformers and the model
+# live in tasks.py and are imported by the Celery worker alone.
 
-class ExecutionRequest(BaseModel):
-    code: str
-    language: str
-
-
-# Global model variables (will be loaded in workers)
-model = None
-tokenizer = None
-processor = None
-device = None
-
-
-def load_model():
-    global model, tokenizer, processor, device
-
-    device = "cpu"
-    if torch.backends.mps.is_available():
-        device = "mps"
-    elif torch.cuda.is_available():
-        device = "cuda"
-
-    # Configure precision and quantization based on device
-    if device == "cuda":
-        torch_dtype = torch.float16
-        device_map = "auto"
-    elif device == "mps":
-        bnb_config = None
-        torch_dtype = torch.float32
-        device_map = {"": "mps"}
-    else:
-        bnb_config = None
-        torch_dtype = torch.float32
-        device_map = {"": "cpu"}
+logger = logging.getLogger(__name__)
 
-    # Loading model
-    logger.info(f"Loading model using {device}")
-    try:
-        # local_model_dir = snapshot_download(model_path, cache_dir="/tmp/hf_cache")
-        model = AutoModelForImageTextToText.from_pretrained(
-            model_path,
-            device_map=device_map,
-            offload_folder="/tmp/offload",
-            offload_state_dict=True,
-            torch_dtype=torch_dtype,  # or float32 if you must
-            low_cpu_mem_usage=True,
-            trust_remote_code=True,
-            quantization_config=bnb_config,
-            # torch_dtype=torch.float16, #torch_dtype,
-            # cache_dir="/tmp/hf_cache",
-            # use_cache=False,
-            # offload_folder="/tmp/offload",
-        )
-        # model = model.half()
-        # model = torch.quantization.quantize_dynamic(
-        #     model,
-        #     {torch.nn.Linear},
-        #     dtype=torch.qint8
-        # )
+# Env Variables
+apiRedisPoolSize = int(getenv("API_REDIS_POOL_SIZE", "64"))
+apiBlockingThreads = int(getenv("API_BLOCKING_THREADS", "16"))
+ocrBatchMaxPages = int(getenv("OCR_BATCH_MAX_PAGES", "100"))
 
-        model.eval()
-        tokenizer = AutoTokenizer.from_pretrained(model_path, cache_dir="/tmp/hf_cache")
-        processor = AutoProcessor.from_pretrained(model_path, cache_dir="/tmp/hf_cache")
+BATCH_TTL = 3600  # seconds
 
-        logger.info(f"Model loaded successfully on {device}")
 
-    except Exception as e:
-        logger.error(f"Failed to load model: {e}")
-        raise
+# ======================== FASTAPI Endpoints ========================
 
 
-# ======================== Celery Tasks ========================
+# Redis goes through these pooled asyncio clients and blocking Celery calls
+# through a bounded thread pool, so handlers never stall the event loop
+redis_async = aioredis.Redis(
+    connection_pool=aioredis.BlockingConnectionPool.from_url(
+        redisOcrURL, max_connections=apiRedisPoolSize
+    )
+)
+celery_redis_async = aioredis.Redis(
+    connection_pool=aioredis.BlockingConnectionPool.from_url(
+        redisCeleryURL, max_connections=apiRedisPoolSize
+    )
+)
+blocking_executor = ThreadPoolExecutor(
+    max_workers=apiBlockingThreads, thread_name_prefix="api-blocking"
+)
 
 
-@worker_process_init.connect
-def load_model_on_worker_start(**kwargs):
-    load_model()
+async def run_blocking(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, partial(fn, *args, **kwargs))
 
 
-# OCR function for scanning images using Nanonets ML model
-@celeryApp.task(bind=True, name="ocr_service.process_ocr")
-def process_ocr_task(self, image_bytes: bytes, maxNewTokens=256):
+async def get_celery_task_meta(task_id: str) -> tuple[str, Any]:
     """
-    Celery Task for OCR Processing
+    (state, result) straight from the Celery Redis backend, PENDING if unknown
     """
-    try:
-        self.update_state(state="PROGRESS", meta={"status": "Loading model..."})
-
-        # Decode base64 image
-        import base64
-
-        image_bytes = base64.b64decode(image_bytes)
-        self.update_state(state="PROGRESS", meta={"status": "Processing image..."})
-
-        start_time = time.time()
-
-        from hashlib import md5
-
-        cacheKey = f"ocr:{md5(image_bytes).hexdigest()}"
-        # checks if image_bytes is already in the redis cache as a key
-        cachedResult = redis_client.get(cacheKey)
-        if cachedResult:
-            logger.info("Cache hit for OCR request")
-            return {
-                "status": "SUCCESS",
-                "result": cachedResult.decode("utf-8"),  # type: ignore
-                "execution_time": 0.0,
-                "cached": True,
-            }
-
-        prompt = """Extract the code in the image exactly as it appears, but return it as raw source code with no extra characters. Do not format the code using markdown (e.g., no triple backticks). Do not include escape characters like \\n or \\t. Output must be plain text exactly how it would appear in a .java file. Remove all surrounding quotes, line breaks, or markup."""
-
-        image = Image.open(BytesIO(image_bytes))
-        max_size = 1024 if len(image_bytes) > 1024 * 1024 else 512
-        image = image.resize((max_size, max_size))
-
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {
-                "role": "user",
-                "content": [
-                    {"type": "image", "image": f"{image_bytes}"},
-                    {"type": "text", "text": prompt},
-                ],
-            },
-        ]
-
-        if processor is None:
-            logger.error("processor is not defined")
-            raise RuntimeError("processor is not defined")
-
-        text = processor.apply_chat_template(
-            messages, tokenize=False, add_generation_prompt=True
-        )
-        inputs = processor(
-            text=[text], images=[image], padding=True, return_tensors="pt"
-        )
-        inputs = inputs.to(device)
-
-        if tokenizer is None:
-            logger.error("tokenizer is not defined")
-            raise RuntimeError("tokenizer is not defined")
-
-        if model is None:
-            logger.error("model is not defined")
-            raise RuntimeError("model is not defined")
-
-        with torch.no_grad():
-            output_ids = model.generate(
-                **inputs,
-                max_new_tokens=maxNewTokens,
-                do_sample=False,
-                temperature=0.1,
-                pad_token_id=tokenizer.eos_token_id,
-            )
+    raw = await celery_redis_async.get(f"celery-task-meta-{task_id}")
+    if not raw:
+        return "PENDING", None
+    meta = json.loads(raw)
+    return meta["status"], meta.get("result")
 
-        generate_ids = [
-            output_ids[len(input_ids) :]
-            for input_ids, output_ids in zip(inputs.input_ids, output_ids)
-        ]
-        output_text = processor.batch_decode(
-            generate_ids, skip_special_tokens=True, clean_up_tokenization_spaces=True
-        )
-        clean_result = output_text[0].replace("```", "").replace("\\n", "\n").strip()
-
-        redis_client.setex(cacheKey, 3600, clean_result)
-
-        processing_time = time.time() - start_time
-        logger.info(f"OCR completed in {processing_time:.2f}s")
-
-        return {
-            "status": "SUCCESS",
-            "result": clean_result,
-            "execution_time": processing_time,
-            "cached": False,
-        }
-    except Exception as e:
-        logger.error(f"OCR processing failed: {e}")
-        return {"status": "FAILURE", "error": str(e)}
-
-
-@celeryApp.task(bind=True, name="ocr_service.execute_code")
-def execute_code_task(self, code: str, language: str):
-    try:
-        self.update_state(
-            state="PROGRESS", meta={"status": "Queuing code execution..."}
-        )
-
-        language = language.lower()
 
-        message = {"code": code, "language": language, "task_id": self.request.id}
-
-        if (
-            not executionQueuePythonURL
-            or not executionQueueJavaScriptURL
-            or not executionQueueJavaURL
-        ):
-            logger.error(
-                "EXECUTION URLs Cannot be None, there is a problem with env vars"
-            )
-            return {
-                "status": "FAILURE",
-                "error": "EXECUTION URLs Cannot be None, there is a problem with env vars",
-            }
-
-        def sendMessage(url: str, message: dict[str, str]):
-            sqs.send_message(
-                QueueUrl=url,
-                MessageBody=json.dumps(message),
-            )
-
-        match language:
-            case "python":
-                sendMessage(executionQueuePythonURL, message)
-            case "javascript":
-                sendMessage(executionQueueJavaScriptURL, message)
-            case "java":
-                sendMessage(executionQueueJavaURL, message)
-            case _:
-                logger.error(f"Failed to queue execution: Invalid language passed")
-                return {"status": "FAILURE", "error": "Invalid Language Passed"}
-
-        return {
-            "status": "SUCCESS",
-            "task_id": message["task_id"],
-            "queued_at": time.time(),
-        }
-
-    except ClientError as e:
-        logger.error(f"Failed to queue execution: {e}")
-        return {"status": "FAILURE", "error": str(e)}
-
-
-# ======================== FASTAPI Endpoints ========================
+# SSE streams wait on these instead of polling; they still re-check on their
+# own every STREAM_RECHECK_INTERVAL in case a notification is missed
+event_hub = EventHub()
+STREAM_RECHECK_INTERVAL = 5  # seconds
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting OCR service")
+    try:
+        # executors write execution:<id>, OCR workers append to ocr:stream:<id>
+        await event_hub.start(
+            redisOcrURL,
+            [
+                keyspace_pattern(redis_async, "execution:*"),
+                keyspace_pattern(redis_async, "ocr:stream:*"),
+            ],
+            keyspace=True,
+        )
+        # the Celery Redis backend publishes every state change on the key
+        await event_hub.start(redisCeleryURL, ["celery-task-meta-*"])
+    except Exception as e:
+        logger.error(f"Could not start notification listeners: {e}")
 
     yield
 
     logger.info("Shutting down OCR service")
-    redis_client.close()
+    await event_hub.stop()
+    await redis_async.aclose()
+    await celery_redis_async.aclose()
+    blocking_executor.shutdown(wait=False)
 
 
 # FastAPI app setup
@@ -342,8 +133,9 @@ app.add_middleware(
 @app.get("/health")
 async def health_check():
     try:
-        celery_inspect = celeryApp.control.inspect()
-        active_workers = celery_inspect.active()
+        active_workers = await run_blocking(
+            lambda: celeryApp.control.inspect().active()
+        )
         worker_count = len(active_workers) if active_workers else 0
     except Exception as e:
         worker_count = 0
@@ -352,9 +144,7 @@ async def health_check():
     return {
         "status": "healthy",
         "timestamp": time.time(),
-        "device": device,
         "celery_workers": worker_count,
-        "model_loaded": model is not None,
     }
 
 
@@ -362,22 +152,94 @@ async def health_check():
 async def recognize_code(
     title: Annotated[str, Form()],
     language: Annotated[str, Form()],
-    max_tokens: Annotated[int, Form()] = 256,
-    drawing: UploadFile = File(),
+    # unset lets the worker size the budget from the drawing
+    max_tokens: Annotated[Optional[int], Form()] = None,
+    drawing: Optional[UploadFile] = File(None),
+    # PencilKit strokes (see strokes.py), a much smaller upload than the bitmap
+    strokes: Optional[UploadFile] = File(None),
 ):
+    if (drawing is None) == (strokes is None):
+        raise HTTPException(400, "Send either a drawing or its strokes")
+    if drawing is not None and (
+        not drawing.content_type or not drawing.content_type.startswith("image/")
+    ):
+        raise HTTPException(400, "File must be an image")
+
+    inputKind = "image" if drawing is not None else "strokes"
+    contents = await (drawing or strokes).read()
+    parsedStrokes = None
+    if inputKind == "strokes":
+        try:
+            parsedStrokes = await run_blocking(stroke_format.parse, contents)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
 
     try:
-        if not drawing.content_type or not drawing.content_type.startswith("image/"):
-            raise HTTPException(400, "File must be an image")
-
-        contents = await drawing.read()
-
-        # Encode image as base64 for Celery serialization
-        import base64
-
-        image_b64 = base64.b64encode(contents).decode("utf-8")
+        # cache hits are answered here without a broker round trip. Only the
+        # exact key is computed, hashing the ink (and rasterizing strokes for
+        # it) is left to the worker.
+        cacheKey = ocr_cache.OCRCacheKey(
+            key=await run_blocking(
+                ocr_cache.content_key, contents, inputKind, parsedStrokes
+            )
+        )
+        task_id = str(uuid4())
+        # only exact hits are answered inline, a near-duplicate could be
+        # different code and the client would have no way to tell
+        cachedResult = await ocr_cache.lookup_async(
+            redis_async, cacheKey, near=False
+        )
+        if cachedResult:
+            logger.info("Cache hit for OCR request, skipping the queue")
+            # recorded under a task id too, for clients that poll regardless
+            await run_blocking(
+                celeryApp.backend.store_result,
+                task_id,
+                {
+                    "status": "SUCCESS",
+                    "result": cachedResult,
+                    "execution_time": 0.0,
+                    "cached": True,
+                },
+                "SUCCESS",
+            )
+            return OCRResponse(
+                task_id=task_id,
+                status="completed",
+                result=cachedResult,
+                execution_time=0.0,
+                cached=True,
+            )
 
-        task = process_ocr_task.delay(image_b64, max_tokens)
+        # an identical drawing already queued or running gets the same task
+        # instead of a second inference
+        leased = await singleflight.acquire_async(redis_async, cacheKey.key, task_id)
+        if not leased:
+            inflight_task_id = await singleflight.holder_async(
+                redis_async, cacheKey.key
+            )
+            if inflight_task_id:
+                logger.info(f"Attaching OCR request to in-flight {inflight_task_id}")
+                await singleflight.add_requester_async(redis_async, inflight_task_id)
+                await metrics.incr_async(redis_async, "ocr_singleflight_attached")
+                return OCRResponse(task_id=inflight_task_id, status="processing")
+
+        await singleflight.add_requester_async(redis_async, task_id)
+
+        try:
+            # the image travels out of band, the broker only sees a reference
+            blobRef = await blob_store.put_async(redis_async, contents)
+            task = await run_blocking(
+                celeryApp.send_task,
+                PROCESS_OCR_TASK,
+                args=(blobRef, max_tokens, cacheKey.dump(), inputKind),
+                task_id=task_id,
+            )
+        except Exception:
+            # nothing will ever finish this task, do not let others attach
+            if leased:
+                await singleflight.release_async(redis_async, cacheKey.key, task_id)
+            raise
 
         task_metadata = {
             "title": title,
@@ -386,7 +248,9 @@ async def recognize_code(
             "celery_task_id": task.id,
         }
 
-        redis_client.setex(f"task_meta:{task.id}", 600, json.dumps(task_metadata))
+        await redis_async.setex(
+            f"task_meta:{task.id}", 600, json.dumps(task_metadata)
+        )
 
         return OCRResponse(task_id=task.id, status="processing")
 
@@ -438,32 +302,332 @@ def get_task_status(task_id: str):
 @app.get("/ocr/stream/{task_id}")
 async def get_streamed_task_status(task_id: str, wait: int = 35):
     async def eventgen():
+        with event_hub.listen(
+            f"celery-task-meta-{task_id}", stream_key(task_id)
+        ) as changed:
+            async for event in ocr_events(changed):
+                yield event
+
+    async def ocr_events(changed: asyncio.Event):
         deadline = asyncio.get_event_loop().time() + wait
+        # text the worker has streamed so far, always sent in full so a client
+        # can simply replace what it shows
+        partial = ""
+        last_stream_id = "0-0"
         while asyncio.get_event_loop().time() < deadline:
-            r = celeryApp.AsyncResult(task_id)
-            state = r.state
+            entries = await redis_async.xread({stream_key(task_id): last_stream_id})
+            if entries:
+                for entry_id, fields in entries[0][1]:  # type: ignore
+                    last_stream_id = entry_id
+                    partial += fields[b"text"].decode("utf-8")
+                yield f"data:{json.dumps({'status': 'partial', 'task_id': task_id, 'result': {'status': 'PARTIAL', 'result': partial}})}\n\n"
+
+            state, result = await get_celery_task_meta(task_id)
             if state == "PROGRESS":
-                yield f"data:{json.dumps({'status': 'processing', 'task_id': task_id, 'result': r.info})}\n\n"
+                if not partial:
+                    yield f"data:{json.dumps({'status': 'processing', 'task_id': task_id, 'result': result})}\n\n"
             elif state == "SUCCESS":
-                yield f"data:{json.dumps({'status': 'completed', 'task_id': task_id, 'result': r.result})}\n\n"
+                yield f"data:{json.dumps({'status': 'completed', 'task_id': task_id, 'result': result})}\n\n"
                 break
             elif state == "FAILURE":
-                err = r.result if isinstance(r.result, str) else str(r.result)
+                # the backend stores raised exceptions as exc_type/exc_message
+                if isinstance(result, dict) and "exc_message" in result:
+                    result = result["exc_message"]
+                err = result if isinstance(result, str) else str(result)
                 yield f"data:{json.dumps({'status': 'failed', 'task_id': task_id,  'result': err})}\n\n"
                 break
             else:
                 yield f"data:{json.dumps({'status': state.lower(), 'task_id': task_id, 'result': None})}\n\n"
-            await asyncio.sleep(0.8)
+            remaining = deadline - asyncio.get_event_loop().time()
+            await event_hub.wait(
+                changed, max(min(STREAM_RECHECK_INTERVAL, remaining), 0)
+            )
         else:
             yield f"data:{json.dumps({'status':'timeout', 'task_id': task_id, 'result': None})}\n\n"
 
     return StreamingResponse(content=eventgen(), media_type="text/event-stream")
 
 
+def batch_key(batch_id: str) -> str:
+    return f"ocr_batch:{batch_id}"
+
+
+def page_response(task_id: str, state: str, result: Any) -> OCRResponse:
+    """
+    OCRResponse for one page of a batch from its Celery state and result
+    """
+    if state == "SUCCESS":
+        result = result if isinstance(result, dict) else {}
+        if result.get("status") == "FAILURE":
+            return OCRResponse(
+                task_id=task_id,
+                status="failed",
+                error=result.get("error", "Unknown error"),
+            )
+        return OCRResponse(
+            task_id=task_id,
+            status="completed",
+            result=result.get("result"),
+            execution_time=result.get("execution_time"),
+            cached=result.get("cached"),
+        )
+    elif state == "FAILURE":
+        if isinstance(result, dict) and "exc_message" in result:
+            result = result["exc_message"]
+        return OCRResponse(task_id=task_id, status="failed", error=str(result))
+    elif state == "PROGRESS":
+        return OCRResponse(
+            task_id=task_id,
+            status="processing",
+            result=(result or {}).get("status", "Processing..."),
+        )
+    return OCRResponse(task_id=task_id, status=state.lower())
+
+
+def send_ocr_tasks(messages: list[tuple[str, tuple]]):
+    """
+    Publishes every page's task over one producer, so a batch costs one
+    broker connection instead of one per page
+    """
+    with celeryApp.producer_or_acquire() as producer:
+        for task_id, args in messages:
+            celeryApp.send_task(
+                PROCESS_OCR_TASK, args=args, task_id=task_id, producer=producer
+            )
+
+
+async def get_batch_status(batch_id: str) -> Optional[OCRBatchResponse]:
+    raw = await redis_async.get(batch_key(batch_id))
+    if not raw:
+        return None
+    pages = json.loads(raw)["pages"]
+
+    # every page still running is read from the backend in one round trip
+    pending = [page["task_id"] for page in pages if "result" not in page]
+    metas = {}
+    if pending:
+        raws = await celery_redis_async.mget(
+            [f"celery-task-meta-{task_id}" for task_id in pending]
+        )
+        metas = {
+            task_id: json.loads(meta) for task_id, meta in zip(pending, raws) if meta
+        }
+
+    responses = []
+    for page in pages:
+        if "result" in page:
+            responses.append(
+                OCRResponse(
+                    task_id=page["task_id"],
+                    status="completed",
+                    result=page["result"],
+                    execution_time=0.0,
+                    cached=True,
+                )
+            )
+            continue
+        meta = metas.get(page["task_id"], {"status": "PENDING"})
+        responses.append(
+            page_response(page["task_id"], meta["status"], meta.get("result"))
+        )
+
+    completed = sum(page.status == "completed" for page in responses)
+    failed = sum(page.status == "failed" for page in responses)
+    return OCRBatchResponse(
+        batch_id=batch_id,
+        status="completed" if completed + failed == len(pages) else "processing",
+        total=len(pages),
+        completed=completed,
+        failed=failed,
+        pages=responses,
+    )
+
+
+@app.post("/ocr/batch", response_model=OCRBatchResponse)
+async def recognize_code_batch(
+    title: Annotated[str, Form()],
+    language: Annotated[str, Form()],
+    max_tokens: Annotated[Optional[int], Form()] = None,
+    # images or serialized strokes, told apart by their content type
+    drawings: list[UploadFile] = File(),
+):
+    if len(drawings) > ocrBatchMaxPages:
+        raise HTTPException(400, f"At most {ocrBatchMaxPages} drawings per batch")
+
+    pages = []
+    for upload in drawings:
+        isImage = bool(upload.content_type) and upload.content_type.startswith(
+            "image/"
+        )
+        pages.append(("image" if isImage else "strokes", await upload.read()))
+
+    def content_keys() -> list[str]:
+        keys = []
+        for index, (inputKind, contents) in enumerate(pages):
+            parsedStrokes = None
+            if inputKind == "strokes":
+                try:
+                    parsedStrokes = stroke_format.parse(contents)
+                except ValueError as e:
+                    raise ValueError(f"Drawing {index}: {e}")
+            keys.append(ocr_cache.content_key(contents, inputKind, parsedStrokes))
+        return keys
+
+    try:
+        keys = await run_blocking(content_keys)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    try:
+        cacheKeys = [ocr_cache.OCRCacheKey(key=key) for key in keys]
+        cachedResults = await asyncio.gather(
+            *(
+                ocr_cache.lookup_async(redis_async, key, near=False)
+                for key in cacheKeys
+            )
+        )
+
+        batch_id = str(uuid4())
+        records = []
+        queued = []
+        for (inputKind, contents), cacheKey, cachedResult in zip(
+            pages, cacheKeys, cachedResults
+        ):
+            task_id = str(uuid4())
+            if cachedResult:
+                records.append({"task_id": task_id, "result": cachedResult})
+                continue
+
+            # pages already in flight, including repeats within this batch,
+            # follow the task that is running them
+            if not await singleflight.acquire_async(
+                redis_async, cacheKey.key, task_id
+            ):
+                inflight_task_id = await singleflight.holder_async(
+                    redis_async, cacheKey.key
+                )
+                if inflight_task_id:
+                    await metrics.incr_async(redis_async, "ocr_singleflight_attached")
+                    records.append({"task_id": inflight_task_id})
+                    continue
+
+            records.append({"task_id": task_id})
+            queued.append((task_id, inputKind, contents, cacheKey))
+
+        # the batch is one requester of each task it waits on, however many
+        # of its pages share it
+        await asyncio.gather(
+            *(
+                singleflight.add_requester_async(redis_async, task_id)
+                for task_id in {
+                    record["task_id"] for record in records if "result" not in record
+                }
+            )
+        )
+
+        try:
+            blobRefs = await asyncio.gather(
+                *(
+                    blob_store.put_async(redis_async, contents)
+                    for _, _, contents, _ in queued
+                )
+            )
+            await run_blocking(
+                send_ocr_tasks,
+                [
+                    (task_id, (blobRef, max_tokens, cacheKey.dump(), inputKind))
+                    for (task_id, inputKind, _, cacheKey), blobRef in zip(
+                        queued, blobRefs
+                    )
+                ],
+            )
+        except Exception:
+            # the release is owner checked, pages that attached elsewhere
+            # keep their leader's lease
+            await asyncio.gather(
+                *(
+                    singleflight.release_async(redis_async, cacheKey.key, task_id)
+                    for task_id, _, _, cacheKey in queued
+                )
+            )
+            raise
+
+        batch_metadata = {
+            "title": title,
+            "language": language,
+            "created_at": time.time(),
+            "pages": records,
+        }
+        await redis_async.setex(
+            batch_key(batch_id), BATCH_TTL, json.dumps(batch_metadata)
+        )
+        await metrics.incr_async(redis_async, "ocr_batch_requests")
+        await metrics.incr_async(redis_async, "ocr_batch_pages", len(pages))
+
+        return await get_batch_status(batch_id)
+
+    except Exception as e:
+        logger.error(f"OCR batch request failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/ocr/batch/{batch_id}", response_model=OCRBatchResponse)
+async def get_batch(batch_id: str):
+    batch = await get_batch_status(batch_id)
+    if batch is None:
+        raise HTTPException(404, "Batch not found or expired")
+    return batch
+
+
+@app.get("/ocr/batch/stream/{batch_id}")
+async def get_streamed_batch_status(batch_id: str, wait: int = 300):
+    batch = await get_batch_status(batch_id)
+    if batch is None:
+        raise HTTPException(404, "Batch not found or expired")
+
+    async def eventgen():
+        keys = [f"celery-task-meta-{page.task_id}" for page in batch.pages]
+        with event_hub.listen(*keys) as changed:
+            async for event in batch_events(changed):
+                yield event
+
+    async def batch_events(changed: asyncio.Event):
+        deadline = asyncio.get_event_loop().time() + wait
+        # each page is sent once, as soon as it has finished
+        reported = set()
+        while asyncio.get_event_loop().time() < deadline:
+            status = await get_batch_status(batch_id)
+            if status is None:
+                yield f"data:{json.dumps({'status': 'failed', 'batch_id': batch_id, 'result': 'Batch expired'})}\n\n"
+                break
+            for index, page in enumerate(status.pages):
+                if page.status in ("completed", "failed") and index not in reported:
+                    reported.add(index)
+                    yield f"data:{json.dumps({'status': 'page', 'batch_id': batch_id, 'index': index, 'result': page.model_dump()})}\n\n"
+            if status.status == "completed":
+                summary = {
+                    "total": status.total,
+                    "completed": status.completed,
+                    "failed": status.failed,
+                }
+                yield f"data:{json.dumps({'status': 'completed', 'batch_id': batch_id, 'result': summary})}\n\n"
+                break
+            remaining = deadline - asyncio.get_event_loop().time()
+            await event_hub.wait(
+                changed, max(min(STREAM_RECHECK_INTERVAL, remaining), 0)
+            )
+        else:
+            yield f"data:{json.dumps({'status': 'timeout', 'batch_id': batch_id, 'result': None})}\n\n"
+
+    return StreamingResponse(content=eventgen(), media_type="text/event-stream")
+
+
 @app.post("/execute")
 async def execute_code(request: ExecutionRequest):
     try:
-        task = execute_code_task.delay(request.code, request.language)
+        task = await run_blocking(
+            celeryApp.send_task, EXECUTE_CODE_TASK, args=(request.code, request.language)
+        )
 
         return {"status": "queued", "task_id": task.id}
 
@@ -476,7 +640,7 @@ async def execute_code(request: ExecutionRequest):
 async def get_execution_status(task_id: str):
     try:
         # task_result = celeryApp.AsyncResult(task_id)
-        raw_result = redis_client.get(f"execution:{task_id}")
+        raw_result = await redis_async.get(f"execution:{task_id}")
 
         if raw_result:
             try:
@@ -514,10 +678,15 @@ async def get_execution_status(task_id: str):
 @app.get("/execute/stream/{task_id}")
 async def get_streamed_execution_status(task_id: str, wait: int = 35):
     async def eventgen():
+        with event_hub.listen(f"execution:{task_id}") as changed:
+            async for event in execution_events(changed):
+                yield event
+
+    async def execution_events(changed: asyncio.Event):
         deadline = asyncio.get_event_loop().time() + wait
         while asyncio.get_event_loop().time() < deadline:
             try:
-                raw_result = redis_client.get(f"execution:{task_id}")
+                raw_result = await redis_async.get(f"execution:{task_id}")
                 # print(raw_result)
                 if raw_result:
                     try:
@@ -536,19 +705,32 @@ async def get_streamed_execution_status(task_id: str, wait: int = 35):
             except Exception as e:
                 logger.exception(f"Error reading execution status for {task_id}: {e}")
                 yield f"data: {json.dumps({'status': 'pending in except (error occurred)', 'task_id': task_id, 'result': None})}\n\n"
-            await asyncio.sleep(0.8)
+            remaining = deadline - asyncio.get_event_loop().time()
+            await event_hub.wait(
+                changed, max(min(STREAM_RECHECK_INTERVAL, remaining), 0)
+            )
         else:
             yield f"data: {json.dumps({'status': 'timed out', 'task_id': task_id, 'result': None})}\n\n"
 
     return StreamingResponse(content=eventgen(), media_type="text/event-stream")
 
 
+@app.get("/metrics")
+async def get_metrics():
+    try:
+        return await metrics.snapshot_async(redis_async)
+    except Exception as e:
+        logger.error(f"Error getting metrics: {e}")
+        raise HTTPException(status_code=500, detail="Error retrieving metrics")
+
+
 # Add endpoint to get all active tasks
 @app.get("/tasks/active")
 async def get_active_tasks():
     try:
-        celery_inspect = celeryApp.control.inspect()
-        active_tasks = celery_inspect.active()
+        active_tasks = await run_blocking(
+            lambda: celeryApp.control.inspect().active()
+        )
         return {"active_tasks": active_tasks or {}}
     except Exception as e:
         logger.error(f"Error getting active tasks: {e}")
@@ -557,8 +739,19 @@ async def get_active_tasks():
 
 @app.delete("/task/{task_id}")
 async def cancel_task(task_id: str):
+    """
+    Cancels an OCR or execution task wherever it is: the flag stops OCR
+    generation between tokens and is watched by the code executors, the
+    revoke drops it from the Celery queue if it has not started yet. An OCR
+    task other requests attached to keeps running until they all cancel.
+    """
     try:
-        celeryApp.control.revoke(task_id, terminate=True)
+        remaining = await singleflight.drop_requester_async(redis_async, task_id)
+        if remaining > 0:
+            logger.info(f"Task {task_id} still has {remaining} requesters")
+            return {"message": f"Task {task_id} cancelled for this request"}
+        await cancellation.request_cancel_async(redis_async, task_id)
+        await run_blocking(celeryApp.control.revoke, task_id, terminate=True)
         return {"message": f"Task {task_id} cancelled"}
     except Exception as e:
         logger.error(f"Error cancelling task: {e}")
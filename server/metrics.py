@@ -0,0 +1,54 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# All counters live in one Redis hash so the API can read them in one call
+METRICS_KEY = "metrics:ocr"
+
+
+def incr(redis_client, name: str, amount: int = 1):
+    try:
+        redis_client.hincrby(METRICS_KEY, name, amount)
+    except Exception as e:
+        logger.warning(f"Could not increment metric {name}: {e}")
+
+
+async def incr_async(redis_client, name: str, amount: int = 1):
+    try:
+        await redis_client.hincrby(METRICS_KEY, name, amount)
+    except Exception as e:
+        logger.warning(f"Could not increment metric {name}: {e}")
+
+
+def observe(redis_client, name: str, value: float):
+    """
+    Records a sample as `<name>_count`, `<name>_sum` and `<name>_last`
+    """
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hincrby(METRICS_KEY, f"{name}_count", 1)
+        pipe.hincrbyfloat(METRICS_KEY, f"{name}_sum", value)
+        pipe.hset(METRICS_KEY, f"{name}_last", value)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not record metric {name}: {e}")
+
+
+def parse(raw: dict) -> dict:
+    metrics = {}
+    for key, value in raw.items():
+        key = key.decode("utf-8") if isinstance(key, bytes) else key
+        value = value.decode("utf-8") if isinstance(value, bytes) else value
+        try:
+            metrics[key] = int(value)
+        except ValueError:
+            metrics[key] = float(value)
+    return metrics
+
+
+def snapshot(redis_client) -> dict:
+    return parse(redis_client.hgetall(METRICS_KEY))
+
+
+async def snapshot_async(redis_client) -> dict:
+    return parse(await redis_client.hgetall(METRICS_KEY))
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+
+import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+# K: keyspace events, $: string commands (SET/SETEX), t: stream commands (XADD)
+KEYSPACE_EVENTS = "K$t"
+
+
+class EventHub:
+    """
+    Holds one pattern subscription per Redis server for the whole API process
+    and wakes the SSE generators waiting on the keys it hears about, instead
+    of every stream polling Redis on its own.
+    """
+
+    def __init__(self):
+        self._waiters: dict[str, set[asyncio.Event]] = defaultdict(set)
+        self._clients: list[aioredis.Redis] = []
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self, url: str, patterns: list[str], keyspace: bool = False):
+        client = aioredis.from_url(url)
+        self._clients.append(client)
+        if keyspace:
+            await self._enable_keyspace_events(client)
+
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.psubscribe(*patterns)
+        self._tasks.append(asyncio.create_task(self._listen(pubsub)))
+        logger.info(f"Listening for {', '.join(patterns)}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for client in self._clients:
+            await client.aclose()
+
+    @contextmanager
+    def listen(self, *keys: str):
+        """
+        Yields an asyncio.Event that is set whenever one of `keys` changes
+        """
+        event = asyncio.Event()
+        for key in keys:
+            self._waiters[key].add(event)
+        try:
+            yield event
+        finally:
+            for key in keys:
+                self._waiters[key].discard(event)
+                if not self._waiters[key]:
+                    del self._waiters[key]
+
+    async def wait(self, event: asyncio.Event, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            event.clear()
+
+    def notify(self, key: str):
+        for event in self._waiters.get(key, ()):
+            event.set()
+
+    async def _listen(self, pubsub):
+        while True:
+            try:
+                async for message in pubsub.listen():
+                    channel = message["channel"].decode("utf-8")
+                    # __keyspace@0__:execution:<id> -> execution:<id>
+                    if channel.startswith("__keyspace@"):
+                        channel = channel.split(":", 1)[1]
+                    self.notify(channel)
+            except asyncio.CancelledError:
+                await pubsub.aclose()
+                raise
+            except Exception as e:
+                # redis-py resubscribes on reconnect, waiters fall back to
+                # their periodic re-check until then
+                logger.warning(f"Notification listener error: {e}")
+                await asyncio.sleep(1)
+
+    async def _enable_keyspace_events(self, client):
+        try:
+            current = (await client.config_get("notify-keyspace-events")).get(
+                "notify-keyspace-events", ""
+            )
+            if isinstance(current, bytes):
+                current = current.decode("utf-8")
+            missing = "".join(flag for flag in KEYSPACE_EVENTS if flag not in current)
+            if missing:
+                await client.config_set("notify-keyspace-events", current + missing)
+        except Exception as e:
+            logger.warning(
+                f"Could not enable keyspace notifications ({e}), make sure Redis "
+                f"runs with notify-keyspace-events {KEYSPACE_EVENTS}"
+            )
+
+
+def keyspace_pattern(redis_client, key_pattern: str) -> str:
+    db = redis_client.connection_pool.connection_kwargs.get("db", 0)
+    return f"__keyspace@{db}__:{key_pattern}"
@@ -0,0 +1,320 @@
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from hashlib import blake2b, md5
+from io import BytesIO
+from os import getenv
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+import metrics
+import strokes
+from imaging import ink_bbox, ink_mask, load_grayscale
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL = 3600  # seconds
+HASH_GRID = int(getenv("OCR_HASH_GRID", "128"))
+# Near-duplicate matching is off by default: a one-glyph edit (10 -> 19,
+# x -> y) can move the hash by fewer bits than re-encoding or shifting the
+# same drawing does, so no threshold tells them apart. Run
+# benchmarks/eval_near_duplicates.py on your drawings before turning it on.
+HASH_MAX_DISTANCE = int(getenv("OCR_HASH_MAX_DISTANCE", "0"))
+# With line OCR, the line cache decides which lines of an edited page are
+# read again, so pages are never matched as near-duplicates of each other
+LINE_MODE = getenv("OCR_LINE_MODE", "0") == "1"
+# Near-duplicate candidates are found through exact matches on one of these
+# bands, so a hash within HASH_BANDS - 1 bits is seen unless the bands it
+# shares are all blank or all ink, which are not indexed.
+HASH_BANDS = 16
+# the stored hashes fetched per lookup, those sharing the most bands first
+HASH_MAX_CANDIDATES = int(getenv("OCR_HASH_MAX_CANDIDATES", "32"))
+# Hashing never needs more detail than this, so big uploads are shrunk first
+HASH_MAX_SIDE = 1024
+# text-line strips are hashed at this height, keeping their aspect ratio
+LINE_HASH_HEIGHT = 16
+
+
+@dataclass
+class OCRCacheKey:
+    key: str
+    # perceptual hash of the ink, only for near-duplicate matching; None when
+    # that is off or the image had no usable ink
+    phash: Optional[int] = None
+
+    def dump(self) -> dict:
+        """
+        JSON-safe form for passing the key along in a task message
+        """
+        return {
+            "key": self.key,
+            "phash": f"{self.phash:x}" if self.phash is not None else None,
+        }
+
+    @classmethod
+    def load(cls, data: dict) -> "OCRCacheKey":
+        phash = data.get("phash")
+        return cls(key=data["key"], phash=int(phash, 16) if phash else None)
+
+
+def ink_hash(image: Image.Image) -> Optional[int]:
+    """
+    Perceptual hash of the ink in `image`: crop to the ink bounding box,
+    scale it to a HASH_GRID x HASH_GRID coverage grid and binarize each cell
+    against the mean coverage. The crop is stretched rather than padded, so
+    every cell and band covers ink whatever the drawing's aspect ratio.
+    """
+    image.draft("L", (HASH_MAX_SIDE, HASH_MAX_SIDE))
+    gray = load_grayscale(image)
+    gray.thumbnail((HASH_MAX_SIDE, HASH_MAX_SIDE))
+
+    mask = ink_mask(gray)
+    bbox = ink_bbox(mask)
+    if bbox is None:
+        return None
+
+    left, top, right, bottom = bbox
+    ink = mask[top:bottom, left:right].astype(np.uint8) * 255
+    grid = Image.fromarray(ink).resize((HASH_GRID, HASH_GRID), Image.BOX)
+    coverage = np.asarray(grid, dtype=np.float32)
+    bits = coverage > coverage.mean()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def content_key(
+    data: bytes, kind: str = "image", drawing: Optional[strokes.Drawing] = None
+) -> str:
+    """
+    Exact cache key for an upload: the digest of its bytes, or for strokes of
+    their canonical binary form, so JSON, binary and compressed uploads of one
+    drawing share it. Pass `drawing` when the strokes are already parsed.
+    """
+    if kind == "strokes":
+        data = strokes.serialize(drawing or strokes.parse(data))
+    return f"ocr:{md5(data).hexdigest()}"
+
+
+def perceptual_hash(data: bytes, kind: str = "image") -> Optional[int]:
+    """
+    ink_hash of an upload, or None when near-duplicate matching is off, line
+    mode is on or the upload has no usable ink. Strokes are rasterized at the
+    scale ink_hash would shrink a bitmap export of them to, so stroke and
+    bitmap uploads of one drawing hash alike.
+    """
+    if HASH_MAX_DISTANCE <= 0 or LINE_MODE:
+        return None
+    try:
+        if kind == "strokes":
+            drawing = strokes.parse(data)
+            image = strokes.rasterize_ink(
+                drawing, strokes.canvas_scale(drawing, HASH_MAX_SIDE)
+            )
+            return ink_hash(image) if image is not None else None
+        return ink_hash(Image.open(BytesIO(data)))
+    except Exception as e:
+        logger.warning(f"Could not hash image ink, matching exactly: {e}")
+        return None
+
+
+def compute_cache_key(image_bytes: bytes, kind: str = "image") -> OCRCacheKey:
+    """
+    Cache key for an uploaded drawing. An exact hit always has the same
+    content, the perceptual hash is only used to look for near-duplicates.
+    """
+    return OCRCacheKey(
+        key=content_key(image_bytes, kind),
+        phash=perceptual_hash(image_bytes, kind),
+    )
+
+
+def _band_keys(phash: int) -> list[str]:
+    """
+    Index keys of the bands of `phash`. All-blank and all-ink bands are left
+    out, they are shared by too many unrelated drawings to narrow anything.
+    """
+    width = -(-HASH_GRID * HASH_GRID // HASH_BANDS)
+    full = (1 << width) - 1
+    keys = []
+    for i in range(HASH_BANDS):
+        band = (phash >> (i * width)) & full
+        if band not in (0, full):
+            keys.append(f"ocr:phash:band:{i}:{band:x}")
+    return keys
+
+
+def _rank_candidates(members: list) -> list[str]:
+    counts = Counter(
+        c.decode("utf-8") if isinstance(c, bytes) else c
+        for band in members
+        for c in band
+    )
+    return [c for c, _ in counts.most_common(HASH_MAX_CANDIDATES)]
+
+
+def _closest(
+    phash: int, candidates: list[str], stored: list
+) -> tuple[Optional[str], list[str]]:
+    """
+    The closest candidate within HASH_MAX_DISTANCE, and the candidates whose
+    hash has expired
+    """
+    best_key, best_distance = None, HASH_MAX_DISTANCE + 1
+    expired = []
+    for candidate, value in zip(candidates, stored):
+        if not value:
+            expired.append(candidate)
+            continue
+        distance = (phash ^ int(value, 16)).bit_count()
+        if distance < best_distance:
+            best_key, best_distance = candidate, distance
+    return best_key, expired
+
+
+def _find_near_duplicate(redis_client, phash: int) -> Optional[str]:
+    band_keys = _band_keys(phash)
+    if not band_keys:
+        return None
+    pipe = redis_client.pipeline()
+    for band_key in band_keys:
+        pipe.smembers(band_key)
+    candidates = _rank_candidates(pipe.execute())
+    if not candidates:
+        return None
+
+    pipe = redis_client.pipeline()
+    for candidate in candidates:
+        pipe.get(f"ocr:phash:{candidate}")
+    best_key, expired = _closest(phash, candidates, pipe.execute())
+
+    # the band sets only shrink here, entries expire on their own
+    if expired:
+        pipe = redis_client.pipeline()
+        for band_key in band_keys:
+            pipe.srem(band_key, *expired)
+        pipe.execute()
+    return best_key
+
+
+async def _find_near_duplicate_async(redis_client, phash: int) -> Optional[str]:
+    band_keys = _band_keys(phash)
+    if not band_keys:
+        return None
+    pipe = redis_client.pipeline()
+    for band_key in band_keys:
+        pipe.smembers(band_key)
+    candidates = _rank_candidates(await pipe.execute())
+    if not candidates:
+        return None
+
+    pipe = redis_client.pipeline()
+    for candidate in candidates:
+        pipe.get(f"ocr:phash:{candidate}")
+    best_key, expired = _closest(phash, candidates, await pipe.execute())
+
+    if expired:
+        pipe = redis_client.pipeline()
+        for band_key in band_keys:
+            pipe.srem(band_key, *expired)
+        await pipe.execute()
+    return best_key
+
+
+def lookup(redis_client, cache_key: OCRCacheKey) -> Optional[str]:
+    """
+    Returns the cached OCR text for `cache_key`, falling back to the closest
+    stored drawing within HASH_MAX_DISTANCE bits of its perceptual hash.
+    """
+    cached = redis_client.get(cache_key.key)
+    if cached:
+        metrics.incr(redis_client, "ocr_cache_hits_exact")
+        return cached.decode("utf-8")
+
+    if cache_key.phash is not None and HASH_MAX_DISTANCE > 0:
+        near_key = _find_near_duplicate(redis_client, cache_key.phash)
+        cached = redis_client.get(near_key) if near_key else None
+        if cached:
+            logger.info(f"Near-duplicate cache hit {cache_key.key} -> {near_key}")
+            metrics.incr(redis_client, "ocr_cache_hits_near")
+            return cached.decode("utf-8")
+
+    metrics.incr(redis_client, "ocr_cache_misses")
+    return None
+
+
+async def lookup_async(
+    redis_client, cache_key: OCRCacheKey, near: bool = True
+) -> Optional[str]:
+    """
+    lookup() for the API's redis.asyncio client. With `near` off only an
+    exact hit on the upload's content is returned.
+    """
+    cached = await redis_client.get(cache_key.key)
+    if cached:
+        await metrics.incr_async(redis_client, "ocr_cache_hits_exact")
+        return cached.decode("utf-8")
+
+    if near and cache_key.phash is not None and HASH_MAX_DISTANCE > 0:
+        near_key = await _find_near_duplicate_async(redis_client, cache_key.phash)
+        cached = await redis_client.get(near_key) if near_key else None
+        if cached:
+            logger.info(f"Near-duplicate cache hit {cache_key.key} -> {near_key}")
+            await metrics.incr_async(redis_client, "ocr_cache_hits_near")
+            return cached.decode("utf-8")
+
+    await metrics.incr_async(redis_client, "ocr_cache_misses")
+    return None
+
+
+def store(redis_client, cache_key: OCRCacheKey, result: str, ttl: int = CACHE_TTL):
+    pipe = redis_client.pipeline()
+    pipe.setex(cache_key.key, ttl, result)
+    if cache_key.phash is not None:
+        pipe.setex(f"ocr:phash:{cache_key.key}", ttl, f"{cache_key.phash:x}")
+        for band_key in _band_keys(cache_key.phash):
+            pipe.sadd(band_key, cache_key.key)
+            pipe.expire(band_key, ttl)
+    pipe.execute()
+
+
+def line_cache_key(mask: np.ndarray) -> str:
+    """
+    Key for one text-line strip, from its tight ink mask scaled to
+    LINE_HASH_HEIGHT rows. It ignores where the line sits on the page, so an
+    unchanged line still hits after lines above it were added or removed.
+    """
+    height, width = mask.shape
+    hash_width = max(round(width * LINE_HASH_HEIGHT / max(height, 1)), 1)
+    grid = Image.fromarray(mask.astype(np.uint8) * 255).resize(
+        (hash_width, LINE_HASH_HEIGHT), Image.BOX
+    )
+    bits = np.asarray(grid) > 127
+    digest = blake2b(np.packbits(bits).tobytes(), digest_size=16)
+    digest.update(hash_width.to_bytes(4, "big"))
+    return f"ocr:line:{digest.hexdigest()}"
+
+
+def lookup_lines(redis_client, keys: list[str]) -> list[Optional[str]]:
+    if not keys:
+        return []
+    try:
+        values = redis_client.mget(keys)
+    except Exception as e:
+        logger.warning(f"Could not read OCR line cache: {e}")
+        return [None] * len(keys)
+
+    hits = sum(value is not None for value in values)
+    metrics.incr(redis_client, "ocr_line_cache_hits", hits)
+    metrics.incr(redis_client, "ocr_line_cache_misses", len(keys) - hits)
+    return [value.decode("utf-8") if value is not None else None for value in values]
+
+
+def store_lines(redis_client, lines: dict[str, str], ttl: int = CACHE_TTL):
+    try:
+        pipe = redis_client.pipeline()
+        for key, text in lines.items():
+            pipe.setex(key, ttl, text)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not store OCR line results: {e}")
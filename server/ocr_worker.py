@@ -0,0 +1,224 @@
+"""
+Pre-fork launcher for the OCR worker.
+
+The model is loaded once here, then OCR_WORKER_PROCESSES children are forked,
+each running its own threads-pool Celery worker (and micro-batcher) on a slice
+of OCR_TORCH_THREADS torch threads. The children inherit the weights as
+copy-on-write pages that inference only reads, so every extra process costs
+its activations rather than another copy of the model. A child that exits is
+re-forked from this already-loaded parent.
+
+The threads pool ignores worker_max_tasks_per_child, so recycling is done here
+instead: after OCR_CHILD_MAX_TASKS tasks a child asks to be replaced, and the
+replacement is forked (already warm) before the old child is sent a warm
+shutdown, so there is no window where nothing is serving and no model reload.
+
+    python ocr_worker.py
+"""
+
+import gc
+import itertools
+import logging
+import os
+import select
+import signal
+import time
+from os import getenv
+
+import torch
+from celery.signals import task_postrun
+
+import metrics
+import tasks
+from celery_app import celeryApp
+
+logger = logging.getLogger(__name__)
+
+ocrWorkerProcesses = max(int(getenv("OCR_WORKER_PROCESSES", "1")), 1)
+ocrTorchThreads = int(getenv("OCR_TORCH_THREADS", "0")) or max(
+    (os.cpu_count() or 1) // ocrWorkerProcesses, 1
+)
+# 0 never recycles
+ocrChildMaxTasks = int(getenv("OCR_CHILD_MAX_TASKS", "1000"))
+
+# a child dying faster than this is re-forked after a pause, not in a loop
+MIN_CHILD_LIFETIME = 5  # seconds
+
+stopping = False
+children: dict[int, int] = {}
+started_at: dict[int, float] = {}
+# children that have been replaced and are finishing their last tasks
+retiring: set[int] = set()
+generations = itertools.count()
+
+# children write their pid here once they have run ocrChildMaxTasks tasks
+recycle_read, recycle_write = os.pipe()
+
+
+def run_child(index: int, hostname: str):
+    torch.set_num_threads(ocrTorchThreads)
+    os.close(recycle_read)
+
+    completed = itertools.count(1)
+
+    @task_postrun.connect(weak=False)
+    def request_recycle(**kwargs):
+        # next() on a count is atomic, so the pool's threads can share it
+        if next(completed) == ocrChildMaxTasks:
+            logger.info(f"OCR worker {index} ran {ocrChildMaxTasks} tasks")
+            os.write(recycle_write, f"{os.getpid()}\n".encode())
+
+    celeryApp.worker_main(
+        [
+            "worker",
+            "--loglevel=info",
+            "--pool=threads",
+            f"--concurrency={tasks.ocrBatchMaxSize}",
+            f"--hostname={hostname}",
+        ]
+    )
+
+
+def spawn(index: int) -> int:
+    # a replacement runs next to the child it replaces, so the node names
+    # have to differ; counted here since a child's copy of the counter is lost
+    hostname = f"ocr{index}-{next(generations)}@%h"
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+        code = 0
+        try:
+            run_child(index, hostname)
+        except BaseException as e:
+            logger.error(f"OCR worker {index} crashed: {e}")
+            code = 1
+        os._exit(code)
+
+    logger.info(f"Started OCR worker {index} (pid {pid})")
+    started_at[pid] = time.monotonic()
+    return pid
+
+
+def memory_kb(pid: int) -> dict[str, int]:
+    """
+    Rss/Pss/shared/private totals from smaps_rollup. Pss is the number that
+    shows the shared weights being counted once across the children.
+    """
+    stats = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                stats[parts[0].rstrip(":")] = int(parts[1])
+    return stats
+
+
+def log_memory(*args):
+    for pid, index in [(os.getpid(), "parent"), *children.items()]:
+        try:
+            stats = memory_kb(pid)
+        except OSError:
+            continue
+        private = stats.get("Private_Clean", 0) + stats.get("Private_Dirty", 0)
+        logger.info(
+            f"OCR worker {index}: rss={stats.get('Rss', 0) // 1024}MB "
+            f"pss={stats.get('Pss', 0) // 1024}MB private={private // 1024}MB"
+        )
+
+
+def recycle(pid: int):
+    """
+    Replaces a child that has run its share of tasks: the replacement is
+    forked from the loaded parent first, then the old child is sent SIGTERM,
+    which Celery treats as a warm shutdown that finishes the tasks it holds.
+    """
+    index = children.get(pid)
+    if index is None or pid in retiring or stopping:
+        return
+
+    children[spawn(index)] = index
+    retiring.add(pid)
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    metrics.incr(tasks.redis_client, "ocr_worker_recycles")
+
+
+def read_recycle_requests() -> list[int]:
+    try:
+        data = os.read(recycle_read, 4096)
+    except BlockingIOError:
+        return []
+    return [int(pid) for pid in data.split()]
+
+
+def reap(pid: int, status: int):
+    index = children.pop(pid, None)
+    lifetime = time.monotonic() - started_at.pop(pid, 0)
+    if index is None:
+        return
+    if pid in retiring:
+        retiring.discard(pid)
+        logger.info(f"Retired OCR worker {index} (pid {pid})")
+        return
+    if not stopping:
+        logger.warning(
+            f"OCR worker {index} exited ({os.waitstatus_to_exitcode(status)}), "
+            f"re-forking"
+        )
+        if lifetime < MIN_CHILD_LIFETIME:
+            time.sleep(MIN_CHILD_LIFETIME)
+        children[spawn(index)] = index
+
+
+def stop(signum, frame):
+    global stopping
+    stopping = True
+    for pid in children:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    # no intra-op thread pool in the parent, the children size their own
+    torch.set_num_threads(1)
+    tasks.load_model()
+    # objects that exist now never need collecting, and freezing them keeps
+    # the collector from writing to (and so copying) their pages in children
+    gc.collect()
+    gc.freeze()
+
+    logger.info(
+        f"Forking {ocrWorkerProcesses} OCR workers with {ocrTorchThreads} "
+        f"torch threads each"
+    )
+    os.set_blocking(recycle_read, False)
+    for index in range(ocrWorkerProcesses):
+        children[spawn(index)] = index
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGUSR1, log_memory)
+
+    while children:
+        readable, _, _ = select.select([recycle_read], [], [], 1.0)
+        if readable:
+            for pid in read_recycle_requests():
+                recycle(pid)
+
+        while children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            reap(pid, status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import copy
+import logging
+import threading
+from typing import Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+VISION_START = "<|vision_start|>"
+
+
+class PrefixCache:
+    """
+    Past key/values of the text-only part of the OCR prompt before the image,
+    computed once and reused by every request: the system message, plus the
+    instruction when OCR_PROMPT_TEXT_FIRST puts it there. Everything up to
+    <|vision_start|> is identical between requests, and with Qwen2.5-VL's
+    mRoPE text positions before the first image are plain 0..n-1, so the
+    cached entries are exactly what a full prefill would produce.
+
+    Only unpadded batches use it. The processor pads on the left, so rows
+    whose images give different visual token counts start their prefix at
+    different positions and are prefilled in full (counted as misses).
+    """
+
+    def __init__(self, model, processor, prompt_text: str):
+        self.model = model
+        self.processor = processor
+        self.prompt_text = prompt_text
+        self.prefix_ids: Optional[torch.Tensor] = None
+        self.past_key_values = None
+        self.lock = threading.Lock()
+
+    def build(self):
+        with self.lock:
+            if self.past_key_values is not None:
+                return
+            if VISION_START not in self.prompt_text:
+                raise ValueError("OCR prompt has no image to split the prefix at")
+
+            prefix_text = self.prompt_text[: self.prompt_text.index(VISION_START)]
+            prefix_ids = self.processor.tokenizer(
+                prefix_text, return_tensors="pt", add_special_tokens=False
+            ).input_ids.to(self.model.device)
+            with torch.no_grad():
+                output = self.model(input_ids=prefix_ids, use_cache=True)
+            self.prefix_ids = prefix_ids
+            self.past_key_values = output.past_key_values
+            logger.info(f"Cached KV for a {prefix_ids.shape[1]} token OCR prefix")
+
+    def prefill(self, inputs) -> Optional[object]:
+        """
+        Runs the image and the rest of the prompt, all but its last token, on
+        top of a copy of the cached prefix and returns the resulting cache for
+        `generate`, which then only has to feed that one token. Returns None
+        when the batch cannot reuse the prefix (left-padded rows, different
+        tokenization) so the caller falls back to a full prefill.
+        """
+        self.build()
+
+        input_ids = inputs.input_ids
+        attention_mask = inputs.attention_mask
+        prefix_length = self.prefix_ids.shape[1]
+        batch_size, prompt_length = input_ids.shape
+
+        # left padding would shift every row's prefix to a different position
+        if not bool(attention_mask.all()) or prompt_length <= prefix_length + 1:
+            return None
+        if not torch.equal(
+            input_ids[:, :prefix_length],
+            self.prefix_ids.expand(batch_size, -1),
+        ):
+            return None
+
+        past_key_values = copy.deepcopy(self.past_key_values)
+        if batch_size > 1:
+            past_key_values.batch_repeat_interleave(batch_size)
+
+        # newer transformers keep the rope helpers on the inner model
+        rope_owner = self.model.model
+        if not hasattr(rope_owner, "get_rope_index"):
+            rope_owner = self.model
+        position_ids, rope_deltas = rope_owner.get_rope_index(
+            input_ids=input_ids,
+            image_grid_thw=inputs.image_grid_thw,
+            attention_mask=attention_mask,
+        )
+
+        end = prompt_length - 1
+        with torch.no_grad():
+            self.model(
+                input_ids=input_ids[:, prefix_length:end],
+                pixel_values=inputs.pixel_values,
+                image_grid_thw=inputs.image_grid_thw,
+                attention_mask=attention_mask[:, :end],
+                position_ids=position_ids[:, :, prefix_length:end],
+                past_key_values=past_key_values,
+                cache_position=torch.arange(
+                    prefix_length, end, device=input_ids.device
+                ),
+                use_cache=True,
+            )
+
+        # decoding steps derive their positions from the deltas the image
+        # introduced, which the full prefill would normally have stored
+        rope_owner.rope_deltas = rope_deltas
+        return past_key_values
@@ -0,0 +1,32 @@
+from typing import Optional
+from pydantic import BaseModel
+
+
+# pydantic models
+class OCRRequest(BaseModel):
+    title: str
+    language: str
+    max_tokens: Optional[int] = None
+
+
+class OCRResponse(BaseModel):
+    task_id: str
+    status: str
+    result: Optional[str] = None
+    error: Optional[str] = None
+    cached: Optional[bool] = None
+    execution_time: Optional[float] = None
+
+
+class ExecutionRequest(BaseModel):
+    code: str
+    language: str
+
+
+class OCRBatchResponse(BaseModel):
+    batch_id: str
+    status: str
+    total: int
+    completed: int = 0
+    failed: int = 0
+    pages: list[OCRResponse] = []
@@ -0,0 +1,158 @@
+import logging
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Long enough to cover queueing plus the task's hard time limit
+LEASE_TTL = 300  # seconds
+# a holder that keeps one lease this long without finishing is taken to have
+# hung, the threads pool does not enforce Celery's time limits
+WAIT_TIMEOUT = LEASE_TTL + 30  # seconds
+
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+TAKEOVER_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('set', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+DROP_REQUESTER_SCRIPT = """
+local remaining = redis.call('decr', KEYS[1])
+if remaining <= 0 then
+    redis.call('del', KEYS[1])
+end
+return remaining
+"""
+
+
+def lease_key(cache_key: str) -> str:
+    return f"lease:{cache_key}"
+
+
+def done_channel(cache_key: str) -> str:
+    return f"done:{cache_key}"
+
+
+def requesters_key(task_id: str) -> str:
+    return f"requesters:{task_id}"
+
+
+def acquire(redis_client, cache_key: str, owner: str) -> bool:
+    """
+    Takes the inference lease for `cache_key`. Returns True when `owner` holds
+    it, including when it was already claimed for `owner` at submit time.
+    """
+    key = lease_key(cache_key)
+    if redis_client.set(key, owner, nx=True, ex=LEASE_TTL):
+        return True
+    return holder(redis_client, cache_key) == owner
+
+
+def holder(redis_client, cache_key: str) -> Optional[str]:
+    current = redis_client.get(lease_key(cache_key))
+    return current.decode("utf-8") if current else None
+
+
+async def acquire_async(redis_client, cache_key: str, owner: str) -> bool:
+    key = lease_key(cache_key)
+    if await redis_client.set(key, owner, nx=True, ex=LEASE_TTL):
+        return True
+    return await holder_async(redis_client, cache_key) == owner
+
+
+async def holder_async(redis_client, cache_key: str) -> Optional[str]:
+    current = await redis_client.get(lease_key(cache_key))
+    return current.decode("utf-8") if current else None
+
+
+def release(redis_client, cache_key: str, owner: str):
+    try:
+        redis_client.eval(RELEASE_SCRIPT, 1, lease_key(cache_key), owner)
+        redis_client.publish(done_channel(cache_key), owner)
+    except Exception as e:
+        logger.warning(f"Could not release lease for {cache_key}: {e}")
+
+
+async def release_async(redis_client, cache_key: str, owner: str):
+    """
+    Drops a lease taken for a task that never got queued, so identical
+    requests do not attach to it until LEASE_TTL runs out
+    """
+    try:
+        await redis_client.eval(RELEASE_SCRIPT, 1, lease_key(cache_key), owner)
+        await redis_client.publish(done_channel(cache_key), owner)
+    except Exception as e:
+        logger.warning(f"Could not release lease for {cache_key}: {e}")
+
+
+async def add_requester_async(redis_client, task_id: str):
+    """
+    Counts one more client waiting on `task_id`, the one that queued it or one
+    that attached to it, so cancelling stops it only once all of them have
+    """
+    pipe = redis_client.pipeline()
+    pipe.incr(requesters_key(task_id))
+    pipe.expire(requesters_key(task_id), LEASE_TTL)
+    await pipe.execute()
+
+
+async def drop_requester_async(redis_client, task_id: str) -> int:
+    """
+    Takes back one client's interest in `task_id`. Returns how many are still
+    waiting on it, 0 or less when the task can be stopped (including tasks
+    that were never counted).
+    """
+    return await redis_client.eval(
+        DROP_REQUESTER_SCRIPT, 1, requesters_key(task_id)
+    )
+
+
+def wait(
+    redis_client,
+    cache_key: str,
+    owner: str,
+    poll_interval: float = 1.0,
+    timeout: float = WAIT_TIMEOUT,
+) -> Optional[str]:
+    """
+    Blocks until the lease holder for `cache_key` finishes. Returns the cached
+    result it stored, or None if the lease went away without one (the holder
+    failed or died) so the caller can take over. A holder that keeps the lease
+    past `timeout` is taken to have hung: the lease is handed to `owner` and
+    None is returned, so the caller runs the work itself.
+    """
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(done_channel(cache_key))
+    try:
+        waiting_on, deadline = None, 0.0
+        while True:
+            # checked after subscribing so a release in between is not missed
+            cached = redis_client.get(cache_key)
+            if cached:
+                return cached.decode("utf-8")
+            current = holder(redis_client, cache_key)
+            if current is None or current == owner:
+                return None
+            if current != waiting_on:
+                waiting_on, deadline = current, time.monotonic() + timeout
+            elif time.monotonic() >= deadline:
+                logger.warning(
+                    f"Lease holder {current} of {cache_key} did not finish in "
+                    f"{timeout:.0f}s, taking over"
+                )
+                redis_client.eval(
+                    TAKEOVER_SCRIPT, 1, lease_key(cache_key), current, owner, LEASE_TTL
+                )
+                return None
+            pubsub.get_message(timeout=poll_interval)
+    finally:
+        pubsub.close()
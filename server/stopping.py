@@ -0,0 +1,100 @@
+import logging
+import time
+from typing import Optional
+
+import torch
+from transformers import StoppingCriteria
+
+import cancellation
+
+logger = logging.getLogger(__name__)
+
+# a loop has to repeat this often and span this many tokens before it stops
+# generation, so short runs of identical lines in real code are left alone
+MIN_REPEATS = 4
+MIN_REPEAT_TOKENS = 32
+MAX_PERIOD = 48
+# cancel flags are read at most this often, not on every token
+CANCEL_CHECK_INTERVAL = 0.25  # seconds
+
+
+def repeating_period(tokens: list[int]) -> int:
+    """
+    Length of the token sequence `tokens` ends in a loop of, or 0
+    """
+    for period in range(1, MAX_PERIOD + 1):
+        span = period * max(MIN_REPEATS, -(-MIN_REPEAT_TOKENS // period))
+        if span > len(tokens):
+            break
+        tail = tokens[-span:]
+        if all(tail[i] == tail[i % period] for i in range(period, span)):
+            return period
+    return 0
+
+
+class RepetitionStoppingCriteria(StoppingCriteria):
+    """
+    Finishes a row once its output ends in a degenerate loop, instead of
+    letting it repeat until max_new_tokens. The period each row stopped on is
+    kept in `periods` so the caller can cut the output back to one copy.
+    """
+
+    def __init__(self, prompt_length: int, batch_size: int, pad_token_id: int):
+        self.prompt_length = prompt_length
+        self.pad_token_id = pad_token_id
+        self.periods = [0] * batch_size
+
+    def __call__(self, input_ids: torch.LongTensor, scores, **kwargs):
+        done = torch.zeros(
+            input_ids.shape[0], dtype=torch.bool, device=input_ids.device
+        )
+        start = max(self.prompt_length, input_ids.shape[1] - MAX_PERIOD * MIN_REPEATS)
+        for row, tokens in enumerate(input_ids[:, start:].tolist()):
+            # finished rows are padded, which is not a loop worth reporting
+            if self.periods[row] or not tokens or tokens[-1] == self.pad_token_id:
+                done[row] = bool(self.periods[row])
+                continue
+            period = repeating_period(tokens)
+            if period:
+                self.periods[row] = period
+                done[row] = True
+        return done
+
+
+def trim_repetition(tokens: list[int], period: int) -> list[int]:
+    """
+    Drops the repeats of the `period` long loop at the end of `tokens`,
+    keeping its first occurrence
+    """
+    end = len(tokens)
+    while end - 2 * period >= 0 and tokens[end - period : end] == tokens[
+        end - 2 * period : end - period
+    ]:
+        end -= period
+    return tokens[:end]
+
+
+class CancelStoppingCriteria(StoppingCriteria):
+    """
+    Finishes the rows whose task has been cancelled through the API, so an
+    abandoned request stops taking decoding steps in its batch. The rows it
+    stopped are kept in `cancelled`.
+    """
+
+    def __init__(self, redis_client, task_ids: list[Optional[str]]):
+        self.redis_client = redis_client
+        self.task_ids = task_ids
+        self.cancelled = [False] * len(task_ids)
+        self.checked_at = 0.0
+
+    def __call__(self, input_ids: torch.LongTensor, scores, **kwargs):
+        now = time.monotonic()
+        if now - self.checked_at >= CANCEL_CHECK_INTERVAL:
+            self.checked_at = now
+            flags = cancellation.cancelled(self.redis_client, self.task_ids)
+            for row, flag in enumerate(flags):
+                if flag and not self.cancelled[row]:
+                    task_id = self.task_ids[row]
+                    logger.info(f"Stopping generation for cancelled task {task_id}")
+                    self.cancelled[row] = True
+        return torch.tensor(self.cancelled, dtype=torch.bool, device=input_ids.device)
@@ -0,0 +1,82 @@
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+STREAM_TTL = 600  # seconds
+STREAM_MAXLEN = 1000
+
+
+def stream_key(task_id: str) -> str:
+    return f"ocr:stream:{task_id}"
+
+
+def clean_output(text: str) -> str:
+    return text.replace("```", "").replace("\\n", "\n")
+
+
+class RedisLineStreamer:
+    """
+    Generation streamer (the put/end interface `generate` expects) for a batch
+    of OCR requests. Every completed line of each row is appended to that
+    task's Redis stream as soon as it has been decoded, so the API can forward
+    partial transcriptions while `generate` is still running. It does not
+    subclass transformers' BaseStreamer so the API can import this module
+    without pulling in transformers.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        tokenizer,
+        task_ids: list[Optional[str]],
+        max_new_tokens: list[int],
+    ):
+        self.redis_client = redis_client
+        self.tokenizer = tokenizer
+        self.task_ids = task_ids
+        self.max_new_tokens = max_new_tokens
+        self.token_ids: list[list[int]] = [[] for _ in task_ids]
+        self.published = [0 for _ in task_ids]
+        self.prompt_seen = False
+
+    def put(self, value):
+        # the first call carries the prompt, which is not part of the output
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+
+        tokens = value.reshape(len(self.task_ids), -1).tolist()
+        for row, row_tokens in enumerate(tokens):
+            remaining = self.max_new_tokens[row] - len(self.token_ids[row])
+            if remaining > 0:
+                self.token_ids[row].extend(row_tokens[:remaining])
+                self._publish(row, final=False)
+
+    def end(self):
+        for row in range(len(self.task_ids)):
+            self._publish(row, final=True)
+
+    def _publish(self, row: int, final: bool):
+        task_id = self.task_ids[row]
+        if not task_id:
+            return
+
+        text = clean_output(
+            self.tokenizer.decode(self.token_ids[row], skip_special_tokens=True)
+        )
+        # only whole lines go out until generation ends
+        end = len(text) if final else text.rfind("\n") + 1
+        if end <= self.published[row]:
+            return
+
+        chunk = text[self.published[row] : end]
+        self.published[row] = end
+        try:
+            key = stream_key(task_id)
+            pipe = self.redis_client.pipeline()
+            pipe.xadd(key, {"text": chunk}, maxlen=STREAM_MAXLEN)
+            pipe.expire(key, STREAM_TTL)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Could not stream OCR output for {task_id}: {e}")
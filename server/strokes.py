@@ -0,0 +1,300 @@
+"""
+Stroke-vector input for OCR. Instead of a full-resolution bitmap the client
+can upload the PencilKit strokes, which the server rasterizes at exactly the
+size the OCR pipeline wants.
+
+Binary form (little endian):
+
+    "RCS1"  uint16 canvas width  uint16 canvas height  uint32 stroke count
+    per stroke: uint32 point count, then per point
+        uint16 x, uint16 y      in quarter points
+        uint8 width             in eighth points
+        uint8 force             0-255
+
+JSON form, coordinates and widths in points and force 0-1:
+
+    {"width": 1024, "height": 768, "strokes": [[[x, y, width, force], ...]]}
+
+Either form may also be sent zlib-compressed.
+"""
+
+import json
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import imaging
+
+MAGIC = b"RCS1"
+HEADER = struct.Struct("<4sHHI")
+STROKE_HEADER = struct.Struct("<I")
+POINT = np.dtype([("x", "<u2"), ("y", "<u2"), ("width", "u1"), ("force", "u1")])
+
+MAX_STROKES = 10_000
+MAX_POINTS = 250_000
+# JSON of MAX_POINTS points fits well within this
+MAX_DECOMPRESSED = 16 * 1024 * 1024
+# used for points recorded without a width
+DEFAULT_WIDTH = 2.0  # points
+# densities and layouts are measured at this resolution, close to the
+# retina PNG exports they replace
+REFERENCE_SCALE = 2.0  # pixels per point
+REFERENCE_MAX_SIDE = 2048
+# strokes are drawn this much larger and scaled down, for antialiasing
+SUPERSAMPLE = 2
+
+
+@dataclass
+class Drawing:
+    width: float
+    height: float
+    # one (points, 4) array per stroke: x, y, width in points and force 0-1
+    strokes: list[np.ndarray]
+
+
+def parse(data: bytes) -> Drawing:
+    """
+    Reads either serialized form, raising ValueError on malformed input
+    """
+    if data[:1] == b"\x78":
+        data = _decompress(data)
+    if data[:4] == MAGIC:
+        return _parse_binary(data)
+    try:
+        payload = json.loads(data)
+        strokes = [
+            np.asarray(stroke, dtype=np.float32).reshape(-1, 4)
+            for stroke in payload["strokes"]
+        ]
+        drawing = Drawing(float(payload["width"]), float(payload["height"]), strokes)
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Malformed stroke data: {e}") from e
+    _check_limits(drawing)
+    return drawing
+
+
+def _decompress(data: bytes) -> bytes:
+    decompressor = zlib.decompressobj()
+    try:
+        data = decompressor.decompress(data, MAX_DECOMPRESSED)
+    except zlib.error as e:
+        raise ValueError(f"Malformed compressed stroke data: {e}") from e
+    if decompressor.unconsumed_tail:
+        raise ValueError("Stroke data is too large")
+    return data
+
+
+def _parse_binary(data: bytes) -> Drawing:
+    if len(data) < HEADER.size:
+        raise ValueError("Truncated stroke header")
+    _, width, height, count = HEADER.unpack_from(data)
+    if count > MAX_STROKES:
+        raise ValueError(f"Too many strokes ({count})")
+
+    strokes = []
+    offset = HEADER.size
+    for _ in range(count):
+        if offset + STROKE_HEADER.size > len(data):
+            raise ValueError("Truncated stroke data")
+        (points,) = STROKE_HEADER.unpack_from(data, offset)
+        offset += STROKE_HEADER.size
+        end = offset + points * POINT.itemsize
+        if end > len(data):
+            raise ValueError("Truncated stroke data")
+        raw = np.frombuffer(data, dtype=POINT, count=points, offset=offset)
+        offset = end
+
+        stroke = np.empty((points, 4), dtype=np.float32)
+        stroke[:, 0] = raw["x"] / 4
+        stroke[:, 1] = raw["y"] / 4
+        stroke[:, 2] = raw["width"] / 8
+        stroke[:, 3] = raw["force"] / 255
+        strokes.append(stroke)
+
+    drawing = Drawing(float(width), float(height), strokes)
+    _check_limits(drawing)
+    return drawing
+
+
+def _check_limits(drawing: Drawing):
+    if len(drawing.strokes) > MAX_STROKES:
+        raise ValueError(f"Too many strokes ({len(drawing.strokes)})")
+    points = sum(len(stroke) for stroke in drawing.strokes)
+    if points > MAX_POINTS:
+        raise ValueError(f"Too many stroke points ({points})")
+
+
+def serialize(drawing: Drawing) -> bytes:
+    """
+    Binary form of `drawing`, also the canonical form OCR cache keys are
+    computed from
+    """
+    parts = [
+        HEADER.pack(
+            MAGIC, int(drawing.width), int(drawing.height), len(drawing.strokes)
+        )
+    ]
+    for stroke in drawing.strokes:
+        points = np.empty(len(stroke), dtype=POINT)
+        points["x"] = np.clip(np.round(stroke[:, 0] * 4), 0, 65535)
+        points["y"] = np.clip(np.round(stroke[:, 1] * 4), 0, 65535)
+        points["width"] = np.clip(np.round(stroke[:, 2] * 8), 0, 255)
+        points["force"] = np.clip(np.round(stroke[:, 3] * 255), 0, 255)
+        parts.append(STROKE_HEADER.pack(len(stroke)))
+        parts.append(points.tobytes())
+    return b"".join(parts)
+
+
+def _widths(stroke: np.ndarray) -> np.ndarray:
+    # PencilKit widths already include pressure, force only fills in for
+    # points recorded without one
+    return np.where(
+        stroke[:, 2] > 0, stroke[:, 2], DEFAULT_WIDTH * (0.5 + stroke[:, 3])
+    )
+
+
+def bounds(drawing: Drawing) -> Optional[tuple[float, float, float, float]]:
+    """
+    (left, top, right, bottom) of the ink in points, or None without strokes
+    """
+    boxes = []
+    for stroke in drawing.strokes:
+        if len(stroke) == 0:
+            continue
+        half = _widths(stroke)[:, None] / 2
+        boxes.append(
+            (
+                *(stroke[:, :2] - half).min(axis=0),
+                *(stroke[:, :2] + half).max(axis=0),
+            )
+        )
+    if not boxes:
+        return None
+    boxes = np.asarray(boxes)
+    return (
+        float(boxes[:, 0].min()),
+        float(boxes[:, 1].min()),
+        float(boxes[:, 2].max()),
+        float(boxes[:, 3].max()),
+    )
+
+
+def rasterize(
+    drawing: Drawing,
+    box: tuple[float, float, float, float],
+    size: tuple[int, int],
+) -> Image.Image:
+    """
+    Draws the part of `drawing` inside `box` (points) into a white grayscale
+    image of `size` pixels
+    """
+    left, top, right, bottom = box
+    width, height = size
+    scale_x = width * SUPERSAMPLE / max(right - left, 1e-6)
+    scale_y = height * SUPERSAMPLE / max(bottom - top, 1e-6)
+    scale = (scale_x + scale_y) / 2
+
+    canvas = Image.new("L", (width * SUPERSAMPLE, height * SUPERSAMPLE), 255)
+    draw = ImageDraw.Draw(canvas)
+    for stroke in drawing.strokes:
+        if len(stroke) == 0:
+            continue
+        xs = (stroke[:, 0] - left) * scale_x
+        ys = (stroke[:, 1] - top) * scale_y
+        radii = np.maximum(_widths(stroke) * scale / 2, 0.5)
+        for i in range(len(stroke)):
+            x, y, r = float(xs[i]), float(ys[i]), float(radii[i])
+            # round joints and caps, then the segment to the next point
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=0)
+            if i + 1 < len(stroke):
+                draw.line(
+                    (x, y, float(xs[i + 1]), float(ys[i + 1])),
+                    fill=0,
+                    width=max(round(2 * r), 1),
+                )
+    if SUPERSAMPLE == 1:
+        return canvas
+    return canvas.resize((width, height), Image.BOX)
+
+
+def rasterize_ink(drawing: Drawing, scale: float) -> Optional[Image.Image]:
+    """
+    The inked part of `drawing` at `scale` pixels per point, or None for a
+    drawing without strokes
+    """
+    box = bounds(drawing)
+    if box is None:
+        return None
+    left, top, right, bottom = box
+    size = (
+        max(round((right - left) * scale), 1),
+        max(round((bottom - top) * scale), 1),
+    )
+    return rasterize(drawing, box, size)
+
+
+def canvas_scale(drawing: Drawing, max_side: int) -> float:
+    """
+    Pixels per point of a REFERENCE_SCALE export of the whole canvas once it
+    has been shrunk to fit `max_side`, as a bitmap upload would be
+    """
+    return min(REFERENCE_SCALE, max_side / max(drawing.width, drawing.height, 1.0))
+
+
+def render_for_ocr(
+    drawing: Drawing,
+    factor: int = imaging.DEFAULT_PATCH_FACTOR,
+    min_tokens: int = 64,
+    max_tokens: int = 1024,
+) -> tuple[Image.Image, dict]:
+    """
+    Stroke counterpart of imaging.preprocess_for_ocr: the ink is measured
+    on a reference raster, then drawn once more directly at the size
+    preprocess_for_ocr would have scaled a bitmap to, with the same margin
+    around it. Returns the RGB image and the same stats.
+    """
+    reference = rasterize_ink(drawing, canvas_scale(drawing, REFERENCE_MAX_SIDE))
+    if reference is None:
+        blank = Image.new("RGB", (factor, factor), "white")
+        return blank, {
+            "ink_density": 0.0,
+            "width": factor,
+            "height": factor,
+            "visual_tokens": 1,
+            "text_lines": 0,
+            "text_characters": 0,
+        }
+
+    mask = imaging.ink_mask(reference)
+    density = float(mask.mean())
+    layout = imaging.estimate_text_layout(mask)
+
+    # the margin preprocess_for_ocr adds, converted back to points
+    left, top, right, bottom = bounds(drawing)
+    points_per_pixel = max(right - left, bottom - top) / max(reference.size)
+    margin_px = factor // 2 + int(0.03 * max(reference.size))
+    margin = margin_px * points_per_pixel
+    box = (left - margin, top - margin, right + margin, bottom + margin)
+
+    width, height = imaging.target_size(
+        reference.width + 2 * margin_px,
+        reference.height + 2 * margin_px,
+        density,
+        factor,
+        min_tokens,
+        max_tokens,
+    )
+    image = rasterize(drawing, box, (width, height))
+    stats = {
+        "ink_density": density,
+        "width": width,
+        "height": height,
+        "visual_tokens": imaging.visual_tokens(width, height, factor),
+        "text_lines": layout["lines"],
+        "text_characters": layout["characters"],
+    }
+    return image.convert("RGB"), stats
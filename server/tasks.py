@@ -0,0 +1,753 @@
+from PIL import Image
+from transformers import (
+    AutoProcessor,
+    AutoModelForCausalLM,
+    AutoModelForImageTextToText,
+    AutoTokenizer,
+)
+import torch
+from huggingface_hub import snapshot_download
+from typing import Optional
+import logging
+from os import getenv
+import redis
+from celery.signals import worker_init, worker_process_init
+import json
+import boto3
+from botocore.exceptions import ClientError
+import math
+import time
+from dataclasses import dataclass
+from batching import MicroBatcher
+from prefix_cache import PrefixCache
+from stopping import (
+    CancelStoppingCriteria,
+    RepetitionStoppingCriteria,
+    trim_repetition,
+)
+import blob_store
+import cancellation
+from celery_app import (
+    EXECUTE_CODE_TASK,
+    PROCESS_OCR_TASK,
+    celeryApp,
+    redisOcrURL,
+)
+import imaging
+import metrics
+import ocr_cache
+import singleflight
+import strokes
+from streaming import RedisLineStreamer, clean_output
+
+logger = logging.getLogger(__name__)
+
+# Env Variables
+executionQueuePythonURL = getenv("EXECUTION_QUEUE_PYTHON_URL")
+executionQueueJavaScriptURL = getenv("EXECUTION_QUEUE_JAVASCRIPT_URL")
+executionQueueJavaURL = getenv("EXECUTION_QUEUE_JAVA_URL")
+awsRegion = getenv("AWS_REGION")
+ocrBatchMaxSize = int(getenv("OCR_BATCH_MAX_SIZE", "4"))
+ocrBatchMaxWaitMs = int(getenv("OCR_BATCH_MAX_WAIT_MS", "50"))
+ocrMinVisualTokens = int(getenv("OCR_MIN_VISUAL_TOKENS", "64"))
+# 0 keeps the budget of the 512x512 square drawings were resized to before
+# ink-based sizing, so it never sends more tokens than that did
+ocrMaxVisualTokens = int(getenv("OCR_MAX_VISUAL_TOKENS", "0"))
+ocrBinarize = getenv("OCR_BINARIZE", "0") == "1"
+ocrDenoise = getenv("OCR_DENOISE", "0") == "1"
+# put the instruction before the image, so the prefix cache covers it too;
+# compare with benchmarks/eval_precision.py --prompt-orders before turning on
+ocrPromptTextFirst = getenv("OCR_PROMPT_TEXT_FIRST", "0") == "1"
+# with the image first the shared prefix is only the system message, too
+# short to pay for the extra forward pass, so the cache follows the order
+ocrPrefixCache = getenv(
+    "OCR_PREFIX_CACHE", "1" if ocrPromptTextFirst else "0"
+) == "1"
+# fp32, fp16, bf16 or int8 (dynamic, CPU only); unset picks per device
+ocrPrecision = getenv("OCR_PRECISION", "").lower()
+# off, prompt_lookup (n-gram drafts from the tokens so far) or draft (a small
+# model sharing the tokenizer proposes tokens); greedy output is unchanged
+ocrAssisted = getenv("OCR_ASSISTED", "off").lower()
+ocrDraftModel = getenv("OCR_DRAFT_MODEL", "Qwen/Qwen2.5-0.5B-Instruct")
+ocrPromptLookupTokens = int(getenv("OCR_PROMPT_LOOKUP_TOKENS", "10"))
+# clamp for the new-token budget estimated from the drawing's text layout
+ocrMinNewTokens = int(getenv("OCR_MIN_NEW_TOKENS", "32"))
+ocrMaxNewTokens = int(getenv("OCR_MAX_NEW_TOKENS", "1024"))
+# OCR each text line separately, caching per line, so an edited program only
+# re-runs its changed lines
+ocrLineMode = getenv("OCR_LINE_MODE", "0") == "1"
+
+# initializing services
+redis_client = redis.from_url(redisOcrURL)
+sqs = boto3.client("sqs", region_name=awsRegion)
+
+
+# Model Setup
+model_path = "nanonets/Nanonets-OCR-s"
+# code averages about this many characters per token, and budgets get this
+# much headroom over the estimate since handwriting sizes vary
+CHARS_PER_TOKEN = 3
+BUDGET_SLACK = 1.5
+# spaces per indentation level when reassembling line-mode output
+INDENT_WIDTH = 4
+# side of the square drawings were resized to before ink-based sizing
+BASELINE_SIDE = 512
+OCR_PROMPT = """Extract the code in the image exactly as it appears, but return it as raw source code with no extra characters. Do not format the code using markdown (e.g., no triple backticks). Do not include escape characters like \\n or \\t. Output must be plain text exactly how it would appear in a .java file. Remove all surrounding quotes, line breaks, or markup."""
+
+
+# Global model variables (will be loaded in workers)
+model = None
+tokenizer = None
+processor = None
+device = None
+prefix_cache = None
+draft_model = None
+
+
+def local_snapshot() -> str:
+    """
+    Path of the model snapshot in /tmp/hf_cache, only going to the Hub when
+    it has not been downloaded yet
+    """
+    try:
+        return snapshot_download(
+            model_path, cache_dir="/tmp/hf_cache", local_files_only=True
+        )
+    except Exception:
+        logger.info(f"No local snapshot of {model_path}, downloading it")
+        return snapshot_download(model_path, cache_dir="/tmp/hf_cache")
+
+
+PRECISION_DTYPES = {
+    "fp32": torch.float32,
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16,
+    # int8 loads fp32 weights and quantizes the Linear layers afterwards
+    "int8": torch.float32,
+}
+
+
+def model_precision(device: str) -> str:
+    precision = ocrPrecision or ("fp16" if device == "cuda" else "fp32")
+    if precision not in PRECISION_DTYPES:
+        raise ValueError(f"Unsupported OCR_PRECISION: {precision}")
+    if precision == "int8" and device != "cpu":
+        # quantize_dynamic only has CPU kernels
+        logger.warning(f"int8 is only supported on CPU, using fp32 on {device}")
+        return "fp32"
+    return precision
+
+
+def load_model():
+    global model, tokenizer, processor, device
+
+    device = "cpu"
+    if torch.backends.mps.is_available():
+        device = "mps"
+    elif torch.cuda.is_available():
+        device = "cuda"
+
+    # Configure precision and quantization based on device
+    precision = model_precision(device)
+    torch_dtype = PRECISION_DTYPES[precision]
+    if device == "cuda":
+        device_map = "auto"
+    else:
+        device_map = {"": device}
+
+    # Loading model
+    logger.info(f"Loading model using {device} in {precision}")
+    start_time = time.time()
+    try:
+        local_model_dir = local_snapshot()
+        # the checkpoint is bf16, so any other precision converts every
+        # tensor into freshly allocated memory and nothing stays mapped from
+        # the safetensors files. ocr_worker.py shares the weights with its
+        # children as copy-on-write pages of this process, not through mmap.
+        model = AutoModelForImageTextToText.from_pretrained(
+            local_model_dir,
+            device_map=device_map,
+            offload_folder="/tmp/offload",
+            torch_dtype=torch_dtype,
+            low_cpu_mem_usage=True,
+            trust_remote_code=True,
+        )
+        model.eval()
+        if precision == "int8":
+            # in place, so the fp32 copy is not kept alongside the int8 one
+            model = torch.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+            )
+
+        tokenizer = AutoTokenizer.from_pretrained(local_model_dir)
+        processor = AutoProcessor.from_pretrained(local_model_dir)
+        # batched decoder-only generation needs the prompts aligned on the right
+        processor.tokenizer.padding_side = "left"
+        if ocrAssisted == "draft":
+            load_draft_model(torch_dtype, device_map)
+
+        load_time = time.time() - start_time
+        metrics.observe(redis_client, "model_load_seconds", load_time)
+        logger.info(
+            f"Model loaded successfully on {device} ({precision}) in {load_time:.2f}s"
+        )
+
+    except Exception as e:
+        logger.error(f"Failed to load model: {e}")
+        raise
+
+
+def load_draft_model(torch_dtype=torch.float32, device_map=None):
+    """
+    Loads the assistant for OCR_ASSISTED=draft. It has to share the OCR
+    model's tokenizer; being text only, it drafts from the tokens so far and
+    the main model's verification keeps the output identical.
+    """
+    global draft_model
+
+    draft_model = AutoModelForCausalLM.from_pretrained(
+        ocrDraftModel,
+        cache_dir="/tmp/hf_cache",
+        device_map=device_map or {"": device},
+        torch_dtype=torch_dtype,
+        low_cpu_mem_usage=True,
+    )
+    draft_model.eval()
+    logger.info(f"Draft model {ocrDraftModel} loaded for assisted decoding")
+
+
+# ======================== Celery Tasks ========================
+
+
+# threads/solo pools never fork, so the model is loaded once per worker process
+@worker_init.connect
+@worker_process_init.connect
+def load_model_on_worker_start(**kwargs):
+    if model is None:
+        load_model()
+
+
+def patch_factor() -> int:
+    """
+    Pixels per visual token side for the loaded processor (patch * merge)
+    """
+    image_processor = getattr(processor, "image_processor", None)
+    patch_size = getattr(image_processor, "patch_size", None)
+    merge_size = getattr(image_processor, "merge_size", None)
+    if not patch_size or not merge_size:
+        return imaging.DEFAULT_PATCH_FACTOR
+    return patch_size * merge_size
+
+
+def max_visual_tokens() -> int:
+    """
+    OCR_MAX_VISUAL_TOKENS, or the tokens of the old BASELINE_SIDE square
+    """
+    return ocrMaxVisualTokens or imaging.visual_tokens(
+        BASELINE_SIDE, BASELINE_SIDE, patch_factor()
+    )
+
+
+def token_budget(imageStats: dict) -> int:
+    """
+    New-token budget for a drawing from its estimated text layout: the
+    characters at CHARS_PER_TOKEN plus a newline per line, with slack
+    """
+    estimate = (
+        imageStats["text_characters"] / CHARS_PER_TOKEN + imageStats["text_lines"]
+    )
+    budget = math.ceil(estimate * BUDGET_SLACK) + ocrMinNewTokens
+    return min(max(budget, ocrMinNewTokens), ocrMaxNewTokens)
+
+
+@dataclass
+class OCRJob:
+    image: Image.Image
+    maxNewTokens: int
+    taskId: Optional[str] = None
+    # line-mode strips belong to a task (for cancellation) but are not
+    # streamed as its output
+    stream: bool = True
+
+
+@dataclass
+class OCROutput:
+    text: str
+    tokens: int
+    repetition: bool = False
+    cancelled: bool = False
+
+
+class OCRCancelled(Exception):
+    pass
+
+
+def ocr_prompt_text() -> str:
+    """
+    Chat template for one OCR request. The image comes first, as the model
+    has always been prompted, unless OCR_PROMPT_TEXT_FIRST moves the
+    instruction in front of it into the prefix every request shares.
+    """
+    content = [{"type": "image"}, {"type": "text", "text": OCR_PROMPT}]
+    if ocrPromptTextFirst:
+        content.reverse()
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": content},
+    ]
+    return processor.apply_chat_template(
+        messages, tokenize=False, add_generation_prompt=True
+    )
+
+
+def get_prefix_cache() -> PrefixCache:
+    global prefix_cache
+    if prefix_cache is None:
+        prefix_cache = PrefixCache(model, processor, ocr_prompt_text())
+    return prefix_cache
+
+
+def assisted_generate_kwargs() -> dict:
+    if ocrAssisted == "prompt_lookup":
+        return {"prompt_lookup_num_tokens": ocrPromptLookupTokens}
+    if ocrAssisted == "draft":
+        return {"assistant_model": draft_model}
+    if ocrAssisted != "off":
+        logger.warning(f"Unknown OCR_ASSISTED mode {ocrAssisted}, decoding plainly")
+    return {}
+
+
+def run_ocr_batch(jobs: list[OCRJob]) -> list[OCROutput]:
+    """
+    Runs one padded processor/generate call for a batch of OCR jobs, or one
+    call per job when assisted decoding is on
+    """
+    if processor is None:
+        logger.error("processor is not defined")
+        raise RuntimeError("processor is not defined")
+
+    if tokenizer is None:
+        logger.error("tokenizer is not defined")
+        raise RuntimeError("tokenizer is not defined")
+
+    if model is None:
+        logger.error("model is not defined")
+        raise RuntimeError("model is not defined")
+
+    assisted = assisted_generate_kwargs()
+    if assisted:
+        # assisted generation only verifies one sequence at a time, and runs
+        # its own prefill so it does not use the prefix cache
+        outputs = []
+        for job in jobs:
+            outputs.extend(generate_ocr([job], use_prefix_cache=False, **assisted))
+        return outputs
+
+    return generate_ocr(jobs, use_prefix_cache=ocrPrefixCache)
+
+
+def generate_ocr(
+    jobs: list[OCRJob], use_prefix_cache: bool, **generate_kwargs
+) -> list[OCROutput]:
+    text = ocr_prompt_text()
+    inputs = processor(
+        text=[text] * len(jobs),
+        images=[job.image for job in jobs],
+        padding=True,
+        return_tensors="pt",
+    )
+    inputs = inputs.to(device)
+
+    # partial lines go to each task's Redis stream while generation runs
+    streamer = RedisLineStreamer(
+        redis_client,
+        tokenizer,
+        [job.taskId if job.stream else None for job in jobs],
+        [job.maxNewTokens for job in jobs],
+    )
+
+    past_key_values = None
+    if use_prefix_cache:
+        try:
+            past_key_values = get_prefix_cache().prefill(inputs)
+        except Exception as e:
+            logger.warning(f"Prefix cache unavailable, prefilling in full: {e}")
+        metrics.incr(
+            redis_client,
+            "ocr_prefix_cache_hits" if past_key_values else "ocr_prefix_cache_misses",
+        )
+
+    prompt_length = inputs.input_ids.shape[1]
+    repetition = RepetitionStoppingCriteria(
+        prompt_length, len(jobs), tokenizer.eos_token_id
+    )
+    cancel = CancelStoppingCriteria(redis_client, [job.taskId for job in jobs])
+
+    with torch.no_grad():
+        output_ids = model.generate(
+            **inputs,
+            past_key_values=past_key_values,
+            max_new_tokens=max(job.maxNewTokens for job in jobs),
+            do_sample=False,
+            temperature=0.1,
+            pad_token_id=tokenizer.eos_token_id,
+            streamer=streamer,
+            stopping_criteria=[repetition, cancel],
+            **generate_kwargs,
+        )
+
+    # every row shares the padded prompt length, and each job only gets the
+    # tokens it asked for even when a longer job kept the batch generating
+    outputs = []
+    for row, job, period, cancelled in zip(
+        output_ids, jobs, repetition.periods, cancel.cancelled
+    ):
+        generated = row[prompt_length : prompt_length + job.maxNewTokens].tolist()
+        if tokenizer.eos_token_id in generated:
+            generated = generated[: generated.index(tokenizer.eos_token_id)]
+        if period:
+            generated = trim_repetition(generated, period)
+        text = processor.decode(
+            generated, skip_special_tokens=True, clean_up_tokenization_spaces=True
+        )
+        outputs.append(
+            OCROutput(
+                clean_output(text).strip(), len(generated), bool(period), cancelled
+            )
+        )
+    return outputs
+
+
+def record_batch_stats(batch_size: int, batch_latency: float):
+    metrics.observe(redis_client, "ocr_batch_size", batch_size)
+    metrics.observe(redis_client, "ocr_batch_latency", batch_latency)
+
+
+ocr_batcher = MicroBatcher(
+    run_ocr_batch,
+    max_batch_size=ocrBatchMaxSize,
+    max_wait_ms=ocrBatchMaxWaitMs,
+    on_batch=record_batch_stats,
+)
+
+
+def record_generation_stats(budget: int, output: OCROutput):
+    metrics.observe(redis_client, "ocr_token_budget", budget)
+    metrics.observe(redis_client, "ocr_tokens_generated", output.tokens)
+    metrics.observe(redis_client, "ocr_tokens_unused", budget - output.tokens)
+    if output.repetition:
+        logger.warning("Stopped OCR generation on a repetition loop")
+        metrics.incr(redis_client, "ocr_repetition_stops")
+
+
+def run_page_ocr(
+    blob,
+    maxNewTokens: Optional[int],
+    taskId: str,
+    drawing: Optional[strokes.Drawing] = None,
+) -> tuple[str, dict]:
+    """
+    OCRs the whole drawing in one generate call, streaming its lines. Stroke
+    drawings are rasterized straight at the size the bitmap would be scaled to.
+    """
+    blob.seek(0, 2)
+    blob_size = blob.tell()
+    blob.seek(0)
+
+    # the square resize this replaced, kept as the baseline we report token
+    # savings against
+    factor = patch_factor()
+    baseline_size = 1024 if blob_size > 1024 * 1024 else BASELINE_SIDE
+    baseline_tokens = imaging.visual_tokens(baseline_size, baseline_size, factor)
+    if drawing is not None:
+        image, imageStats = strokes.render_for_ocr(
+            drawing,
+            factor=factor,
+            min_tokens=ocrMinVisualTokens,
+            max_tokens=max_visual_tokens(),
+        )
+    else:
+        image, imageStats = imaging.preprocess_for_ocr(
+            Image.open(blob),
+            factor=factor,
+            min_tokens=ocrMinVisualTokens,
+            max_tokens=max_visual_tokens(),
+            binarize=ocrBinarize,
+            denoise=ocrDenoise,
+        )
+    tokensSaved = baseline_tokens - imageStats["visual_tokens"]
+    metrics.observe(redis_client, "ocr_visual_tokens", imageStats["visual_tokens"])
+    metrics.observe(redis_client, "ocr_visual_tokens_saved", tokensSaved)
+    logger.info(
+        f"Preprocessed to {imageStats['width']}x{imageStats['height']}, "
+        f"{imageStats['visual_tokens']} visual tokens ({tokensSaved} saved)"
+    )
+
+    budget = maxNewTokens or token_budget(imageStats)
+    batch_result = ocr_batcher.submit(OCRJob(image, budget, taskId)).result(
+        timeout=celeryApp.conf.task_soft_time_limit
+    )
+    output = batch_result.output
+    if output.cancelled:
+        raise OCRCancelled()
+    record_generation_stats(budget, output)
+
+    return output.text, {
+        "batch_size": batch_result.batch_size,
+        "batch_latency": batch_result.batch_latency,
+        "visual_tokens": imageStats["visual_tokens"],
+        "visual_tokens_saved": tokensSaved,
+        "token_budget": budget,
+        "tokens_generated": output.tokens,
+    }
+
+
+def indent_levels(indents: list[int], line_height: float) -> list[int]:
+    """
+    Maps each line's indentation in pixels to a nesting level. Handwritten
+    indents drift, so indents less than a character apart share a level.
+    """
+    tolerance = imaging.CHAR_ASPECT * line_height
+    levels: list[int] = []
+    for indent in sorted(set(indents)):
+        if not levels or indent - levels[-1] > tolerance:
+            levels.append(indent)
+    return [
+        max(i for i, level in enumerate(levels) if indent >= level)
+        for indent in indents
+    ]
+
+
+def run_line_ocr(
+    blob, taskId: str, drawing: Optional[strokes.Drawing] = None
+) -> Optional[tuple[str, dict]]:
+    """
+    Splits the drawing into text lines, answers unchanged lines from the line
+    cache and OCRs only the rest, as one set of batched jobs. Returns None
+    for drawings with fewer than two lines, which are OCRed as a page.
+    """
+    if drawing is not None:
+        page = strokes.rasterize_ink(
+            drawing, strokes.canvas_scale(drawing, strokes.REFERENCE_MAX_SIDE)
+        )
+    else:
+        blob.seek(0)
+        page = Image.open(blob)
+    strips = imaging.segment_lines(page) if page is not None else []
+    if len(strips) < 2:
+        return None
+
+    keys = [ocr_cache.line_cache_key(strip["mask"]) for strip in strips]
+    texts = ocr_cache.lookup_lines(redis_client, keys)
+
+    factor = patch_factor()
+    pending = {}
+    visualTokens = budget = 0
+    for row, (strip, text) in enumerate(zip(strips, texts)):
+        if text is not None:
+            continue
+        image, imageStats = imaging.preprocess_for_ocr(
+            strip["image"],
+            factor=factor,
+            min_tokens=ocrMinVisualTokens,
+            max_tokens=max_visual_tokens(),
+            binarize=ocrBinarize,
+            denoise=ocrDenoise,
+        )
+        lineBudget = token_budget(imageStats)
+        visualTokens += imageStats["visual_tokens"]
+        budget += lineBudget
+        job = OCRJob(image, lineBudget, taskId, stream=False)
+        pending[row] = (ocr_batcher.submit(job), lineBudget)
+
+    batchSize, batchLatency, generated, fresh = 0, 0.0, 0, {}
+    for row, (future, lineBudget) in pending.items():
+        batch_result = future.result(timeout=celeryApp.conf.task_soft_time_limit)
+        output = batch_result.output
+        if output.cancelled:
+            raise OCRCancelled()
+        record_generation_stats(lineBudget, output)
+        batchSize = max(batchSize, batch_result.batch_size)
+        batchLatency = max(batchLatency, batch_result.batch_latency)
+        generated += output.tokens
+        texts[row] = fresh[keys[row]] = output.text
+    ocr_cache.store_lines(redis_client, fresh)
+
+    logger.info(f"Line OCR ran {len(pending)} of {len(strips)} lines")
+    levels = indent_levels(
+        [strip["indent"] for strip in strips], strips[0]["line_height"]
+    )
+    program = "\n".join(
+        " " * (INDENT_WIDTH * level) + text for level, text in zip(levels, texts)
+    )
+    return program, {
+        "batch_size": batchSize,
+        "batch_latency": batchLatency,
+        "visual_tokens": visualTokens,
+        "token_budget": budget,
+        "tokens_generated": generated,
+        "lines": len(strips),
+        "lines_cached": len(strips) - len(pending),
+    }
+
+
+# OCR function for scanning images using Nanonets ML model
+@celeryApp.task(bind=True, name=PROCESS_OCR_TASK)
+def process_ocr_task(
+    self,
+    blobRef: str,
+    maxNewTokens: Optional[int] = None,
+    cacheKeyData: Optional[dict] = None,
+    inputKind: str = "image",
+):
+    """
+    Celery Task for OCR Processing. The image (or with inputKind "strokes",
+    the serialized strokes) is read from the blob store, the message only
+    carries its reference. Without maxNewTokens the budget is estimated from
+    the drawing.
+    """
+    blob = None
+    try:
+        start_time = time.time()
+
+        blob = blob_store.open_blob(redis_client, blobRef)
+
+        # keyed on the upload's bytes, with near-duplicates of its ink only
+        # when OCR_HASH_MAX_DISTANCE opts in. Checked before any state update
+        # so a hit costs no extra backend writes.
+        if cacheKeyData:
+            # the API only computes the exact key, the ink is hashed here
+            cacheKey = ocr_cache.OCRCacheKey.load(cacheKeyData)
+            if cacheKey.phash is None:
+                cacheKey.phash = ocr_cache.perceptual_hash(blob.read(), inputKind)
+        else:
+            cacheKey = ocr_cache.compute_cache_key(blob.read(), inputKind)
+        cachedResult = ocr_cache.lookup(redis_client, cacheKey)
+        if cachedResult:
+            logger.info("Cache hit for OCR request")
+            singleflight.release(redis_client, cacheKey.key, self.request.id)
+            return {
+                "status": "SUCCESS",
+                "result": cachedResult,
+                "execution_time": 0.0,
+                "cached": True,
+            }
+
+        self.update_state(state="PROGRESS", meta={"status": "Processing image..."})
+
+        # only one task per cache key runs the model, the rest wait for it
+        while not singleflight.acquire(redis_client, cacheKey.key, self.request.id):
+            self.update_state(
+                state="PROGRESS", meta={"status": "Waiting for identical request..."}
+            )
+            coalescedResult = singleflight.wait(
+                redis_client, cacheKey.key, self.request.id
+            )
+            if coalescedResult is not None:
+                logger.info("Coalesced OCR request with an in-flight one")
+                metrics.incr(redis_client, "ocr_singleflight_coalesced")
+                return {
+                    "status": "SUCCESS",
+                    "result": coalescedResult,
+                    "execution_time": time.time() - start_time,
+                    "cached": True,
+                }
+
+        try:
+            self.update_state(
+                state="PROGRESS", meta={"status": "Waiting for batch..."}
+            )
+            drawing = None
+            if inputKind == "strokes":
+                blob.seek(0)
+                drawing = strokes.parse(blob.read())
+            if cancellation.is_cancelled(redis_client, self.request.id):
+                raise OCRCancelled()
+            ocrResult = None
+            if ocrLineMode:
+                ocrResult = run_line_ocr(blob, self.request.id, drawing)
+            if ocrResult is None:
+                ocrResult = run_page_ocr(
+                    blob, maxNewTokens, self.request.id, drawing
+                )
+            clean_result, ocrStats = ocrResult
+
+            ocr_cache.store(redis_client, cacheKey, clean_result)
+        finally:
+            singleflight.release(redis_client, cacheKey.key, self.request.id)
+
+        processing_time = time.time() - start_time
+        logger.info(
+            f"OCR completed in {processing_time:.2f}s (batch of {ocrStats['batch_size']})"
+        )
+
+        return {
+            "status": "SUCCESS",
+            "result": clean_result,
+            "execution_time": processing_time,
+            "cached": False,
+            **ocrStats,
+        }
+    except OCRCancelled:
+        logger.info(f"OCR task {self.request.id} was cancelled")
+        metrics.incr(redis_client, "ocr_cancelled")
+        return {"status": "FAILURE", "error": "Task was cancelled", "cancelled": True}
+    except Exception as e:
+        logger.error(f"OCR processing failed: {e}")
+        return {"status": "FAILURE", "error": str(e)}
+    finally:
+        if blob is not None:
+            blob.close()
+        blob_store.delete(redis_client, blobRef)
+
+
+@celeryApp.task(bind=True, name=EXECUTE_CODE_TASK)
+def execute_code_task(self, code: str, language: str):
+    try:
+        self.update_state(
+            state="PROGRESS", meta={"status": "Queuing code execution..."}
+        )
+
+        language = language.lower()
+
+        message = {"code": code, "language": language, "task_id": self.request.id}
+
+        if (
+            not executionQueuePythonURL
+            or not executionQueueJavaScriptURL
+            or not executionQueueJavaURL
+        ):
+            logger.error(
+                "EXECUTION URLs Cannot be None, there is a problem with env vars"
+            )
+            return {
+                "status": "FAILURE",
+                "error": "EXECUTION URLs Cannot be None, there is a problem with env vars",
+            }
+
+        def sendMessage(url: str, message: dict[str, str]):
+            sqs.send_message(
+                QueueUrl=url,
+                MessageBody=json.dumps(message),
+            )
+
+        match language:
+            case "python":
+                sendMessage(executionQueuePythonURL, message)
+            case "javascript":
+                sendMessage(executionQueueJavaScriptURL, message)
+            case "java":
+                sendMessage(executionQueueJavaURL, message)
+            case _:
+                logger.error(f"Failed to queue execution: Invalid language passed")
+                return {"status": "FAILURE", "error": "Invalid Language Passed"}
+
+        return {
+            "status": "SUCCESS",
+            "task_id": message["task_id"],
+            "queued_at": time.time(),
+        }
+
+    except ClientError as e:
+        logger.error(f"Failed to queue execution: {e}")
+        return {"status": "FAILURE", "error": str(e)}